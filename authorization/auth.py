@@ -1,13 +1,17 @@
 import os
-from fastapi import APIRouter, Response, HTTPException, Depends, Form
+from fastapi import APIRouter, Request, Response, HTTPException, Depends, Form
 from authx import AuthX, AuthXConfig
+from authx.exceptions import CSRFError
 from dotenv import load_dotenv
 from sqlalchemy import select
 import jwt
+from hmac import compare_digest
 from typing import Optional, Dict, Any
 
 from schemas.schemas import UserModel, UserAddSchema, LoginSchema
 from database.database import SessionDep
+from authorization.cache import request_token_cache, token_cache, user_cache
+from authorization.passwords import password_hasher
 
 
 
@@ -23,8 +27,14 @@ security = AuthX(config=config)
 
 def verify_jwt_token(token: str) -> Optional[Dict[str, Any]]:
     """
-    Verify and decode JWT token manually
+    Verify and decode JWT token manually.
+
+    Returns the claims as a dict; access_token_required keeps its authx
+    payloads in a separate cache.
     """
+    payload = token_cache.get_payload(token)
+    if payload is not None:
+        return payload
     try:
         # Decode the token using the same secret and algorithm
         payload = jwt.decode(
@@ -32,6 +42,7 @@ def verify_jwt_token(token: str) -> Optional[Dict[str, Any]]:
             os.getenv("JWT_SECRET_KEY"), 
             algorithms=["HS256"]
         )
+        token_cache.put_payload(token, payload, payload.get("exp"))
         return payload
     except jwt.ExpiredSignatureError:
         return None
@@ -40,11 +51,35 @@ def verify_jwt_token(token: str) -> Optional[Dict[str, Any]]:
     except Exception:
         return None
 
+async def authenticate_user(session, login: str, password: str) -> Optional[UserModel]:
+    """
+    Check credentials without blocking the event loop.
+
+    Plaintext or weaker hashes are upgraded to the configured hash on the
+    first successful login.
+    """
+    query = select(UserModel).where(UserModel.login == login)
+    result = await session.execute(query)
+    user = result.scalar_one_or_none()
+    if user is None:
+        await password_hasher.verify_missing(password)
+        return None
+    if not await password_hasher.verify(password, user.password):
+        return None
+    
+    if password_hasher.needs_rehash(user.password):
+        try:
+            user.password = await password_hasher.hash(password)
+            await session.commit()
+        except Exception:
+            # The login itself succeeded; retry the upgrade next time
+            await session.rollback()
+    return user
+
+
 @router.post("/login")
 async def login(login: str = Form(), password: str = Form(), response: Response = None, session: SessionDep = None):
-    query = select(UserModel).where(UserModel.login == login).where(UserModel.password == password)
-    result = await session.execute(query)
-    data = result.scalar_one_or_none()
+    data = await authenticate_user(session, login, password)
     if data:
         is_admin = int(data.is_admin)
         is_adm = 1 if is_admin else 0
@@ -77,9 +112,7 @@ async def login(login: str = Form(), password: str = Form(), response: Response
 @router.post("/login_json")
 async def login_json(login_data: LoginSchema, response: Response = None, session: SessionDep = None):
     """Login endpoint with email validation using Pydantic schema"""
-    query = select(UserModel).where(UserModel.login == login_data.login).where(UserModel.password == login_data.password)
-    result = await session.execute(query)
-    data = result.scalar_one_or_none()
+    data = await authenticate_user(session, login_data.login, login_data.password)
     if data:
         is_admin = int(data.is_admin)
         is_adm = 1 if is_admin else 0
@@ -109,7 +142,42 @@ async def login_json(login_data: LoginSchema, response: Response = None, session
     raise HTTPException(status_code=404, detail="Неверный логин или пароль")
 
 
-async def admin_required(user = Depends(security.access_token_required)):
+async def access_token_required(request: Request):
+    """
+    Cached equivalent of security.access_token_required.
+
+    The decoded claims of a verified token are reused until the token
+    expires, so repeat requests skip the HMAC check. The CSRF check belongs
+    to the request rather than the token and runs every time. Being a single
+    function, FastAPI also resolves it once per request even when
+    admin_required needs it too.
+    """
+    request_token = await security.get_access_token_from_request(request)
+    if security.is_token_in_blocklist(request_token.token):
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    
+    payload = request_token_cache.get_payload(request_token.token)
+    if payload is None:
+        payload = security.verify_token(request_token, verify_csrf=False)
+        try:
+            exp = payload.expiry_datetime.timestamp()
+        except Exception:
+            exp = None
+        request_token_cache.put_payload(request_token.token, payload, exp)
+    
+    # Same condition and double-submit check as authx applies itself
+    if (config.JWT_COOKIE_CSRF_PROTECT and request.method.upper() in config.JWT_CSRF_METHODS
+            and request_token.location == "cookies"):
+        if request_token.csrf is None:
+            raise CSRFError("Missing CSRF token in cookies")
+        if payload.csrf is None:
+            raise CSRFError("Cookies token missing CSRF claim")
+        if not compare_digest(request_token.csrf, payload.csrf):
+            raise CSRFError("CSRF token mismatch")
+    return payload
+
+
+async def admin_required(user = Depends(access_token_required)):
     try:
         is_admin = user.get("is_admin")
     except AttributeError:
@@ -139,13 +207,14 @@ async def create_account(user: UserAddSchema, session: SessionDep):
             patronymic=user.patronymic,
             login=user.login,
             is_admin=user.is_admin,
-            password=user.password,
+            password=await password_hasher.hash(user.password),
             address=user.address,
             flat=user.flat
         )
         session.add(new_user)
         await session.commit()
         await session.refresh(new_user)
+        user_cache.invalidate(new_user.login)
     except Exception as e:
         await session.rollback()
         raise HTTPException(status_code=500, detail="Ошибка при создании аккаунта")
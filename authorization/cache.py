@@ -0,0 +1,94 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+AUTH_TOKEN_CACHE_MAX_TTL = float(os.getenv("AUTH_TOKEN_CACHE_MAX_TTL", "300"))
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "60"))
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire at a per-entry wall-clock time"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any, expires_at: float):
+        if expires_at <= time.time():
+            return
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class TokenCache(TTLCache):
+    """Verified JWT payloads keyed by token digest.
+
+    An entry never outlives the token's own exp claim, and is additionally
+    capped at max_ttl so a revoked secret stops being honoured quickly.
+    Failed verifications are not cached.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_ttl: float = AUTH_TOKEN_CACHE_MAX_TTL):
+        super().__init__(max_entries)
+        self.max_ttl = max_ttl
+
+    @staticmethod
+    def digest(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get_payload(self, token: str) -> Optional[Any]:
+        return self.get(self.digest(token))
+
+    def put_payload(self, token: str, payload: Any, exp: Optional[float]):
+        expires_at = time.time() + self.max_ttl
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        self.put(self.digest(token), payload, expires_at)
+
+
+class UserCache(TTLCache):
+    """Authenticated user profiles keyed by login, refreshed after ttl seconds"""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = AUTH_USER_CACHE_TTL):
+        super().__init__(max_entries)
+        self.ttl = ttl
+
+    def put_user(self, login: str, user_data: dict):
+        self.put(login, user_data, time.time() + self.ttl)
+
+
+# Global cache instances. Tokens verified by authx for REST requests are
+# cached apart from those decoded for WebSocket handshakes: the two checks
+# differ and so do the payload types they return.
+token_cache = TokenCache()
+request_token_cache = TokenCache()
+user_cache = UserCache()
@@ -0,0 +1,140 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+PASSWORD_HASH_ALGORITHM = "pbkdf2_sha256"
+PASSWORD_HASH_ITERATIONS = int(os.getenv("PASSWORD_HASH_ITERATIONS", "600000"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+PASSWORD_HASH_MAX_CONCURRENCY = int(os.getenv("PASSWORD_HASH_MAX_CONCURRENCY", str(PASSWORD_HASH_WORKERS * 4)))
+# "thread" works because hashlib releases the GIL while deriving keys;
+# "process" isolates hashing completely at the cost of pickling per call.
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+# Bulk imports hash plaintext passwords on their own small pool, so an import
+# can use at most this many cores and never queues ahead of logins
+PASSWORD_IMPORT_HASH_WORKERS = int(os.getenv("PASSWORD_IMPORT_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+
+def hash_password_sync(password: str, iterations: int = PASSWORD_HASH_ITERATIONS) -> str:
+    """Hash a password as pbkdf2_sha256$<iterations>$<salt>$<hash>"""
+    salt = secrets.token_bytes(16)
+    derived = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return f"{PASSWORD_HASH_ALGORITHM}${iterations}${_b64encode(salt)}${_b64encode(derived)}"
+
+
+def is_password_hash(stored: str) -> bool:
+    """Check whether a stored password is in our hash format"""
+    return stored.startswith(PASSWORD_HASH_ALGORITHM + "$") and stored.count("$") == 3
+
+
+def verify_password_sync(password: str, stored: str) -> bool:
+    """Check a password against a stored hash, or a legacy plaintext value"""
+    if not is_password_hash(stored):
+        return hmac.compare_digest(password.encode(), stored.encode())
+    try:
+        _, iterations, salt, expected = stored.split("$")
+        derived = hashlib.pbkdf2_hmac("sha256", password.encode(), _b64decode(salt), int(iterations))
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(derived, _b64decode(expected))
+
+
+def needs_rehash(stored: str, iterations: int = PASSWORD_HASH_ITERATIONS) -> bool:
+    """Plaintext and hashes weaker than the configured cost need rehashing"""
+    if not is_password_hash(stored):
+        return True
+    try:
+        return int(stored.split("$")[1]) < iterations
+    except ValueError:
+        return True
+
+
+class PasswordHasher:
+    """Runs password hashing off the event loop.
+
+    Hash and verify calls go to a worker pool, and at most max_concurrency
+    are in flight at once; further callers wait on the semaphore instead of
+    piling work into the pool queue.
+    """
+
+    def __init__(
+        self,
+        iterations: int = PASSWORD_HASH_ITERATIONS,
+        workers: int = PASSWORD_HASH_WORKERS,
+        max_concurrency: int = PASSWORD_HASH_MAX_CONCURRENCY,
+        executor_kind: str = PASSWORD_HASH_EXECUTOR,
+        name: str = "password-hash"
+    ):
+        self.iterations = iterations
+        self.workers = workers
+        self.executor_kind = executor_kind
+        self.name = name
+        self._executor: Optional[Executor] = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Same format and cost as a real hash; no password derives to it
+        self._dummy_hash = (
+            f"{PASSWORD_HASH_ALGORITHM}${iterations}$"
+            f"{_b64encode(secrets.token_bytes(16))}${_b64encode(secrets.token_bytes(32))}"
+        )
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        return self._executor
+
+    async def _run(self, func, *args):
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+
+    async def hash(self, password: str) -> str:
+        """Hash a password with the configured cost"""
+        return await self._run(hash_password_sync, password, self.iterations)
+
+    async def verify(self, password: str, stored: str) -> bool:
+        """Verify a password against a stored hash or legacy plaintext"""
+        if not is_password_hash(stored):
+            # Plaintext comparison is cheap; no need to queue for a worker
+            return verify_password_sync(password, stored)
+        return await self._run(verify_password_sync, password, stored)
+
+    async def verify_missing(self, password: str) -> bool:
+        """Verify against a dummy hash for a login that does not exist.
+
+        Always False, but takes as long as verify() on a real hash, so
+        unknown logins cannot be told apart by response time.
+        """
+        await self._run(verify_password_sync, password, self._dummy_hash)
+        return False
+
+    def needs_rehash(self, stored: str) -> bool:
+        return needs_rehash(stored, self.iterations)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+# Global password hasher instances: logins and account changes, and bulk imports
+password_hasher = PasswordHasher()
+import_password_hasher = PasswordHasher(
+    workers=PASSWORD_IMPORT_HASH_WORKERS,
+    max_concurrency=PASSWORD_IMPORT_HASH_WORKERS,
+    name="import-password-hash"
+)
@@ -0,0 +1,169 @@
+"""
+Shared setup for the benchmark scripts.
+
+prepare_environment() must run before anything from the application is
+imported: the engine, cold storage and admission limits read their
+configuration from the environment at import time.
+"""
+import asyncio
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def prepare_environment(workdir: Optional[str] = None) -> str:
+    """Point the app at a fresh SQLite file in a temporary directory"""
+    workdir = workdir or tempfile.mkdtemp(prefix="chat-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["COLD_STORAGE_DIR"] = os.path.join(workdir, "cold_storage")
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret")
+    # Every simulated tenant connects from 127.0.0.1
+    os.environ.setdefault("WS_CONNECT_RATE_PER_IP", "100000")
+    os.environ.setdefault("WS_CONNECT_BURST_PER_IP", "100000")
+    os.environ.setdefault("QUERY_SLOW_MS", "1000")
+    # Room for every concurrent handshake (WS_HANDSHAKE_CONCURRENCY) plus frames
+    os.environ.setdefault("DB_POOL_SIZE", "32")
+    os.environ.setdefault("DB_MAX_OVERFLOW", "32")
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    # StaticFiles resolves "static" against the working directory
+    os.chdir(ROOT)
+    return workdir
+
+
+def tenant_login(index: int) -> str:
+    return f"tenant{index}@bench.local"
+
+
+def admin_login(index: int) -> str:
+    return f"admin{index}@bench.local"
+
+
+async def seed_users(tenants: int, admins: int, addresses: int = 10):
+    """Create tables and insert tenant and admin users in bulk"""
+    from sqlalchemy import insert
+
+    from authorization.passwords import hash_password_sync
+    from database.database import init_models, new_async_session
+    from schemas.schemas import UserModel
+
+    await init_models()
+    # Nobody logs in with a password here; one cheap hash serves everyone
+    password = hash_password_sync("bench", iterations=1000)
+    rows = [
+        {
+            "first_name": "Tenant", "last_name": str(i), "patronymic": "",
+            "login": tenant_login(i), "password": password,
+            "address": f"Address {i % addresses}", "flat": i, "is_admin": False,
+        }
+        for i in range(tenants)
+    ] + [
+        {
+            "first_name": "Admin", "last_name": str(i), "patronymic": "",
+            "login": admin_login(i), "password": password,
+            "address": "Office", "flat": 0, "is_admin": True,
+        }
+        for i in range(admins)
+    ]
+    async with new_async_session() as session:
+        await session.execute(insert(UserModel), rows)
+        await session.commit()
+
+
+async def start_server(app):
+    """Serve the app with uvicorn on a free local port; returns (server, task, ws url)"""
+    import uvicorn
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning", ws="websockets", lifespan="on")
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, task, f"ws://127.0.0.1:{port}"
+
+
+async def stop_server(server, task):
+    from database.database import engine
+
+    server.should_exit = True
+    await task
+    # Pooled aiosqlite connections run on threads that keep the process alive
+    await engine.dispose()
+
+
+def make_token(login: str, is_admin: bool) -> str:
+    from authorization.auth import security
+
+    return security.create_access_token(uid=login, data={"login": login, "is_admin": 1 if is_admin else 0})
+
+
+def summarize(values: List[float], scale: float = 1000.0) -> Dict[str, float]:
+    """Count, mean and nearest-rank percentiles; seconds become ms by default"""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        return round(ordered[max(0, math.ceil(p * len(ordered) / 100) - 1)] * scale, 3)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered) * scale, 3),
+        "p50": rank(50),
+        "p90": rank(90),
+        "p99": rank(99),
+        "max": round(ordered[-1] * scale, 3),
+    }
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes a task that sleeps interval seconds"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+def environment_info() -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def emit(result: dict, output: Optional[str] = None):
+    """Print the result as JSON and optionally write it to a file"""
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if output:
+        with open(output, "w", encoding="utf-8") as result_file:
+            result_file.write(text + "\n")
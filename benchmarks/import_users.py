@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Bulk user import benchmark, against the app in-process.
+
+Streams a CSV of --rows residents to /ops/import_users and reports how long
+the import took, while a client logs in with a full-cost password hash in a
+loop to show whether logins are held up by the import. Passwords are
+pre-hashed (the documented fast path) except for the first --plaintext rows,
+which the server hashes at full cost on its import pool.
+
+Exits with status 1 if the import takes longer than --target-seconds or any
+row fails.
+
+    python -m benchmarks.import_users --rows 10000 --output import.json
+"""
+import argparse
+import asyncio
+import contextlib
+import sys
+import time
+from typing import List
+
+from benchmarks.common import (
+    admin_login, emit, environment_info, make_token, prepare_environment,
+    seed_users, summarize
+)
+
+LOGIN_USER = "login-probe@bench.local"
+LOGIN_PASSWORD = "probe password"
+HEADER = "first_name,last_name,patronymic,login,password,address,flat,is_admin\n"
+
+
+def build_upload(rows: int, plaintext: int, prehash_iterations: int) -> bytes:
+    from authorization.passwords import hash_password_sync
+
+    # One pre-hashed value serves every row, as a migration export would
+    # carry each user's existing hash
+    prehashed = hash_password_sync("resident", iterations=prehash_iterations)
+    lines = [HEADER]
+    for i in range(rows):
+        password = "resident" if i < plaintext else prehashed
+        lines.append(f'Resident,{i},,resident{i}@import.example.com,{password},"Building {i // 200}",{i % 200},false\n')
+    return "".join(lines).encode()
+
+
+async def seed_login_probe():
+    from authorization.passwords import hash_password_sync
+    from database.database import new_async_session
+    from schemas.schemas import UserModel
+
+    async with new_async_session() as session:
+        session.add(UserModel(
+            first_name="Login", last_name="Probe", patronymic="", login=LOGIN_USER,
+            password=hash_password_sync(LOGIN_PASSWORD), address="Office", flat=0, is_admin=False
+        ))
+        await session.commit()
+
+
+async def probe_logins(client, stop: asyncio.Event, latencies: List[float]):
+    """Log in back to back until stopped"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.post("/auth/login", data={"login": LOGIN_USER, "password": LOGIN_PASSWORD})
+        if response.status_code != 200:
+            raise RuntimeError(f"Login probe failed: {response.status_code}")
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0.05)
+
+
+async def run(args) -> dict:
+    import httpx
+
+    from authorization.passwords import import_password_hasher, password_hasher
+    from database.database import engine
+    from main import app
+
+    await seed_users(0, 1)
+    await seed_login_probe()
+    body = build_upload(args.rows, args.plaintext, args.prehash_iterations)
+
+    async def upload():
+        for start in range(0, len(body), 64 * 1024):
+            yield body[start:start + 64 * 1024]
+
+    headers = {"Authorization": f"Bearer {make_token(admin_login(0), True)}", "Content-Type": "text/csv"}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        idle_latencies: List[float] = []
+        idle_stop = asyncio.Event()
+        idle_probe = asyncio.create_task(probe_logins(client, idle_stop, idle_latencies))
+        await asyncio.sleep(args.idle_probe_seconds)
+        idle_stop.set()
+        await idle_probe
+
+        login_latencies: List[float] = []
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_logins(client, stop, login_latencies))
+        started = time.perf_counter()
+        response = await client.post("/ops/import_users", content=upload(), headers=headers)
+        seconds = time.perf_counter() - started
+        stop.set()
+        await probe
+
+    password_hasher.shutdown()
+    import_password_hasher.shutdown()
+    await engine.dispose()
+
+    report = response.json()
+    return {
+        "benchmark": "import_users",
+        "environment": environment_info(),
+        "config": vars(args),
+        "status_code": response.status_code,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(args.rows / seconds, 1),
+        "inserted": report.get("inserted"),
+        "failed": report.get("failed"),
+        "first_errors": report.get("errors", [])[:3],
+        "target_met": response.status_code == 200 and report.get("failed") == 0 and seconds <= args.target_seconds,
+        "login_ms_idle": summarize(idle_latencies),
+        "login_ms_during_import": summarize(login_latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--plaintext", type=int, default=0, help="Rows sent with a plaintext password")
+    parser.add_argument("--prehash-iterations", type=int, default=600000, help="Cost of the pre-hashed passwords")
+    parser.add_argument("--target-seconds", type=float, default=10.0)
+    parser.add_argument("--idle-probe-seconds", type=float, default=2.0, help="Login probing before the import")
+    parser.add_argument("--workdir", help="Directory for the temporary database (default: a new temp dir)")
+    parser.add_argument("--output", help="Also write the JSON result to this file")
+    args = parser.parse_args()
+
+    prepare_environment(args.workdir)
+    # The app prints debug output; keep stdout for the JSON result
+    with contextlib.redirect_stdout(sys.stderr):
+        result = asyncio.run(run(args))
+    emit(result, args.output)
+    if not result["target_met"]:
+        print(f"Import missed the target: {result['seconds']} s, {result['failed']} failed rows", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+WebSocket load test against the app running in-process.
+
+Starts uvicorn on a free local port with a temporary SQLite database, seeds
+tenants and admins, connects them all and lets them send a weighted mix of
+frames for a fixed time. Reports connect times, throughput, end-to-end
+latency per frame type (send to receipt, measured with one clock because
+clients and server share the process), event-loop lag and the server's
+own trace percentiles as JSON.
+
+Clients run on the same event loop as the server, so absolute numbers
+include client overhead; compare runs made with the same options. If any
+client fails to connect the run stops there, reports only the connect
+phase and exits with status 1.
+
+    python -m benchmarks.load --tenants 2000 --admins 3 --duration 30 --output load.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from benchmarks.common import (
+    LoopLagMonitor, admin_login, emit, environment_info, make_token,
+    prepare_environment, seed_users, start_server, stop_server, summarize,
+    tenant_login
+)
+
+# Frames that carry a benchmark send time and what the receiver sees
+TIMED_FRAMES = {"user_message": "user_to_admin", "admin_message": "admin_to_user", "broadcast": "broadcast"}
+BENCH_PREFIX = "bench "
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """"a=0.8,b=0.2" -> {"a": 0.8, "b": 0.2}"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+class BenchClient:
+    def __init__(self, login: str, is_admin: bool, stats: "LoadStats"):
+        self.login = login
+        self.is_admin = is_admin
+        self.stats = stats
+        self.websocket = None
+        self.pending_requests: List[float] = []
+
+    async def connect(self, url: str, attempts: int):
+        """Connect like a real client: wait for welcome, honour retry-later closes"""
+        import websockets
+
+        from websocket.admission import RETRY_LATER_CLOSE_CODE
+
+        started = time.perf_counter()
+        for _ in range(attempts):
+            websocket = await websockets.connect(
+                f"{url}/ws/{self.login}?token={make_token(self.login, self.is_admin)}",
+                ping_interval=None,
+                max_size=None
+            )
+            try:
+                while json.loads(await websocket.recv()).get("type") != "welcome":
+                    pass
+            except websockets.ConnectionClosed as closed:
+                if closed.rcvd is None or closed.rcvd.code != RETRY_LATER_CLOSE_CODE:
+                    raise
+                self.stats.connect_retries += 1
+                await asyncio.sleep(json.loads(closed.rcvd.reason).get("retry_after_ms", 1000) / 1000)
+                continue
+            self.websocket = websocket
+            self.stats.connect_times.append(time.perf_counter() - started)
+            return
+        raise RuntimeError(f"{self.login} was not admitted after {attempts} attempts")
+
+    async def send(self, frame: dict):
+        await self.websocket.send(json.dumps(frame))
+        self.stats.sent[frame["type"]] += 1
+
+    async def read(self):
+        """Record the latency of every timed frame and request response"""
+        try:
+            async for raw in self.websocket:
+                received = time.perf_counter()
+                data = json.loads(raw)
+                frame_type = data.get("type")
+                if frame_type in TIMED_FRAMES:
+                    content = data.get("message", "")
+                    if content.startswith(BENCH_PREFIX):
+                        sent_at = float(content[len(BENCH_PREFIX):])
+                        self.stats.latencies[TIMED_FRAMES[frame_type]].append(received - sent_at)
+                elif frame_type in ("conversation_history", "conversations_list") and self.pending_requests:
+                    self.stats.latencies[frame_type].append(received - self.pending_requests.pop(0))
+                elif frame_type == "error":
+                    self.stats.errors[data.get("message", "error")] += 1
+        except Exception:
+            # Connection closed by the end of the run or by the server
+            pass
+
+
+class LoadStats:
+    def __init__(self):
+        self.connect_times: List[float] = []
+        self.connect_failures = 0
+        self.connect_retries = 0
+        self.sent: Dict[str, int] = defaultdict(int)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+
+async def drive(client: BenchClient, rate: float, mix: Dict[str, float], deadline: float, peers: List[str]):
+    """Send frames from the mix as a Poisson process at rate frames per second"""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    # Spread the first frames out instead of starting in lockstep
+    await asyncio.sleep(random.uniform(0, min(1 / rate, max(0.0, deadline - time.perf_counter()))))
+    while time.perf_counter() < deadline:
+        frame_type = random.choices(names, weights)[0]
+        stamp = f"{BENCH_PREFIX}{time.perf_counter():.6f}"
+        try:
+            if frame_type == "user_to_admin":
+                await client.send({"type": "user_to_admin", "message": stamp})
+            elif frame_type == "admin_to_user":
+                await client.send({"type": "admin_to_user", "to_user": random.choice(peers), "message": stamp})
+            elif frame_type == "broadcast":
+                await client.send({"type": "broadcast", "message": stamp})
+            elif frame_type == "get_conversation_history":
+                # Tenants may only ask for their conversation with "admin"
+                with_user = random.choice(peers) if client.is_admin else "admin"
+                client.pending_requests.append(time.perf_counter())
+                await client.send({"type": "get_conversation_history", "with_user": with_user, "limit": 20})
+            elif frame_type == "get_conversations":
+                client.pending_requests.append(time.perf_counter())
+                await client.send({"type": "get_conversations"})
+            else:
+                await client.send({"type": frame_type})
+        except Exception:
+            return
+        # A slow client's next gap can be many seconds; don't sleep past the end
+        await asyncio.sleep(min(random.expovariate(rate), max(0.0, deadline - time.perf_counter())))
+
+
+def connect_summary(stats: LoadStats, connected: List[BenchClient], seconds: float) -> dict:
+    return {
+        "connected": len(connected),
+        "failed": stats.connect_failures,
+        "retries": stats.connect_retries,
+        "seconds": round(seconds, 3),
+        "latency_ms": summarize(stats.connect_times),
+    }
+
+
+async def run(args) -> dict:
+    from main import app
+    from websocket.tracing import tracer
+
+    await seed_users(args.tenants, args.admins)
+
+    server, server_task, url = await start_server(app)
+
+    stats = LoadStats()
+    lag = LoopLagMonitor()
+    lag.start()
+
+    admins = [BenchClient(admin_login(i), True, stats) for i in range(args.admins)]
+    tenants = [BenchClient(tenant_login(i), False, stats) for i in range(args.tenants)]
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+    async def connect(client: BenchClient):
+        async with semaphore:
+            try:
+                await client.connect(url, args.connect_attempts)
+            except Exception:
+                stats.connect_failures += 1
+
+    connect_started = time.perf_counter()
+    await asyncio.gather(*(connect(client) for client in admins + tenants))
+    connect_seconds = time.perf_counter() - connect_started
+    connected = [client for client in admins + tenants if client.websocket is not None]
+
+    if stats.connect_failures:
+        # Throughput from a partial fleet is not comparable with anything
+        await asyncio.gather(*(client.websocket.close() for client in connected), return_exceptions=True)
+        await lag.stop()
+        await stop_server(server, server_task)
+        return {
+            "benchmark": "load",
+            "environment": environment_info(),
+            "config": vars(args),
+            "failed": f"{stats.connect_failures} of {len(admins) + len(tenants)} clients could not connect",
+            "connect": connect_summary(stats, connected, connect_seconds),
+        }
+
+    readers = [asyncio.create_task(client.read()) for client in connected]
+
+    tenant_mix = parse_mix(args.tenant_mix)
+    admin_mix = parse_mix(args.admin_mix)
+    admin_logins = [client.login for client in admins]
+    tenant_logins = [client.login for client in tenants]
+
+    load_started = time.perf_counter()
+    deadline = load_started + args.duration
+    drivers = [
+        drive(client, args.tenant_rate, tenant_mix, deadline, admin_logins)
+        for client in connected if not client.is_admin
+    ] + [
+        drive(client, args.admin_rate, admin_mix, deadline, tenant_logins)
+        for client in connected if client.is_admin
+    ]
+    await asyncio.gather(*drivers)
+    load_seconds = time.perf_counter() - load_started
+    # Let in-flight deliveries arrive before closing
+    await asyncio.sleep(args.drain)
+
+    await lag.stop()
+    await asyncio.gather(*(client.websocket.close() for client in connected), return_exceptions=True)
+    for reader in readers:
+        reader.cancel()
+    await stop_server(server, server_task)
+
+    sent_total = sum(stats.sent.values())
+    delivered_total = sum(len(values) for name, values in stats.latencies.items() if name in TIMED_FRAMES.values())
+    return {
+        "benchmark": "load",
+        "environment": environment_info(),
+        "config": vars(args),
+        "connect": connect_summary(stats, connected, connect_seconds),
+        "throughput": {
+            "seconds": round(load_seconds, 3),
+            "sent": dict(stats.sent),
+            "sent_per_second": round(sent_total / load_seconds, 2),
+            "delivered_per_second": round(delivered_total / load_seconds, 2),
+        },
+        "latency_ms": {name: summarize(values) for name, values in sorted(stats.latencies.items())},
+        "loop_lag_ms": summarize(lag.samples),
+        "errors": dict(stats.errors),
+        "server_traces": tracer.summary(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=1000)
+    parser.add_argument("--admins", type=int, default=3)
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of load after everyone connected")
+    parser.add_argument("--tenant-rate", type=float, default=0.1, help="Frames per second per tenant")
+    parser.add_argument("--admin-rate", type=float, default=2.0, help="Frames per second per admin")
+    parser.add_argument(
+        "--tenant-mix", default="user_to_admin=0.8,get_conversation_history=0.15,ping=0.05",
+        help="Weighted tenant frame types"
+    )
+    parser.add_argument(
+        "--admin-mix", default="admin_to_user=0.9,get_conversations=0.08,broadcast=0.02",
+        help="Weighted admin frame types"
+    )
+    parser.add_argument("--connect-concurrency", type=int, default=50)
+    parser.add_argument("--connect-attempts", type=int, default=20, help="Connect attempts per client on retry-later")
+    parser.add_argument("--drain", type=float, default=2.0, help="Seconds to wait for in-flight frames")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", help="Directory for the temporary database (default: a new temp dir)")
+    parser.add_argument("--output", help="Also write the JSON result to this file")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    prepare_environment(args.workdir)
+    # The app prints debug output; keep stdout for the JSON result
+    with contextlib.redirect_stdout(sys.stderr):
+        result = asyncio.run(run(args))
+    emit(result, args.output)
+    if "failed" in result:
+        print(f"Load run failed: {result['failed']}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the hot message paths, without any network.
+
+Runs each operation repeatedly against a seeded temporary SQLite database
+and reports operations per second and a latency summary as JSON:
+
+  save_message                one insert and commit per call
+  get_conversation_history    a page of one long tenant-admin conversation
+                              as models, dumped to a frame with json.dumps
+  conversation_history_frame  the same page as projected rows written
+                              straight to JSON, as the WebSocket handler does
+  get_user_conversations      an admin's conversation list over many tenants
+  broadcast                   fan-out of one frame to in-memory sockets
+
+    python -m benchmarks.micro --iterations 500 --output micro.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import random
+import sys
+import time
+from typing import Awaitable, Callable
+
+from benchmarks.common import (
+    admin_login, emit, environment_info, prepare_environment, seed_users,
+    summarize, tenant_login
+)
+
+
+class NullWebSocket:
+    """Accepts everything and only counts what was sent"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data: str):
+        self.sent += 1
+
+
+async def measure(operation: Callable[[], Awaitable], iterations: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        await operation()
+    timings = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        await operation()
+        timings.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    return {
+        "iterations": iterations,
+        "ops_per_second": round(iterations / elapsed, 2),
+        "latency_ms": summarize(timings),
+    }
+
+
+async def seed_messages(history_length: int, tenants: int):
+    """One long conversation for tenant 0 and a short one for every tenant"""
+    from sqlalchemy import insert
+
+    from database.database import new_async_session
+    from schemas.schemas import MessageModel
+    from utils.timezone import now_ms
+
+    admin = admin_login(0)
+    start = now_ms() - (history_length + tenants) * 1000
+    rows = []
+    for i in range(history_length):
+        tenant_first = i % 2 == 0
+        rows.append({
+            "sender_id": tenant_login(0) if tenant_first else admin,
+            "recipient_id": admin if tenant_first else tenant_login(0),
+            "content": f"history {i}",
+            "message_type": "user_message" if tenant_first else "admin_message",
+            "timestamp": start + i * 1000,
+            "is_read": True,
+        })
+    for i in range(1, tenants):
+        rows.append({
+            "sender_id": tenant_login(i),
+            "recipient_id": admin,
+            "content": f"hello from {i}",
+            "message_type": "user_message",
+            "timestamp": start + (history_length + i) * 1000,
+            "is_read": i % 3 == 0,
+        })
+    async with new_async_session() as session:
+        await session.execute(insert(MessageModel), rows)
+        await session.commit()
+
+
+async def run(args) -> dict:
+    from database.database import engine, new_async_session
+    from websocket.connection_manager import manager
+    from websocket.message_manager import message_manager
+    from utils.timezone import ms_to_moscow_iso
+    from websocket.serializers import conversation_history_frame
+
+    await seed_users(args.tenants, 1)
+    await seed_messages(args.history, args.tenants)
+    admin = admin_login(0)
+
+    async def save_message():
+        async with new_async_session() as session:
+            await message_manager.save_message(
+                session, tenant_login(random.randrange(args.tenants)), admin, "benchmark message"
+            )
+
+    async def conversation_history():
+        async with new_async_session() as session:
+            messages = await message_manager.get_conversation_history(session, tenant_login(0), admin, limit=args.page)
+        serialized = []
+        for message in messages:
+            message_dict = message.model_dump()
+            message_dict["timestamp"] = ms_to_moscow_iso(message_dict["timestamp"])
+            serialized.append(message_dict)
+        json.dumps({"type": "conversation_history", "with_user": admin, "messages": serialized})
+
+    async def history_frame():
+        async with new_async_session() as session:
+            rows = await message_manager.get_conversation_history_rows(session, tenant_login(0), admin, limit=args.page)
+        conversation_history_frame(admin, rows)
+
+    async def user_conversations():
+        async with new_async_session() as session:
+            await message_manager.get_user_conversations(session, admin, is_admin=True)
+
+    for i in range(args.recipients):
+        await manager.connect(tenant_login(i), NullWebSocket(), {
+            "login": tenant_login(i), "first_name": "Tenant", "last_name": str(i), "patronymic": "",
+            "is_admin": False, "id": i + 1, "address": f"Address {i % 10}", "flat": i,
+        })
+
+    async def broadcast():
+        await manager.broadcast("benchmark broadcast", sender_id=admin)
+
+    results = {}
+    for name, operation, iterations in (
+        ("save_message", save_message, args.iterations),
+        ("get_conversation_history", conversation_history, args.iterations),
+        ("conversation_history_frame", history_frame, args.iterations),
+        ("get_user_conversations", user_conversations, max(1, args.iterations // 10)),
+        ("broadcast", broadcast, args.iterations),
+    ):
+        if args.only and name not in args.only:
+            continue
+        results[name] = await measure(operation, iterations, args.warmup)
+
+    for i in range(args.recipients):
+        manager.disconnect(tenant_login(i))
+    await engine.dispose()
+
+    return {
+        "benchmark": "micro",
+        "environment": environment_info(),
+        "config": vars(args),
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--tenants", type=int, default=1000, help="Tenants seeded, each with a conversation")
+    parser.add_argument("--history", type=int, default=5000, help="Messages in the long conversation")
+    parser.add_argument("--page", type=int, default=50, help="History page size")
+    parser.add_argument("--recipients", type=int, default=1000, help="Sockets a broadcast fans out to")
+    parser.add_argument("--only", nargs="*", help="Run only these benchmarks")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", help="Directory for the temporary database (default: a new temp dir)")
+    parser.add_argument("--output", help="Also write the JSON result to this file")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    prepare_environment(args.workdir)
+    # The app prints debug output; keep stdout for the JSON result
+    with contextlib.redirect_stdout(sys.stderr):
+        result = asyncio.run(run(args))
+    emit(result, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Soak test: hours of connect / message / disconnect cycles with memory tracking.
+
+One admin stays connected for the whole run. Each cycle connects a wave of
+tenants (taken round-robin from a larger pool, so logins keep changing),
+exchanges messages with the admin, disconnects everyone and waits until the
+server has dropped the sockets. Memory is sampled twice per cycle:
+
+  peak       with the wave connected, giving the cost per active connection
+             (client sockets live in the same process and are included)
+  quiescent  after the wave left and a full GC, with only the admin online
+
+Quiescent samples all have the same active connection count, so growth
+between them is not explained by connections and is what a leak looks
+like. Every few cycles a tracemalloc snapshot is compared to the one taken
+after warm-up, and the allocation sites and object types that grew are
+reported along with the sizes of the app's in-memory registries.
+
+The run fails (exit status 1) when quiescent memory keeps rising by more
+than --max-leak-bytes per connection served, both over the whole run and
+over its second half; a cache filling once and levelling off passes.
+
+    python -m benchmarks.soak --duration 14400 --wave-size 200 --output soak.json
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Optional
+
+from benchmarks.common import (
+    ROOT, admin_login, emit, environment_info, prepare_environment,
+    seed_users, start_server, stop_server, tenant_login
+)
+from benchmarks.load import BenchClient, LoadStats
+
+# Allocations made by the measuring itself, not by the app
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, os.path.join(ROOT, "benchmarks", "*")),
+)
+
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size, where /proc is available"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def registry_sizes() -> Dict[str, int]:
+    """Sizes of the app's long-lived in-memory structures"""
+    from authorization.cache import request_token_cache, token_cache, user_cache
+    from database.profiling import query_profiler
+    from websocket.activity_feed import activity_feed
+    from websocket.connection_manager import manager
+    from websocket.message_manager import message_manager
+    from websocket.rate_limiter import message_limiter
+    from websocket.tracing import tracer
+
+    return {
+        "manager.active_connections": len(manager.active_connections),
+        "manager.user_info": len(manager.user_info),
+        "manager.all_users": len(manager.all_users),
+        "manager.segments": sum(len(flats) for flats in manager.segments.values()),
+        "message_limiter.users": len(message_limiter._buckets),
+        "token_cache": len(token_cache._entries),
+        "request_token_cache": len(request_token_cache._entries),
+        "user_cache": len(user_cache._entries),
+        "recent_client_messages": len(message_manager.recent_client_messages._entries),
+        "tracer.traces": len(tracer._traces),
+        "activity_feed": len(activity_feed._entries),
+        "query_profiler.fingerprints": len(query_profiler.statements),
+    }
+
+
+def object_type_counts() -> Counter:
+    return Counter(type(obj).__name__ for obj in gc.get_objects())
+
+
+def slope(points: List[tuple]) -> float:
+    """Least-squares slope of y over x"""
+    if len(points) < 2:
+        return 0.0
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if not spread:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+
+async def drain(client: BenchClient, answered: Optional[asyncio.Event] = None):
+    """Read and drop everything the server sends; set answered on a history reply"""
+    with contextlib.suppress(Exception):
+        async for raw in client.websocket:
+            if answered is not None and '"conversation_history"' in raw:
+                answered.set()
+
+
+class Wave:
+    """Tenants connected in one cycle; messaging starts once all are in"""
+
+    def __init__(self, clients: List[BenchClient]):
+        self.clients = clients
+        self.settled = 0
+        self.all_settled = asyncio.Event()
+        self.go = asyncio.Event()
+
+    def settle(self):
+        self.settled += 1
+        if self.settled == len(self.clients):
+            self.all_settled.set()
+
+
+async def tenant_session(
+    client: BenchClient, wave: Wave, url: str, args, stats: LoadStats, semaphore: asyncio.Semaphore
+):
+    try:
+        async with semaphore:
+            await client.connect(url, args.connect_attempts)
+    except Exception:
+        stats.connect_failures += 1
+        return
+    finally:
+        wave.settle()
+    answered = asyncio.Event()
+    reader = asyncio.create_task(drain(client, answered))
+    await wave.go.wait()
+    try:
+        for i in range(args.messages):
+            await client.send({"type": "user_to_admin", "message": f"soak {i}"})
+            await asyncio.sleep(random.uniform(0, args.message_interval * 2))
+        await client.send({"type": "get_conversation_history", "with_user": "admin", "limit": 20})
+        await asyncio.wait_for(answered.wait(), timeout=30)
+    except Exception:
+        pass
+    await client.websocket.close()
+    await reader
+
+
+async def wait_for_connections(count: int, timeout: float = 30.0):
+    """Wait until the server holds exactly count sockets"""
+    from websocket.connection_manager import manager
+
+    deadline = time.monotonic() + timeout
+    while len(manager.active_connections) != count and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+
+def top_growth(snapshot, baseline, limit: int, served: int) -> List[dict]:
+    """Allocation sites that grew since the baseline, biggest first"""
+    result = []
+    for stat in snapshot.compare_to(baseline, "lineno"):
+        if stat.size_diff <= 0:
+            continue
+        frame = stat.traceback[0]
+        result.append({
+            "site": f"{os.path.relpath(frame.filename, ROOT)}:{frame.lineno}",
+            "size_diff_bytes": stat.size_diff,
+            "count_diff": stat.count_diff,
+            "bytes_per_connection_served": round(stat.size_diff / served, 2) if served else None,
+        })
+        if len(result) >= limit:
+            break
+    return result
+
+
+async def run(args) -> dict:
+    from main import app
+    from websocket.connection_manager import manager
+
+    tracemalloc.start(args.traceback_frames)
+    await seed_users(args.tenants, 1)
+    server, server_task, url = await start_server(app)
+
+    stats = LoadStats()
+    admin = BenchClient(admin_login(0), True, stats)
+    await admin.connect(url, args.connect_attempts)
+    admin_reader = asyncio.create_task(drain(admin))
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+    samples: List[dict] = []
+    reports: List[dict] = []
+    baseline = baseline_types = None
+    served = 0
+    next_tenant = 0
+    cycle = 0
+    started = time.perf_counter()
+    deadline = started + args.duration
+
+    while time.perf_counter() < deadline and (args.cycles is None or cycle < args.cycles):
+        clients = []
+        for _ in range(args.wave_size):
+            clients.append(BenchClient(tenant_login(next_tenant), False, stats))
+            next_tenant = (next_tenant + 1) % args.tenants
+        wave = Wave(clients)
+        sessions = asyncio.gather(*(
+            tenant_session(client, wave, url, args, stats, semaphore) for client in clients
+        ))
+
+        # Peak sample with the whole wave connected
+        await wave.all_settled.wait()
+        peak_active = len(manager.active_connections)
+        peak_traced = tracemalloc.get_traced_memory()[0]
+        wave.go.set()
+        for _ in range(args.admin_replies):
+            with contextlib.suppress(Exception):
+                await admin.send({
+                    "type": "admin_to_user",
+                    "to_user": random.choice(clients).login,
+                    "message": "soak reply"
+                })
+        await sessions
+        served += sum(1 for client in clients if client.websocket is not None)
+
+        await wait_for_connections(1)
+        gc.collect()
+        cycle += 1
+        traced = tracemalloc.get_traced_memory()[0]
+        samples.append({
+            "cycle": cycle,
+            "elapsed_s": round(time.perf_counter() - started, 1),
+            "served": served,
+            "peak_active": peak_active,
+            "peak_traced_bytes": peak_traced,
+            "traced_bytes": traced,
+            "rss_bytes": rss_bytes(),
+            "objects": len(gc.get_objects()),
+            "registries": registry_sizes(),
+        })
+
+        if cycle == args.warmup_cycles:
+            baseline = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+            baseline_types = object_type_counts()
+        elif baseline is not None and (cycle - args.warmup_cycles) % args.snapshot_every == 0:
+            snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+            reports.append({
+                "cycle": cycle,
+                "served": served,
+                "top_growth": top_growth(snapshot, baseline, args.top, served - samples[args.warmup_cycles - 1]["served"]),
+            })
+            print(
+                f"cycle {cycle}: served {served}, traced {traced / 1024:.0f} KiB, "
+                f"rss {(samples[-1]['rss_bytes'] or 0) / 1048576:.1f} MiB",
+                file=sys.stderr
+            )
+
+    await admin.websocket.close()
+    await admin_reader
+    await stop_server(server, server_task)
+
+    steady = samples[args.warmup_cycles - 1:] if len(samples) >= args.warmup_cycles else []
+    type_growth = []
+    if baseline_types is not None:
+        growth = object_type_counts()
+        growth.subtract(baseline_types)
+        type_growth = [{"type": name, "count_diff": diff} for name, diff in growth.most_common(args.top) if diff > 0]
+    tracemalloc.stop()
+
+    verdict = check_growth(steady, args.max_leak_bytes)
+    return {
+        "benchmark": "soak",
+        "environment": environment_info(),
+        "config": vars(args),
+        "cycles": cycle,
+        "connections_served": served,
+        "connect_failures": stats.connect_failures,
+        "per_active_connection_bytes": [
+            round((sample["peak_traced_bytes"] - sample["traced_bytes"]) / (sample["peak_active"] - 1))
+            for sample in samples if sample["peak_active"] > 1
+        ],
+        "verdict": verdict,
+        "top_growth": reports[-1]["top_growth"] if reports else [],
+        "object_type_growth": type_growth,
+        "snapshots": reports,
+        "samples": samples,
+    }
+
+
+def check_growth(steady: List[dict], max_leak_bytes: float) -> dict:
+    """Fail when quiescent memory per connection served keeps rising"""
+    if len(steady) < 4:
+        return {"passed": True, "reason": "too few cycles after warm-up to judge"}
+    traced = [(sample["served"], sample["traced_bytes"]) for sample in steady]
+    second_half = traced[len(traced) // 2:]
+    overall = slope(traced)
+    recent = slope(second_half)
+    rss = [(sample["served"], sample["rss_bytes"]) for sample in steady if sample["rss_bytes"] is not None]
+    failed = overall > max_leak_bytes and recent > max_leak_bytes
+    return {
+        "passed": not failed,
+        "traced_bytes_per_connection": round(overall, 2),
+        "traced_bytes_per_connection_second_half": round(recent, 2),
+        "rss_bytes_per_connection": round(slope(rss), 2),
+        "max_leak_bytes": max_leak_bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=3600, help="Seconds to run")
+    parser.add_argument("--cycles", type=int, help="Stop after this many cycles even if time is left")
+    parser.add_argument("--tenants", type=int, default=5000, help="Pool of tenant logins to cycle through")
+    parser.add_argument("--wave-size", type=int, default=200, help="Tenants connected per cycle")
+    parser.add_argument("--messages", type=int, default=3, help="Messages each tenant sends per cycle")
+    parser.add_argument("--message-interval", type=float, default=0.5, help="Mean seconds between a tenant's messages")
+    parser.add_argument("--admin-replies", type=int, default=20, help="Admin replies per cycle")
+    parser.add_argument("--connect-concurrency", type=int, default=50)
+    parser.add_argument("--connect-attempts", type=int, default=20)
+    parser.add_argument("--warmup-cycles", type=int, default=3, help="Cycles before the baseline snapshot")
+    parser.add_argument("--snapshot-every", type=int, default=10, help="Cycles between tracemalloc comparisons")
+    parser.add_argument("--traceback-frames", type=int, default=1, help="Frames kept per allocation")
+    parser.add_argument("--top", type=int, default=15, help="Allocation sites and types reported")
+    parser.add_argument(
+        "--max-leak-bytes", type=float, default=512,
+        help="Allowed steady growth of traced memory per connection served"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", help="Directory for the temporary database (default: a new temp dir)")
+    parser.add_argument("--output", help="Also write the JSON result to this file")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    prepare_environment(args.workdir)
+    # The app prints debug output; keep stdout for the JSON result
+    with contextlib.redirect_stdout(sys.stderr):
+        result = asyncio.run(run(args))
+    emit(result, args.output)
+    if not result["verdict"]["passed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, desc, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.database import new_async_session
+from schemas.schemas import MESSAGE_ROW_FIELDS, ColdSegmentModel, MessageModel, MessageSchema
+from utils.timezone import datetime_to_ms, get_moscow_time_iso, ms_to_moscow_iso, ms_to_moscow_time, now_ms
+
+logger = logging.getLogger(__name__)
+
+COLD_STORAGE_DIR = os.getenv("COLD_STORAGE_DIR", "cold_storage")
+COLD_STORAGE_AGE_DAYS = int(os.getenv("COLD_STORAGE_AGE_DAYS", "180"))
+COLD_STORAGE_BATCH_SIZE = int(os.getenv("COLD_STORAGE_BATCH_SIZE", "500"))
+# Pause between batches so other writers get the SQLite write lock
+COLD_STORAGE_BATCH_PAUSE = float(os.getenv("COLD_STORAGE_BATCH_PAUSE", "0.05"))
+# 0 disables the periodic job; it can still be run from /ops/storage/tier
+COLD_STORAGE_INTERVAL_SECONDS = float(os.getenv("COLD_STORAGE_INTERVAL_SECONDS", "0"))
+
+DAY_MS = 24 * 3600 * 1000
+
+# Tiering modes
+ARCHIVE = "archive"  # move old messages into cold segments
+PURGE = "purge"      # delete old messages and cold segments outright
+
+
+def conversation_key(user1_id: str, user2_id: str) -> Tuple[str, str]:
+    """Participants in sorted order, so both directions share one key"""
+    return (user1_id, user2_id) if user1_id <= user2_id else (user2_id, user1_id)
+
+
+def serialize_message(message: MessageModel) -> dict:
+    return {
+        "id": message.id,
+        "sender_id": message.sender_id,
+        "recipient_id": message.recipient_id,
+        "content": message.content,
+        "timestamp": message.timestamp,
+        "is_read": message.is_read,
+        "message_type": message.message_type,
+        "is_archived": message.is_archived,
+        "client_msg_id": message.client_msg_id,
+    }
+
+
+def deserialize_message(record: dict) -> MessageSchema:
+    return MessageSchema(
+        id=record["id"],
+        sender_id=record["sender_id"],
+        recipient_id=record["recipient_id"],
+        content=record["content"],
+        timestamp=record["timestamp"],
+        is_read=record["is_read"],
+        message_type=record["message_type"],
+        is_archived=record["is_archived"],
+    )
+
+
+def record_row(record: dict) -> tuple:
+    """A cold record as a plain tuple in MESSAGE_ROW_FIELDS order"""
+    return tuple(record[name] for name in MESSAGE_ROW_FIELDS)
+
+
+def append_records(path: str, records: List[dict]) -> int:
+    """Append records to a segment as one new gzip member; returns bytes written.
+
+    A gzip file may hold any number of members and reads back as their
+    concatenation, so segments are only ever appended to.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    payload = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+    data = gzip.compress(payload.encode("utf-8"))
+    with open(path, "ab") as segment_file:
+        segment_file.write(data)
+        segment_file.flush()
+        os.fsync(segment_file.fileno())
+    return len(data)
+
+
+def read_records(path: str) -> List[dict]:
+    """Read all records of a segment, skipping ids repeated by an interrupted run"""
+    records = []
+    seen = set()
+    with gzip.open(path, "rt", encoding="utf-8") as segment_file:
+        for line in segment_file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record["id"] in seen:
+                continue
+            if isinstance(record["timestamp"], str):
+                # Segments written before timestamps became epoch milliseconds
+                record["timestamp"] = datetime_to_ms(datetime.fromisoformat(record["timestamp"]))
+            seen.add(record["id"])
+            records.append(record)
+    return records
+
+
+class ColdStorage:
+    """Tiers old messages out of the hot messages table.
+
+    Messages older than the configured age are appended, in bounded batches,
+    to compressed segment files (one per conversation and month) and then
+    deleted from messages. cold_segments indexes the files so history reads
+    open only the segments they need.
+    """
+
+    def __init__(
+        self,
+        directory: str = COLD_STORAGE_DIR,
+        age_days: int = COLD_STORAGE_AGE_DAYS,
+        batch_size: int = COLD_STORAGE_BATCH_SIZE,
+        batch_pause: float = COLD_STORAGE_BATCH_PAUSE,
+        interval: float = COLD_STORAGE_INTERVAL_SECONDS
+    ):
+        self.directory = directory
+        self.age_days = age_days
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.interval = interval
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        self.archived_total = 0
+        self.purged_total = 0
+        self.last_run: Optional[dict] = None
+
+    def segment_path(self, key: Tuple[str, str], month: str) -> str:
+        digest = hashlib.sha1(f"{key[0]}\0{key[1]}".encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.directory, month, f"{digest}.ndjson.gz")
+
+    async def run(
+        self,
+        mode: str = ARCHIVE,
+        older_than_days: Optional[int] = None,
+        max_batches: Optional[int] = None
+    ) -> dict:
+        """Archive or purge messages older than the cutoff, batch by batch.
+
+        Every batch is its own short transaction; max_batches bounds the
+        work of a single run.
+        """
+        if mode not in (ARCHIVE, PURGE):
+            raise ValueError(f"Unknown tiering mode: {mode}")
+
+        async with self._lock:
+            age_days = self.age_days if older_than_days is None else older_than_days
+            cutoff = now_ms() - age_days * DAY_MS
+            process_batch = self._archive_batch if mode == ARCHIVE else self._purge_batch
+
+            messages = 0
+            batches = 0
+            while max_batches is None or batches < max_batches:
+                async with new_async_session() as session:
+                    count = await process_batch(session, cutoff)
+                if not count:
+                    break
+                messages += count
+                batches += 1
+                await asyncio.sleep(self.batch_pause)
+
+            segments = 0
+            if mode == PURGE:
+                segments = await self._purge_segments(cutoff)
+                self.purged_total += messages
+            else:
+                self.archived_total += messages
+
+            self.last_run = {
+                "mode": mode,
+                "cutoff": ms_to_moscow_iso(cutoff),
+                "messages": messages,
+                "batches": batches,
+                "segments_deleted": segments,
+                "finished_at": get_moscow_time_iso(),
+            }
+            logger.info(f"Cold storage {mode}: {messages} messages in {batches} batches")
+            return self.last_run
+
+    async def _archive_batch(self, session: AsyncSession, cutoff: int) -> int:
+        query = select(MessageModel).where(
+            MessageModel.timestamp < cutoff
+        ).order_by(MessageModel.timestamp, MessageModel.id).limit(self.batch_size)
+        rows = (await session.execute(query)).scalars().all()
+        if not rows:
+            return 0
+
+        groups: Dict[Tuple[str, str, str], List[MessageModel]] = {}
+        for message in rows:
+            key = conversation_key(message.sender_id, message.recipient_id)
+            month = ms_to_moscow_time(message.timestamp).strftime("%Y-%m")
+            groups.setdefault(key + (month,), []).append(message)
+
+        try:
+            # Files first, then index update and delete in one transaction;
+            # a crash in between leaves duplicates that read_records skips
+            for (user_a, user_b, month), messages in groups.items():
+                path = self.segment_path((user_a, user_b), month)
+                size = await asyncio.to_thread(append_records, path, [serialize_message(m) for m in messages])
+
+                segment = (await session.execute(select(ColdSegmentModel).where(
+                    and_(
+                        ColdSegmentModel.user_a == user_a,
+                        ColdSegmentModel.user_b == user_b,
+                        ColdSegmentModel.month == month
+                    )
+                ))).scalar_one_or_none()
+                if segment is None:
+                    segment = ColdSegmentModel(
+                        user_a=user_a,
+                        user_b=user_b,
+                        month=month,
+                        path=path,
+                        first_message_id=messages[0].id,
+                        last_message_id=messages[0].id,
+                        first_timestamp=messages[0].timestamp,
+                        last_timestamp=messages[0].timestamp,
+                        message_count=0,
+                        byte_size=0
+                    )
+                    session.add(segment)
+                segment.first_message_id = min([segment.first_message_id] + [m.id for m in messages])
+                segment.last_message_id = max([segment.last_message_id] + [m.id for m in messages])
+                segment.first_timestamp = min([segment.first_timestamp] + [m.timestamp for m in messages])
+                segment.last_timestamp = max([segment.last_timestamp] + [m.timestamp for m in messages])
+                segment.message_count += len(messages)
+                segment.byte_size += size
+
+            await session.execute(delete(MessageModel).where(MessageModel.id.in_([m.id for m in rows])))
+            await session.commit()
+            return len(rows)
+
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Failed to archive messages: {e}")
+            raise
+
+    async def _purge_batch(self, session: AsyncSession, cutoff: int) -> int:
+        batch = select(MessageModel.id).where(
+            MessageModel.timestamp < cutoff
+        ).order_by(MessageModel.timestamp).limit(self.batch_size)
+        try:
+            result = await session.execute(delete(MessageModel).where(MessageModel.id.in_(batch.scalar_subquery())))
+            await session.commit()
+            return result.rowcount
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Failed to purge messages: {e}")
+            raise
+
+    async def _purge_segments(self, cutoff: int) -> int:
+        """Delete cold segments whose newest message is older than the cutoff"""
+        async with new_async_session() as session:
+            segments = (await session.execute(
+                select(ColdSegmentModel).where(ColdSegmentModel.last_timestamp < cutoff)
+            )).scalars().all()
+            return await self._delete_segments(session, segments)
+
+    async def _delete_segments(self, session: AsyncSession, segments: List[ColdSegmentModel]) -> int:
+        if not segments:
+            return 0
+        try:
+            await session.execute(delete(ColdSegmentModel).where(
+                ColdSegmentModel.id.in_([segment.id for segment in segments])
+            ))
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Failed to delete cold segments: {e}")
+            raise
+        for segment in segments:
+            try:
+                await asyncio.to_thread(os.remove, segment.path)
+            except FileNotFoundError:
+                pass
+        return len(segments)
+
+    async def get_segments(
+        self,
+        session: AsyncSession,
+        user1_id: str,
+        user2_id: str
+    ) -> List[ColdSegmentModel]:
+        """Cold segments of a conversation, newest month first"""
+        user_a, user_b = conversation_key(user1_id, user2_id)
+        query = select(ColdSegmentModel).where(
+            and_(ColdSegmentModel.user_a == user_a, ColdSegmentModel.user_b == user_b)
+        ).order_by(desc(ColdSegmentModel.month))
+        return (await session.execute(query)).scalars().all()
+
+    async def read_conversation_page(
+        self,
+        session: AsyncSession,
+        user1_id: str,
+        user2_id: str,
+        offset: int,
+        limit: int,
+        include_archived: bool = False
+    ) -> List[MessageSchema]:
+        """Page through a conversation's cold messages, newest first"""
+        records = await self.read_conversation_records(session, user1_id, user2_id, offset, limit, include_archived)
+        return [deserialize_message(record) for record in records]
+
+    async def read_conversation_records(
+        self,
+        session: AsyncSession,
+        user1_id: str,
+        user2_id: str,
+        offset: int,
+        limit: int,
+        include_archived: bool = False
+    ) -> List[dict]:
+        """Raw records of a conversation page from cold segments, newest first.
+
+        Whole segments are skipped by their indexed message count when the
+        offset lies past them, so only the segments on the page are read.
+        """
+        page: List[dict] = []
+        if limit <= 0:
+            return page
+
+        for segment in await self.get_segments(session, user1_id, user2_id):
+            if include_archived and offset >= segment.message_count:
+                offset -= segment.message_count
+                continue
+
+            try:
+                records = await asyncio.to_thread(read_records, segment.path)
+            except FileNotFoundError:
+                logger.error(f"Cold segment file missing: {segment.path}")
+                continue
+            if not include_archived:
+                records = [record for record in records if not record["is_archived"]]
+            records.sort(key=lambda record: (record["timestamp"], record["id"]), reverse=True)
+
+            if offset >= len(records):
+                offset -= len(records)
+                continue
+            page.extend(records[offset:offset + limit - len(page)])
+            offset = 0
+            if len(page) >= limit:
+                break
+        return page
+
+    async def iter_records(
+        self,
+        session: AsyncSession,
+        user_id: Optional[str] = None,
+        peer_id: Optional[str] = None,
+        date_from: Optional[int] = None,
+        date_to: Optional[int] = None
+    ) -> AsyncIterator[List[dict]]:
+        """Yield cold records segment by segment, oldest month first.
+
+        Scopes match search_messages: a user, a conversation (user and peer)
+        or an epoch-ms date range. Only one segment is held in memory at a time.
+        """
+        conditions = []
+        if user_id and peer_id:
+            user_a, user_b = conversation_key(user_id, peer_id)
+            conditions += [ColdSegmentModel.user_a == user_a, ColdSegmentModel.user_b == user_b]
+        elif user_id:
+            conditions.append(or_(ColdSegmentModel.user_a == user_id, ColdSegmentModel.user_b == user_id))
+        if date_from is not None:
+            conditions.append(ColdSegmentModel.last_timestamp >= date_from)
+        if date_to is not None:
+            conditions.append(ColdSegmentModel.first_timestamp <= date_to)
+
+        query = select(ColdSegmentModel.path).where(and_(*conditions)).order_by(
+            ColdSegmentModel.month, ColdSegmentModel.user_a, ColdSegmentModel.user_b
+        )
+        paths = [row[0] for row in await session.execute(query)]
+
+        for path in paths:
+            try:
+                records = await asyncio.to_thread(read_records, path)
+            except FileNotFoundError:
+                logger.error(f"Cold segment file missing: {path}")
+                continue
+            if date_from is not None:
+                records = [record for record in records if record["timestamp"] >= date_from]
+            if date_to is not None:
+                records = [record for record in records if record["timestamp"] <= date_to]
+            records.sort(key=lambda record: (record["timestamp"], record["id"]))
+            if records:
+                yield records
+
+    async def delete_conversation(self, session: AsyncSession, user1_id: str, user2_id: str) -> int:
+        """Delete all cold segments of a conversation"""
+        return await self._delete_segments(session, await self.get_segments(session, user1_id, user2_id))
+
+    async def get_stats(self, session: AsyncSession) -> dict:
+        """Hot and cold message counts and segment sizes"""
+        hot_messages = (await session.execute(select(func.count(MessageModel.id)))).scalar() or 0
+        segments, cold_messages, cold_bytes = (await session.execute(select(
+            func.count(ColdSegmentModel.id),
+            func.coalesce(func.sum(ColdSegmentModel.message_count), 0),
+            func.coalesce(func.sum(ColdSegmentModel.byte_size), 0)
+        ))).one()
+        return {
+            "hot_messages": hot_messages,
+            "cold_segments": segments,
+            "cold_messages": cold_messages,
+            "cold_bytes": cold_bytes,
+            "age_days": self.age_days,
+            "archived_total": self.archived_total,
+            "purged_total": self.purged_total,
+            "last_run": self.last_run,
+        }
+
+    def clear_files(self):
+        """Remove every segment file; used when the database is reset"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def start(self):
+        """Start the periodic archive job if an interval is configured"""
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run(ARCHIVE)
+            except Exception as e:
+                logger.error(f"Periodic cold storage run failed: {e}")
+
+
+# Global cold storage instance
+cold_storage = ColdStorage()
@@ -1,18 +1,130 @@
 from fastapi.params import Depends
 from fastapi import APIRouter
+from sqlalchemy import event, inspect, text
 from sqlalchemy.ext.asyncio import create_async_engine,async_sessionmaker, AsyncSession
 from typing import Annotated
+import logging
+import os
+import time
 
+from database.profiling import query_profiler
+from database.search import setup_message_search
+from utils.metrics import db_query_errors, db_query_seconds
+from utils.timezone import MOSCOW_OFFSET_MS
+
+logger = logging.getLogger(__name__)
 
 
 router = APIRouter()
 
-engine = create_async_engine("sqlite+aiosqlite:///database.db")
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///database.db")
+
+# Connection pool sizing; unset values keep SQLAlchemy's defaults. A
+# WebSocket holds a connection only while it handles a frame, so the pool
+# needs to cover concurrent frames and handshakes, not open sockets.
+DB_POOL_OPTIONS = {
+    option: int(os.getenv(variable))
+    for option, variable in (
+        ("pool_size", "DB_POOL_SIZE"),
+        ("max_overflow", "DB_MAX_OVERFLOW"),
+        ("pool_timeout", "DB_POOL_TIMEOUT"),
+    )
+    if os.getenv(variable)
+}
+
+engine = create_async_engine(DATABASE_URL, **DB_POOL_OPTIONS)
 
 new_async_session = async_sessionmaker(engine, expire_on_commit=False)
 
+STATEMENT_KINDS = ("SELECT", "INSERT", "UPDATE", "DELETE")
+_query_timers = {kind: db_query_seconds.labels(kind) for kind in STATEMENT_KINDS + ("OTHER",)}
+
+
+def statement_kind(statement: str) -> str:
+    head = statement.lstrip()[:6].upper()
+    return head if head in STATEMENT_KINDS else "OTHER"
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_started
+    _query_timers[statement_kind(statement)].observe(elapsed)
+    query_profiler.record(statement, elapsed)
+
+
+@event.listens_for(engine.sync_engine, "handle_error")
+def _count_query_error(exception_context):
+    statement = exception_context.statement
+    db_query_errors.labels(statement_kind(statement) if statement else "OTHER").inc()
+
+
 async def get_session():
     async with new_async_session() as session:
         yield session
 
 SessionDep = Annotated[AsyncSession, Depends(get_session)]
+
+
+def _migrate_schema(conn):
+    """Bring an existing database up to the current models.
+
+    create_all only creates missing tables, so columns and indexes added to
+    existing tables are applied here. New columns must be nullable or carry a
+    server_default for SQLite to accept them.
+    """
+    from schemas.schemas import Base
+
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(conn.dialect)}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+            conn.execute(text(ddl))
+            logger.info(f"Added column {table.name}.{column.name}")
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+# Columns that used to hold datetime strings and now hold epoch milliseconds
+EPOCH_MS_COLUMNS = (
+    ("messages", "timestamp"),
+    ("broadcasts", "timestamp"),
+    ("cold_segments", "first_timestamp"),
+    ("cold_segments", "last_timestamp"),
+)
+
+
+def _migrate_timestamps(conn):
+    """Convert datetime strings left by older versions to epoch milliseconds.
+
+    Old values are naive Moscow time. Only rows still holding text are
+    touched, so this is a no-op once a database has been converted.
+    """
+    for table_name, column_name in EPOCH_MS_COLUMNS:
+        result = conn.execute(text(
+            f"UPDATE {table_name} SET {column_name} = "
+            f"CAST(ROUND((julianday({column_name}) - 2440587.5) * 86400000) AS INTEGER) - {MOSCOW_OFFSET_MS} "
+            f"WHERE typeof({column_name}) = 'text'"
+        ))
+        if result.rowcount:
+            logger.info(f"Converted {result.rowcount} {table_name}.{column_name} values to epoch milliseconds")
+
+
+async def init_models():
+    """Create missing tables and apply schema migrations on startup"""
+    from schemas.schemas import Base
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_migrate_schema)
+        await conn.run_sync(_migrate_timestamps)
+        await conn.run_sync(setup_message_search)
@@ -0,0 +1,234 @@
+import logging
+import os
+import re
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional
+
+from utils.timezone import get_moscow_time_iso
+
+logger = logging.getLogger(__name__)
+
+QUERY_PROFILING_ENABLED = os.getenv("QUERY_PROFILING_ENABLED", "1") == "1"
+# Statements slower than this are logged with their unit of work
+QUERY_SLOW_MS = float(os.getenv("QUERY_SLOW_MS", "200"))
+# A unit of work running one fingerprint more often than this looks like N+1
+QUERY_N_PLUS_ONE_THRESHOLD = int(os.getenv("QUERY_N_PLUS_ONE_THRESHOLD", "10"))
+# Distinct fingerprints tracked; later ones are counted under OTHER_FINGERPRINT
+QUERY_STATS_MAX_FINGERPRINTS = int(os.getenv("QUERY_STATS_MAX_FINGERPRINTS", "500"))
+QUERY_EVENTS_KEPT = 50
+
+OTHER_FINGERPRINT = "(other)"
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\bIN \((?:\?, )*\?\)", re.IGNORECASE)
+_FINGERPRINT_CACHE_SIZE = 2000
+
+
+def fingerprint(statement: str) -> str:
+    """Statement text with literals replaced and IN lists collapsed, so
+    every execution of the same query shape maps to one key"""
+    text = _WHITESPACE_RE.sub(" ", statement).strip()
+    text = _STRING_RE.sub("?", text)
+    text = _NUMBER_RE.sub("?", text)
+    return _IN_LIST_RE.sub("IN (...)", text)
+
+
+class UnitOfWork:
+    """Queries run on behalf of one HTTP request or WebSocket frame"""
+
+    __slots__ = ("name", "counts", "queries", "seconds")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.counts: Dict[str, int] = {}
+        self.queries = 0
+        self.seconds = 0.0
+
+
+class StatementStats:
+    __slots__ = ("count", "seconds", "max_seconds", "slow", "n_plus_one")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.slow = 0
+        self.n_plus_one = 0
+
+    def to_dict(self, statement: str) -> dict:
+        return {
+            "statement": statement,
+            "count": self.count,
+            "total_ms": round(self.seconds * 1000, 3),
+            "mean_ms": round(self.seconds * 1000 / self.count, 3) if self.count else 0,
+            "max_ms": round(self.max_seconds * 1000, 3),
+            "slow": self.slow,
+            "n_plus_one": self.n_plus_one,
+        }
+
+
+_current_unit: ContextVar[Optional[UnitOfWork]] = ContextVar("query_unit_of_work", default=None)
+
+
+class QueryProfiler:
+    """Aggregates statement timings by fingerprint and watches units of work.
+
+    The engine's cursor events call record() with each statement's duration.
+    Statements over slow_ms are logged right away; when a unit of work ends,
+    any fingerprint it ran more than n_plus_one_threshold times is reported
+    as a likely N+1 pattern.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = QUERY_PROFILING_ENABLED,
+        slow_ms: float = QUERY_SLOW_MS,
+        n_plus_one_threshold: int = QUERY_N_PLUS_ONE_THRESHOLD,
+        max_fingerprints: int = QUERY_STATS_MAX_FINGERPRINTS
+    ):
+        self.enabled = enabled
+        self.slow_seconds = slow_ms / 1000
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.max_fingerprints = max_fingerprints
+        self.statements: Dict[str, StatementStats] = {}
+        self.slow_queries: Deque[dict] = deque(maxlen=QUERY_EVENTS_KEPT)
+        self.n_plus_one_events: Deque[dict] = deque(maxlen=QUERY_EVENTS_KEPT)
+        self._fingerprints: Dict[str, str] = {}
+        self.units = 0
+
+    def _fingerprint(self, statement: str) -> str:
+        key = self._fingerprints.get(statement)
+        if key is None:
+            if len(self._fingerprints) >= _FINGERPRINT_CACHE_SIZE:
+                self._fingerprints.clear()
+            key = self._fingerprints[statement] = fingerprint(statement)
+        return key
+
+    def _stats(self, key: str) -> StatementStats:
+        stats = self.statements.get(key)
+        if stats is None:
+            if len(self.statements) >= self.max_fingerprints:
+                key = OTHER_FINGERPRINT
+                stats = self.statements.get(key)
+            if stats is None:
+                stats = self.statements[key] = StatementStats()
+        return stats
+
+    def record(self, statement: str, seconds: float):
+        """Account one executed statement"""
+        if not self.enabled:
+            return
+        key = self._fingerprint(statement)
+        stats = self._stats(key)
+        stats.count += 1
+        stats.seconds += seconds
+        if seconds > stats.max_seconds:
+            stats.max_seconds = seconds
+
+        unit = _current_unit.get()
+        if unit is not None:
+            unit.counts[key] = unit.counts.get(key, 0) + 1
+            unit.queries += 1
+            unit.seconds += seconds
+
+        if seconds >= self.slow_seconds:
+            stats.slow += 1
+            unit_name = unit.name if unit is not None else None
+            self.slow_queries.append({
+                "statement": key,
+                "duration_ms": round(seconds * 1000, 3),
+                "unit": unit_name,
+                "timestamp": get_moscow_time_iso(),
+            })
+            logger.warning(f"Slow query ({seconds * 1000:.1f} ms) in {unit_name or 'background'}: {key}")
+
+    @contextmanager
+    def unit(self, name: str):
+        """Scope the queries run inside the block to one unit of work"""
+        if not self.enabled:
+            yield None
+            return
+        unit = UnitOfWork(name)
+        token = _current_unit.set(unit)
+        try:
+            yield unit
+        finally:
+            _current_unit.reset(token)
+            self.units += 1
+            self._check_unit(unit)
+
+    def rename_unit(self, name: str):
+        """Give the current unit of work a more specific name once it is known"""
+        unit = _current_unit.get()
+        if unit is not None:
+            unit.name = name
+
+    def _check_unit(self, unit: UnitOfWork):
+        for key, count in unit.counts.items():
+            if count <= self.n_plus_one_threshold:
+                continue
+            self._stats(key).n_plus_one += 1
+            self.n_plus_one_events.append({
+                "unit": unit.name,
+                "statement": key,
+                "count": count,
+                "unit_queries": unit.queries,
+                "unit_ms": round(unit.seconds * 1000, 3),
+                "timestamp": get_moscow_time_iso(),
+            })
+            logger.warning(f"Possible N+1 in {unit.name}: {count} executions of {key}")
+
+    def top_statements(self, limit: int = 20, order: str = "total") -> List[dict]:
+        """Aggregated statements, worst first by total, mean or max time, or by count"""
+        sort_keys = {
+            "total": lambda item: item[1].seconds,
+            "mean": lambda item: item[1].seconds / item[1].count if item[1].count else 0,
+            "max": lambda item: item[1].max_seconds,
+            "count": lambda item: item[1].count,
+        }
+        if order not in sort_keys:
+            raise ValueError(f"Unknown order: {order}")
+        items = sorted(self.statements.items(), key=sort_keys[order], reverse=True)
+        return [stats.to_dict(statement) for statement, stats in items[:limit]]
+
+    def get_stats(self, limit: int = 20, order: str = "total") -> dict:
+        return {
+            "enabled": self.enabled,
+            "slow_ms": self.slow_seconds * 1000,
+            "n_plus_one_threshold": self.n_plus_one_threshold,
+            "units": self.units,
+            "fingerprints": len(self.statements),
+            "queries": sum(stats.count for stats in self.statements.values()),
+            "top_statements": self.top_statements(limit, order),
+            "slow_queries": list(reversed(self.slow_queries)),
+            "n_plus_one": list(reversed(self.n_plus_one_events)),
+        }
+
+    def reset(self):
+        self.statements.clear()
+        self.slow_queries.clear()
+        self.n_plus_one_events.clear()
+        self._fingerprints.clear()
+        self.units = 0
+
+
+class QueryProfilingMiddleware:
+    """ASGI middleware running each HTTP request as one unit of work"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with query_profiler.unit(f"{scope['method']} {scope['path']}"):
+            await self.app(scope, receive, send)
+
+
+# Global query profiler instance
+query_profiler = QueryProfiler()
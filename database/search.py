@@ -0,0 +1,138 @@
+from sqlalchemy import column, literal_column, table, text, Integer, Float
+from sqlalchemy.exc import OperationalError
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# External-content FTS5 index over messages.content: the text lives only in
+# messages, the index stores tokens keyed by messages.id.
+MESSAGES_FTS_DDL = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        content,
+        content='messages',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    """,
+    # Only content changes touch the index; read/archive flag updates do not
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+)
+
+MESSAGES_FTS_TRIGGERS = ("messages_fts_ai", "messages_fts_ad", "messages_fts_au")
+
+# Lightweight table construct for building search queries
+messages_fts = table(
+    "messages_fts",
+    column("rowid", Integer),
+    column("content"),
+    column("rank", Float),
+)
+
+SNIPPET_START = "**"
+SNIPPET_END = "**"
+SNIPPET_ELLIPSIS = "…"
+SNIPPET_TOKENS = 12
+
+
+def setup_message_search(conn):
+    """Create the messages FTS index and its sync triggers if missing.
+
+    The index is rebuilt from messages whenever the table or any trigger
+    had to be created, so it also catches up after a database reset or an
+    upgrade from a version without search.
+    """
+    existing = {
+        row[0] for row in conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE name = 'messages_fts' OR type = 'trigger'"
+        ))
+    }
+    missing = "messages_fts" not in existing or any(name not in existing for name in MESSAGES_FTS_TRIGGERS)
+    if not missing:
+        return
+
+    try:
+        for ddl in MESSAGES_FTS_DDL:
+            conn.execute(text(ddl))
+        conn.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+        logger.info("Message search index rebuilt")
+    except OperationalError as e:
+        # SQLite built without FTS5; everything except search keeps working
+        logger.warning(f"Message search unavailable: {e}")
+
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def build_match_expression(query: str) -> str:
+    """Turn free text into a safe FTS5 MATCH expression.
+
+    Every word becomes a quoted term, so FTS5 operators in user input are
+    matched literally; the last word is a prefix so results show up while
+    typing. Returns an empty string if the query has no words.
+    """
+    words = _TOKEN_RE.findall(query)
+    if not words:
+        return ""
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def make_snippet(content: str, query: str) -> str:
+    """Cut a SNIPPET_TOKENS-word excerpt around the first matching word and
+    highlight the query words in it.
+
+    Done in Python on the already-fetched content: the FTS5 snippet()
+    function re-runs the match per row when rows are picked by id.
+    """
+    words = list(_TOKEN_RE.finditer(content))
+    if not words:
+        return content
+    terms = [word.casefold() for word in _TOKEN_RE.findall(query)]
+    prefix = terms[-1] if terms else None
+    exact = set(terms[:-1])
+
+    def matches(word: str) -> bool:
+        word = word.casefold()
+        return word in exact or (prefix is not None and word.startswith(prefix))
+
+    first = next((i for i, word in enumerate(words) if matches(word.group())), 0)
+    start = max(0, min(first - SNIPPET_TOKENS // 3, len(words) - SNIPPET_TOKENS))
+    end = min(len(words), start + SNIPPET_TOKENS)
+
+    parts = [SNIPPET_ELLIPSIS] if start > 0 else []
+    position = words[start].start()
+    for word in words[start:end]:
+        parts.append(content[position:word.start()])
+        if matches(word.group()):
+            parts.append(f"{SNIPPET_START}{word.group()}{SNIPPET_END}")
+        else:
+            parts.append(word.group())
+        position = word.end()
+    if end < len(words):
+        parts.append(content[position:words[end].start()].rstrip() + SNIPPET_ELLIPSIS)
+    else:
+        parts.append(content[position:])
+    return "".join(parts)
+
+
+def match_clause(expression: str):
+    """WHERE clause matching the whole FTS table against an expression"""
+    return literal_column("messages_fts").op("MATCH")(expression)
@@ -5,6 +5,7 @@ Initialize database with default admin user
 import asyncio
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from schemas.schemas import Base, UserModel
+from authorization.passwords import hash_password_sync
 
 async def init_database():
     """Initialize database and create default admin user"""
@@ -31,7 +32,7 @@ async def init_database():
                 last_name="User",
                 patronymic="",
                 login="admin",
-                password="admin",  # In production, use hashed passwords
+                password=hash_password_sync("admin"),
                 address="Admin Address",
                 flat=1,
                 is_admin=True
@@ -53,7 +54,7 @@ async def init_database():
                 last_name="User",
                 patronymic="",
                 login="user",
-                password="user",
+                password=hash_password_sync("user"),
                 address="Test Address",
                 flat=2,
                 is_admin=False
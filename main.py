@@ -2,17 +2,39 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 import os
 
 from routers import ops
+from routers import metrics
 from database import database
 from authorization import auth
 from websocket import router as websocket_router
+from authorization.passwords import import_password_hasher, password_hasher
+from database.cold_storage import cold_storage
+from database.profiling import QueryProfilingMiddleware
+from websocket.activity_feed import activity_feed
+from utils.loop_monitor import loop_monitor
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Apply schema migrations before serving requests"""
+    await database.init_models()
+    await activity_feed.warm()
+    cold_storage.start()
+    loop_monitor.start()
+    yield
+    await loop_monitor.stop()
+    await cold_storage.stop()
+    password_hasher.shutdown()
+    import_password_hasher.shutdown()
+
 
 app = FastAPI(
     title="Chat Application Backend",
     description="FastAPI backend with WebSocket chat functionality",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -22,6 +44,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(QueryProfilingMiddleware)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -29,6 +52,7 @@ app.include_router(ops.router)
 app.include_router(database.router)
 app.include_router(auth.router)
 app.include_router(websocket_router.router)
+app.include_router(metrics.router)
 
 @app.get("/")
 async def root():
@@ -55,6 +79,7 @@ async def api_info():
             "websocket": "/ws/{user_id}?token={jwt_token}",
             "auth": "/auth/login",
             "ops": "/ops/",
+            "metrics": "/metrics",
             "frontend": "/static/",
             "status": "running"
         },
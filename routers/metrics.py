@@ -0,0 +1,24 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+import hmac
+import os
+
+from utils.metrics import registry
+
+# Shared secret for scrapers; when unset the endpoint is open, as is usual
+# for a /metrics endpoint on an internal port
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request):
+    """Process metrics in Prometheus text exposition format"""
+    if METRICS_TOKEN:
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(supplied.encode(), METRICS_TOKEN.encode()):
+            raise HTTPException(status_code=401, detail="Неверный токен метрик")
+    return PlainTextResponse(registry.expose(), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,35 +1,352 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy import select
+from collections import deque
+from typing import Optional
+import asyncio
+import codecs
+import csv
+import json
 
-from database.database import SessionDep, engine
-from schemas.schemas import UserModel, UserUpdateSchema, UserSchema
+from database.database import SessionDep, engine, new_async_session
+from database.search import setup_message_search
+from database.cold_storage import cold_storage
+from websocket.activity_feed import activity_feed
+from schemas.schemas import UserModel, UserUpdateSchema, UserSchema, UserAddSchema
 from schemas.schemas import Base
-from authorization.auth import admin_required, security
+from authorization.auth import admin_required, access_token_required
+from authorization.cache import user_cache
+from authorization.passwords import import_password_hasher, password_hasher
+from utils.loop_monitor import defer_when_overloaded, loop_monitor
 
 
 router = APIRouter(prefix="/ops")
 
-@router.post("/setup", dependencies=[Depends(security.access_token_required), Depends(admin_required)])
+@router.post("/setup", dependencies=[Depends(access_token_required), Depends(admin_required)])
 async def setup_database():
     try:
         async with engine.begin() as conn:
             await conn.run_sync(Base.metadata.drop_all)
             await conn.run_sync(Base.metadata.create_all)
+            # Triggers went with the messages table; recreate and resync the index
+            await conn.run_sync(setup_message_search)
+        # Segment files belong to the dropped cold_segments index
+        cold_storage.clear_files()
+        activity_feed.clear()
+        user_cache.clear()
     except:
         raise HTTPException(status_code=500, detail="Ошибка при сбросе базы данных")
 
 
-@router.get("/all_users", dependencies=[Depends(security.access_token_required), Depends(admin_required)])
-async def get_all_users(session: SessionDep):
-    query = select(UserModel)
-    result = await session.execute(query)
-    users = result.scalars().all()
+# Columns returned by user listings; the password hash never leaves the database
+USER_LIST_COLUMNS = (
+    UserModel.id,
+    UserModel.login,
+    UserModel.first_name,
+    UserModel.last_name,
+    UserModel.patronymic,
+    UserModel.address,
+    UserModel.flat,
+    UserModel.is_admin,
+)
+
+
+def build_user_list_query(
+        after_id: int = 0,
+        login_prefix: Optional[str] = None,
+        address: Optional[str] = None,
+        flat_min: Optional[int] = None,
+        flat_max: Optional[int] = None,
+        is_admin: Optional[bool] = None
+    ):
+    """Keyset-ordered, column-projected user query with optional filters"""
+    query = select(*USER_LIST_COLUMNS).where(UserModel.id > after_id)
+    if login_prefix:
+        # Half-open range instead of LIKE so the unique login index is usable
+        upper = login_prefix[:-1] + chr(ord(login_prefix[-1]) + 1)
+        query = query.where(UserModel.login >= login_prefix, UserModel.login < upper)
+    if address is not None:
+        query = query.where(UserModel.address == address)
+    if flat_min is not None:
+        query = query.where(UserModel.flat >= flat_min)
+    if flat_max is not None:
+        query = query.where(UserModel.flat <= flat_max)
+    if is_admin is not None:
+        query = query.where(UserModel.is_admin == is_admin)
+    return query.order_by(UserModel.id)
+
+
+@router.get("/all_users", dependencies=[Depends(access_token_required), Depends(admin_required), Depends(defer_when_overloaded)])
+async def get_all_users(
+        session: SessionDep,
+        after_id: int = Query(0, ge=0, description="Return users with id greater than this (keyset cursor)"),
+        limit: int = Query(100, ge=1, le=1000),
+        login_prefix: Optional[str] = None,
+        address: Optional[str] = None,
+        flat_min: Optional[int] = None,
+        flat_max: Optional[int] = None,
+        is_admin: Optional[bool] = None,
+        format: str = Query("json", pattern="^(json|ndjson)$", description="ndjson streams every matching user")
+    ):
+    query = build_user_list_query(after_id, login_prefix, address, flat_min, flat_max, is_admin)
+
+    if format == "ndjson":
+        async def stream_users():
+            # Own session: the request-scoped one may be closed before streaming ends
+            async with new_async_session() as stream_session:
+                result = await stream_session.stream(query.execution_options(yield_per=500))
+                async for row in result:
+                    yield json.dumps(dict(row._mapping), ensure_ascii=False) + "\n"
+
+        return StreamingResponse(stream_users(), media_type="application/x-ndjson")
+
+    result = await session.execute(query.limit(limit))
+    users = [dict(row._mapping) for row in result]
     return {
         "users": users,
+        "next_after_id": users[-1]["id"] if len(users) == limit else None,
         "message": "Список всех пользователей."
     }
 
 
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_REPORTED_ERRORS = 1000
+
+
+async def iter_upload_lines(request: Request):
+    """Yield decoded lines, line endings included, from a streamed request body"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in request.stream():
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line + "\n"
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+class _LineFeed:
+    """Lines for a csv.reader, refilled while the upload streams in"""
+
+    def __init__(self):
+        self.lines = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+def _read_fed_records(reader, feed: _LineFeed):
+    """Parse everything fed so far as (fields, None) or (None, error)"""
+    while feed.lines:
+        try:
+            values = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield None, str(e)
+            continue
+        if values:
+            yield values, None
+
+
+async def iter_csv_records(request: Request):
+    """Yield CSV records from a streamed upload, parsed by a single csv.reader.
+
+    Lines are handed to the reader once their quotes balance, so quoted
+    fields may span lines. Blank lines are skipped.
+    """
+    feed = _LineFeed()
+    reader = csv.reader(feed)
+    pending = []
+    quotes = 0
+    async for line in iter_upload_lines(request):
+        if not pending and not line.strip():
+            continue
+        pending.append(line)
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+        feed.lines.extend(pending)
+        pending, quotes = [], 0
+        for record in _read_fed_records(reader, feed):
+            yield record
+    # An unterminated quoted field runs to the end of the upload
+    feed.lines.extend(pending)
+    for record in _read_fed_records(reader, feed):
+        yield record
+
+
+async def read_csv_header(records) -> list:
+    """First CSV record as column names; a missing or unusable header is a 400"""
+    try:
+        header, error = await records.__anext__()
+    except StopAsyncIteration:
+        raise HTTPException(status_code=400, detail="Пустой файл: нет строки заголовка CSV")
+    if error:
+        raise HTTPException(status_code=400, detail=f"Некорректный заголовок CSV: {error}")
+    header = [name.strip() for name in header]
+    missing = [name for name in UserAddSchema.model_fields if name not in header]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"В заголовке CSV нет столбцов: {', '.join(missing)}")
+    return header
+
+
+async def iter_upload_records(request: Request, format: str):
+    """Yield (row number, dict, None) records from a CSV or NDJSON upload.
+
+    CSV needs a header record naming the UserAddSchema columns. Unparseable
+    records are yielded as (row number, None, error message).
+    """
+    row_number = 0
+    if format == "csv":
+        records = iter_csv_records(request)
+        header = await read_csv_header(records)
+        async for values, error in records:
+            row_number += 1
+            if error is None and len(values) != len(header):
+                error = f"expected {len(header)} columns, got {len(values)}"
+            if error:
+                yield row_number, None, f"Некорректная строка: {error}"
+            else:
+                yield row_number, dict(zip(header, values)), None
+        return
+
+    async for line in iter_upload_lines(request):
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            yield row_number, None, f"Некорректная строка: {e}"
+            continue
+        yield row_number, record, None
+
+
+async def import_user_batch(session, batch: list, seen_logins: set, report: dict):
+    """Dedupe, hash and insert one batch of already validated users"""
+    from sqlalchemy import insert
+    from authorization.passwords import is_password_hash
+
+    logins = [user.login for _, user in batch]
+    existing_query = select(UserModel.login).where(UserModel.login.in_(logins))
+    existing = {row[0] for row in (await session.execute(existing_query)).fetchall()}
+
+    rows = []
+    for row_number, user in batch:
+        if user.login in existing or user.login in seen_logins:
+            add_import_error(report, row_number, user.login, "Пользователь с таким логином уже существует")
+            continue
+        seen_logins.add(user.login)
+        rows.append((row_number, user))
+
+    async def hash_if_needed(password: str) -> str:
+        # Pre-hashed passwords (e.g. migrated from another system) are kept as is
+        return password if is_password_hash(password) else await import_password_hasher.hash(password)
+
+    # Plaintext is hashed at full login cost on the import pool, which is
+    # sized to leave cores, and the login hasher's queue, to logins
+    hashes = await asyncio.gather(*(hash_if_needed(user.password) for _, user in rows))
+    values = [
+        {**user.model_dump(), "password": password_hash}
+        for (_, user), password_hash in zip(rows, hashes)
+    ]
+    if not values:
+        return
+
+    try:
+        await session.execute(insert(UserModel), values)
+        await session.commit()
+        report["inserted"] += len(values)
+    except Exception:
+        # Something slipped past the checks (e.g. a concurrent insert); retry
+        # row by row so only the offending rows are reported
+        await session.rollback()
+        for (row_number, user), row_values in zip(rows, values):
+            try:
+                await session.execute(insert(UserModel), [row_values])
+                await session.commit()
+                report["inserted"] += 1
+            except Exception as e:
+                await session.rollback()
+                add_import_error(report, row_number, user.login, f"Ошибка записи: {e.__class__.__name__}")
+
+    for row_values in values:
+        user_cache.invalidate(row_values["login"])
+
+
+def add_import_error(report: dict, row_number: int, login: Optional[str], error: str):
+    report["failed"] += 1
+    if len(report["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+        report["errors"].append({"row": row_number, "login": login, "error": error})
+    else:
+        report["errors_truncated"] = True
+
+
+@router.post("/import_users", dependencies=[Depends(access_token_required), Depends(admin_required), Depends(defer_when_overloaded)])
+async def import_users(
+        request: Request,
+        session: SessionDep,
+        format: Optional[str] = Query(None, pattern="^(csv|ndjson)$", description="Defaults from Content-Type")
+    ):
+    """Bulk-create users from a streamed CSV or NDJSON upload.
+
+    Rows are validated with UserAddSchema and inserted in batched
+    transactions; invalid or duplicate rows are reported without aborting
+    the rest of the import.
+
+    The fast path is pre-hashed passwords in the stored format,
+    pbkdf2_sha256$<iterations>$<salt>$<hash> (base64 without padding);
+    they are stored as is, and a lower iteration count is upgraded on the
+    user's first login. Plaintext passwords cost a full-strength hash each,
+    spread over PASSWORD_IMPORT_HASH_WORKERS cores, so a large plaintext
+    import takes minutes rather than seconds.
+    """
+    if format is None:
+        content_type = request.headers.get("content-type", "")
+        format = "csv" if "csv" in content_type else "ndjson"
+
+    report = {"total_rows": 0, "inserted": 0, "failed": 0, "errors": [], "errors_truncated": False}
+    seen_logins = set()
+    batch = []
+
+    async for row_number, record, parse_error in iter_upload_records(request, format):
+        report["total_rows"] += 1
+        if parse_error:
+            add_import_error(report, row_number, None, parse_error)
+            continue
+        try:
+            user = UserAddSchema(**record)
+        except ValidationError as e:
+            fields = ", ".join(".".join(str(part) for part in error["loc"]) for error in e.errors())
+            add_import_error(report, row_number, record.get("login"), f"Некорректные поля: {fields}")
+            continue
+        batch.append((row_number, user))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await import_user_batch(session, batch, seen_logins, report)
+            batch = []
+
+    if batch:
+        await import_user_batch(session, batch, seen_logins, report)
+
+    return {
+        "success": report["failed"] == 0,
+        "format": format,
+        **report,
+        "message": f"Импортировано пользователей: {report['inserted']}"
+    }
+
+
 # @router.post("/add_user")
 # async def add_user_to_database(session: SessionDep, user: UserSchema):
 #     new_user = UserModel(
@@ -45,7 +362,7 @@ async def get_all_users(session: SessionDep):
 #     session.add(new_user)
 #     await session.commit()
 #     return new_user
-@router.get("/user_info/{user_id}", dependencies=[Depends(security.access_token_required), Depends(admin_required)])
+@router.get("/user_info/{user_id}", dependencies=[Depends(access_token_required), Depends(admin_required)])
 async def get_user_info(
         user_id: int,
         session: SessionDep
@@ -58,7 +375,7 @@ async def get_user_info(
     return user_data
 
 
-@router.get("/user_info_by_login/{login}", dependencies=[Depends(security.access_token_required), Depends(admin_required)])
+@router.get("/user_info_by_login/{login}", dependencies=[Depends(access_token_required), Depends(admin_required)])
 async def get_user_info_by_login(
         login: str,
         session: SessionDep
@@ -66,6 +383,7 @@ async def get_user_info_by_login(
     """Get user information by login"""
     from sqlalchemy import select, func
     from schemas.schemas import MessageModel
+    from utils.timezone import ms_to_moscow_iso
     
     # Get user data
     query = select(UserModel).where(UserModel.login == login)
@@ -112,13 +430,13 @@ async def get_user_info_by_login(
         "sent_messages": sent_messages,
         "received_messages": received_messages,
         "unread_messages": unread_messages,
-        "last_activity": last_activity.isoformat() if last_activity else None
+        "last_activity": ms_to_moscow_iso(last_activity) if last_activity else None
     }
     
     return user_info
 
 
-@router.patch("/edit_user/{user_id}", dependencies=[Depends(security.access_token_required)])
+@router.patch("/edit_user/{user_id}", dependencies=[Depends(access_token_required)])
 async def edit_user(
         user_id: int,
         data: UserUpdateSchema,
@@ -132,19 +450,24 @@ async def edit_user(
         raise HTTPException(status_code=404, detail="Пользователь не найден")
 
     update_data = data.model_dump(exclude_unset=True)
+    old_login = user_to_edit.login
+    if update_data.get("password"):
+        update_data["password"] = await password_hasher.hash(update_data["password"])
 
     for field, value in update_data.items():
         setattr(user_to_edit, field, value)
 
     await session.commit()
     await session.refresh(user_to_edit)
+    user_cache.invalidate(old_login)
+    user_cache.invalidate(user_to_edit.login)
     return {
         "success": True,
         "message": "Данные пользователя обновлены"
     }
 
 
-@router.post("/archive_conversation/{user_login}", dependencies=[Depends(security.access_token_required), Depends(admin_required)])
+@router.post("/archive_conversation/{user_login}", dependencies=[Depends(access_token_required), Depends(admin_required)])
 async def archive_conversation(
         user_login: str,
         session: SessionDep
@@ -191,7 +514,7 @@ async def archive_conversation(
         raise HTTPException(status_code=500, detail=f"Ошибка архивирования беседы: {str(e)}")
 
 
-@router.get("/archived_conversations", dependencies=[Depends(security.access_token_required), Depends(admin_required)])
+@router.get("/archived_conversations", dependencies=[Depends(access_token_required), Depends(admin_required), Depends(defer_when_overloaded)])
 async def get_archived_conversations(session: SessionDep):
     """Get list of users with archived conversations"""
     from sqlalchemy import select, func, distinct, and_
@@ -249,7 +572,7 @@ async def get_archived_conversations(session: SessionDep):
         raise HTTPException(status_code=500, detail=f"Ошибка получения архивированных бесед: {str(e)}")
 
 
-@router.post("/unarchive_conversation/{user_login}", dependencies=[Depends(security.access_token_required), Depends(admin_required)])
+@router.post("/unarchive_conversation/{user_login}", dependencies=[Depends(access_token_required), Depends(admin_required)])
 async def unarchive_conversation(
         user_login: str,
         session: SessionDep
@@ -295,7 +618,7 @@ async def unarchive_conversation(
         raise HTTPException(status_code=500, detail=f"Ошибка разархивирования беседы: {str(e)}")
 
 
-@router.post("/clear_user_cache", dependencies=[Depends(security.access_token_required), Depends(admin_required)])
+@router.post("/clear_user_cache", dependencies=[Depends(access_token_required), Depends(admin_required)])
 async def clear_user_cache():
     """Clear invalid users from connection manager cache"""
     from websocket.connection_manager import manager
@@ -307,4 +630,291 @@ async def clear_user_cache():
             "message": "Кэш пользователей очищен"
         }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка очистки кэша: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Ошибка очистки кэша: {str(e)}")
+
+
+@router.get("/connection_stats", dependencies=[Depends(access_token_required), Depends(admin_required)])
+async def get_connection_stats():
+    """WebSocket admission, batching, inbound rate limit and event loop lag counters"""
+    from websocket.admission import admission
+    from websocket.coalescing import coalescer
+    from websocket.connection_manager import manager
+    from websocket.ephemeral import ephemeral_throttle
+    from websocket.rate_limiter import message_limiter
+    
+    return {
+        "active_connections": len(manager.active_connections),
+        "admission": admission.get_stats(),
+        "coalescing": coalescer.get_stats(),
+        "ephemeral": ephemeral_throttle.get_stats(),
+        "event_loop": loop_monitor.get_stats(),
+        "message_limits": message_limiter.get_stats()
+    }
+
+
+@router.get("/traces", dependencies=[Depends(access_token_required), Depends(admin_required)])
+async def get_traces(
+        user: Optional[str] = Query(None, description="Only frames sent by this login"),
+        type: Optional[str] = Query(None, description="Only frames of this type"),
+        limit: int = Query(50, ge=1, le=1000)
+    ):
+    """Recent WebSocket frame traces, newest first"""
+    from websocket.tracing import tracer
+
+    return {"traces": tracer.recent(limit, user, type)}
+
+
+@router.get("/traces/summary", dependencies=[Depends(access_token_required), Depends(admin_required)])
+async def get_trace_summary(type: Optional[str] = Query(None, description="Only frames of this type")):
+    """Per frame type latency percentiles of each stage, from receipt"""
+    from websocket.tracing import tracer
+
+    return {"summary": tracer.summary(type)}
+
+
+@router.get("/traces/{trace_id}", dependencies=[Depends(access_token_required), Depends(admin_required)])
+async def get_trace(trace_id: str):
+    """One trace by the id sent back in message_ack"""
+    from websocket.tracing import tracer
+
+    trace = tracer.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Трассировка не найдена")
+    return trace
+
+
+@router.get("/query_stats", dependencies=[Depends(access_token_required), Depends(admin_required)])
+async def get_query_stats(
+        limit: int = Query(20, ge=1, le=500),
+        order: str = Query("total", pattern="^(total|mean|max|count)$")
+    ):
+    """Top SQL statements by fingerprint, recent slow queries and N+1 warnings"""
+    from database.profiling import query_profiler
+
+    return query_profiler.get_stats(limit, order)
+
+
+@router.post("/query_stats/reset", dependencies=[Depends(access_token_required), Depends(admin_required)])
+async def reset_query_stats():
+    """Start query statistics from scratch, e.g. before measuring a release"""
+    from database.profiling import query_profiler
+
+    query_profiler.reset()
+    return {"success": True}
+
+
+@router.get("/search_messages", dependencies=[Depends(access_token_required), Depends(admin_required), Depends(defer_when_overloaded)])
+async def search_messages(
+        session: SessionDep,
+        q: str = Query(..., min_length=1, description="Words to search for; the last one matches as a prefix"),
+        user: Optional[str] = Query(None, description="Only messages sent or received by this login"),
+        peer: Optional[str] = Query(None, description="With user: only the conversation between user and peer"),
+        date_from: Optional[str] = Query(None, description="ISO datetime, Moscow time if no zone given"),
+        date_to: Optional[str] = Query(None, description="ISO datetime, Moscow time if no zone given"),
+        limit: int = Query(20, ge=1, le=100),
+        offset: int = Query(0, ge=0)
+    ):
+    """Full-text search over message history, ranked by relevance"""
+    from websocket.message_manager import message_manager
+    from utils.timezone import parse_moscow_datetime
+    
+    try:
+        date_from_value = parse_moscow_datetime(date_from) if date_from else None
+        date_to_value = parse_moscow_datetime(date_to) if date_to else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неверный формат даты")
+    
+    try:
+        results = await message_manager.search_messages(
+            session, q,
+            user_id=user,
+            peer_id=peer,
+            date_from=date_from_value,
+            date_to=date_to_value,
+            limit=limit,
+            offset=offset
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка поиска сообщений: {str(e)}")
+    
+    return {
+        "query": q,
+        "results": results,
+        "offset": offset,
+        "next_offset": offset + limit if len(results) == limit else None
+    }
+
+
+@router.post("/storage/tier", dependencies=[Depends(access_token_required), Depends(admin_required), Depends(defer_when_overloaded)])
+async def run_storage_tiering(
+        mode: str = Query("archive", pattern="^(archive|purge)$", description="archive moves old messages to cold segments, purge deletes them"),
+        older_than_days: Optional[int] = Query(None, ge=0, description="Defaults to COLD_STORAGE_AGE_DAYS"),
+        max_batches: Optional[int] = Query(None, ge=1, description="Stop after this many batches")
+    ):
+    """Move or delete messages older than the retention age, in small batches"""
+    try:
+        return await cold_storage.run(mode, older_than_days, max_batches)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка переноса сообщений: {str(e)}")
+
+
+@router.get("/storage/stats", dependencies=[Depends(access_token_required), Depends(admin_required), Depends(defer_when_overloaded)])
+async def get_storage_stats(session: SessionDep):
+    """Hot table size, cold segment totals and the last tiering run"""
+    return await cold_storage.get_stats(session)
+
+
+EXPORT_COLUMNS = (
+    "id", "timestamp", "sender_id", "recipient_id",
+    "message_type", "is_read", "is_archived", "content",
+)
+EXPORT_FETCH_SIZE = 1000
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+def build_message_export_query(
+        user: Optional[str] = None,
+        peer: Optional[str] = None,
+        date_from: Optional[int] = None,
+        date_to: Optional[int] = None
+    ):
+    """Column-projected, id-ordered query over hot messages in an export scope (dates in epoch ms)"""
+    from sqlalchemy import and_, or_
+    from schemas.schemas import MessageModel
+
+    columns = [getattr(MessageModel, name) for name in EXPORT_COLUMNS]
+    query = select(*columns)
+    if user and peer:
+        query = query.where(or_(
+            and_(MessageModel.sender_id == user, MessageModel.recipient_id == peer),
+            and_(MessageModel.sender_id == peer, MessageModel.recipient_id == user)
+        ))
+    elif user:
+        query = query.where(or_(MessageModel.sender_id == user, MessageModel.recipient_id == user))
+    if date_from is not None:
+        query = query.where(MessageModel.timestamp >= date_from)
+    if date_to is not None:
+        query = query.where(MessageModel.timestamp <= date_to)
+    return query.order_by(MessageModel.id)
+
+
+class ExportEncoder:
+    """Turns export records into NDJSON or CSV text, optionally gzipped.
+
+    Output is buffered into chunks of about EXPORT_CHUNK_BYTES so the
+    response is written in a few large pieces rather than a row at a time.
+    """
+
+    def __init__(self, format: str, compress: bool):
+        import io
+        import zlib
+
+        self.format = format
+        # wbits=31: gzip container, so the output is a regular .gz file
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer) if format == "csv" else None
+
+    def header(self) -> Optional[bytes]:
+        if self.writer is not None:
+            self.writer.writerow(EXPORT_COLUMNS)
+        return self._take_if_full()
+
+    def add(self, record: dict) -> Optional[bytes]:
+        """Add one record; returns a chunk to send once the buffer is full"""
+        if self.writer is not None:
+            self.writer.writerow([record[name] for name in EXPORT_COLUMNS])
+        else:
+            self.buffer.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return self._take_if_full()
+
+    def finish(self) -> bytes:
+        data = self._encode(self._take())
+        if self.compressor is not None:
+            data += self.compressor.flush()
+        return data
+
+    def _take_if_full(self) -> Optional[bytes]:
+        if self.buffer.tell() < EXPORT_CHUNK_BYTES:
+            return None
+        return self._encode(self._take()) or None
+
+    def _take(self) -> str:
+        text = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return text
+
+    def _encode(self, text: str) -> bytes:
+        data = text.encode("utf-8")
+        return self.compressor.compress(data) if self.compressor is not None else data
+
+
+@router.get("/export_messages", dependencies=[Depends(access_token_required), Depends(admin_required), Depends(defer_when_overloaded)])
+async def export_messages(
+        user: Optional[str] = Query(None, description="Only messages sent or received by this login"),
+        peer: Optional[str] = Query(None, description="With user: only the conversation between user and peer"),
+        date_from: Optional[str] = Query(None, description="ISO datetime, Moscow time if no zone given"),
+        date_to: Optional[str] = Query(None, description="ISO datetime, Moscow time if no zone given"),
+        format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+        gzip: bool = Query(False, description="Compress the export on the fly")
+    ):
+    """Stream messages in a scope, oldest first, including cold storage.
+
+    Hot rows are read through a server-side cursor EXPORT_FETCH_SIZE at a
+    time and cold segments one at a time, so memory use does not depend
+    on the size of the export.
+    """
+    from utils.timezone import datetime_to_ms, ms_to_moscow_iso, parse_moscow_datetime
+
+    try:
+        date_from_value = datetime_to_ms(parse_moscow_datetime(date_from)) if date_from else None
+        date_to_value = datetime_to_ms(parse_moscow_datetime(date_to)) if date_to else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неверный формат даты")
+
+    query = build_message_export_query(user, peer, date_from_value, date_to_value)
+
+    async def stream_export():
+        encoder = ExportEncoder(format, gzip)
+        chunk = encoder.header()
+        if chunk:
+            yield chunk
+
+        # Own session: the request-scoped one may be closed before streaming ends
+        async with new_async_session() as stream_session:
+            # Cold segments hold the oldest messages, so they go first
+            async for records in cold_storage.iter_records(
+                stream_session, user, peer, date_from_value, date_to_value
+            ):
+                for record in records:
+                    record = {name: record[name] for name in EXPORT_COLUMNS}
+                    record["timestamp"] = ms_to_moscow_iso(record["timestamp"])
+                    chunk = encoder.add(record)
+                    if chunk:
+                        yield chunk
+
+            result = await stream_session.stream(query.execution_options(yield_per=EXPORT_FETCH_SIZE))
+            async for row in result:
+                record = dict(row._mapping)
+                record["timestamp"] = ms_to_moscow_iso(record["timestamp"])
+                chunk = encoder.add(record)
+                if chunk:
+                    yield chunk
+
+        chunk = encoder.finish()
+        if chunk:
+            yield chunk
+
+    filename = f"messages.{format}" + (".gz" if gzip else "")
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv; charset=utf-8"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if gzip:
+        media_type = "application/gzip"
+    return StreamingResponse(stream_export(), media_type=media_type, headers=headers)
+
+
+@router.get("/recent_activity", dependencies=[Depends(access_token_required), Depends(admin_required)])
+async def get_recent_activity(limit: int = Query(50, ge=1, le=1000)):
+    """Latest messages across all conversations, from the in-memory feed"""
+    return {"events": activity_feed.recent(limit)}
@@ -1,8 +1,8 @@
 from pydantic import BaseModel, Field, EmailStr, validator
 from typing import Optional
-from datetime import datetime
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import ForeignKey
+from sqlalchemy import BigInteger, ForeignKey, Index
+from utils.timezone import now_ms
 
 class Base(DeclarativeBase):
     pass
@@ -19,6 +19,11 @@ class UserModel(Base):
     flat: Mapped[int]
     is_admin: Mapped[bool]
 
+    __table_args__ = (
+        # Resolves broadcast segments: address = ? AND flat BETWEEN ? AND ?
+        Index("ix_users_address_flat", "address", "flat"),
+    )
+
 
 class LoginSchema(BaseModel):
     login: EmailStr
@@ -65,10 +70,79 @@ class MessageModel(Base):
     sender_id: Mapped[str] = mapped_column(ForeignKey("users.login"))
     recipient_id: Mapped[str] = mapped_column(ForeignKey("users.login"))
     content: Mapped[str]
-    timestamp: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+    timestamp: Mapped[int] = mapped_column(BigInteger, default=now_ms)  # Epoch milliseconds, UTC
     is_read: Mapped[bool] = mapped_column(default=False)
     message_type: Mapped[str] = mapped_column(default="user_message")  # user_message, admin_message, broadcast
     is_archived: Mapped[bool] = mapped_column(default=False)  # For archiving conversations
+    client_msg_id: Mapped[Optional[str]] = mapped_column(default=None)  # Client-generated id for idempotent retries
+
+    __table_args__ = (
+        # Range scans for cursor-based delivery: recipient_id = ? AND id > ?
+        Index("ix_messages_recipient_id_id", "recipient_id", "id"),
+        # One row per recipient for each client message id; NULLs never collide
+        Index("ux_messages_sender_client_msg", "sender_id", "client_msg_id", "recipient_id", unique=True),
+        # Selects tiering batches: timestamp < cutoff ORDER BY timestamp
+        Index("ix_messages_timestamp", "timestamp"),
+    )
+
+
+class BroadcastModel(Base):
+    """Broadcast log, stored once and replayed to each user after their watermark"""
+    __tablename__ = "broadcasts"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    sender_id: Mapped[str] = mapped_column(ForeignKey("users.login"))
+    content: Mapped[str]
+    timestamp: Mapped[int] = mapped_column(BigInteger, default=now_ms)  # Epoch milliseconds, UTC
+    # Optional segment; NULL address means everyone
+    address: Mapped[Optional[str]] = mapped_column(default=None)
+    flat_from: Mapped[Optional[int]] = mapped_column(default=None)
+    flat_to: Mapped[Optional[int]] = mapped_column(default=None)
+    client_msg_id: Mapped[Optional[str]] = mapped_column(default=None)
+
+    __table_args__ = (
+        Index("ux_broadcasts_sender_client_msg", "sender_id", "client_msg_id", unique=True),
+    )
+
+
+class DeliveryCursorModel(Base):
+    """Highest message and broadcast ids a user has acknowledged receiving"""
+    __tablename__ = "delivery_cursors"
+
+    user_login: Mapped[str] = mapped_column(ForeignKey("users.login"), primary_key=True)
+    last_message_id: Mapped[int] = mapped_column(default=0)
+    # NULL until the user first connects after broadcast logging was added
+    last_broadcast_id: Mapped[Optional[int]] = mapped_column(default=None)
+
+
+class ColdSegmentModel(Base):
+    """Index of compressed cold-storage files, one per conversation and month"""
+    __tablename__ = "cold_segments"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    # Conversation participants in sorted order, so each pair has one key
+    user_a: Mapped[str]
+    user_b: Mapped[str]
+    month: Mapped[str]  # YYYY-MM
+    path: Mapped[str]
+    first_message_id: Mapped[int]
+    last_message_id: Mapped[int]
+    first_timestamp: Mapped[int] = mapped_column(BigInteger)  # Epoch milliseconds, UTC
+    last_timestamp: Mapped[int] = mapped_column(BigInteger)
+    message_count: Mapped[int] = mapped_column(default=0)
+    byte_size: Mapped[int] = mapped_column(default=0)
+
+    __table_args__ = (
+        Index("ux_cold_segments_conversation_month", "user_a", "user_b", "month", unique=True),
+    )
+
+
+# Field order of the plain tuples returned by the projected message read paths;
+# matches MessageSchema
+MESSAGE_ROW_FIELDS = (
+    "id", "sender_id", "recipient_id", "content",
+    "timestamp", "is_read", "message_type", "is_archived",
+)
 
 
 class MessageSchema(BaseModel):
@@ -76,7 +150,7 @@ class MessageSchema(BaseModel):
     sender_id: str
     recipient_id: str
     content: str
-    timestamp: datetime
+    timestamp: int  # Epoch milliseconds; formatted to ISO when sent
     is_read: bool
     message_type: str
     is_archived: bool = False
@@ -92,5 +166,5 @@ class ConversationSchema(BaseModel):
     participant_id: str
     participant_name: str
     last_message: str
-    last_message_time: datetime
+    last_message_time: int  # Epoch milliseconds
     unread_count: int
\ No newline at end of file
@@ -1,8 +1,14 @@
 """
 Start the FastAPI server
 """
+import os
+
 import uvicorn
 
+# permessage-deflate for WebSocket frames; compresses JSON text well and
+# costs CPU per frame, so it can be turned off when clients use the compact codec
+WS_PER_MESSAGE_DEFLATE = os.getenv("WS_PER_MESSAGE_DEFLATE", "1") == "1"
+
 if __name__ == "__main__":
     print("Starting FastAPI server...")
     print("Press Ctrl+C to stop the server")
@@ -12,5 +18,7 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=True,
-        log_level="info"
+        log_level="info",
+        ws="websockets",
+        ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE
     )
\ No newline at end of file
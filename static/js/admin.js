@@ -6,6 +6,10 @@ let currentAdmin = null;
 let connectedUsers = [];
 let selectedUser = null;
 let conversationHistory = {};
+let activityEvents = []; // Live activity feed, newest first
+let debugStats = null; // Latest server debug snapshot
+let typingIndicatorTimer = null;
+const ACTIVITY_FEED_LIMIT = 20;
 
 /**
  * Initialize admin panel
@@ -113,12 +117,15 @@ function setupWebSocketListeners() {
     adminWS.on('connected', () => {
         updateConnectionStatus('online', 'Подключен');
         loadConnectedUsers();
+        adminWS.subscribeActivity(ACTIVITY_FEED_LIMIT);
+        adminWS.subscribeDebug();
         // Загружаем сохраненные данные из localStorage
         loadStoredAdminData();
     });
     
     adminWS.on('disconnected', () => {
         updateConnectionStatus('offline', 'Отключен');
+        updateDebugInfo();
     });
     
     adminWS.on('reconnecting', (data) => {
@@ -136,6 +143,9 @@ function setupWebSocketListeners() {
     
     adminWS.on('userMessage', (data) => {
         console.log('Received user message:', data);
+        if (data.from === selectedUser) {
+            hideTypingIndicator();
+        }
         // New message from user
         addMessageToChat(data.from, {
             content: data.message,
@@ -145,8 +155,12 @@ function setupWebSocketListeners() {
             type: 'received'
         });
         
-        // Update user list with unread indicator
-        updateUserUnreadCount(data.from, 1);
+        // Update user list with unread indicator, or mark read if the chat is open
+        if (selectedUser === data.from && !document.hidden) {
+            adminWS.markAsRead(data.from);
+        } else {
+            updateUserUnreadCount(data.from, 1);
+        }
         
         // Show notification
         if (document.hidden || selectedUser !== data.from) {
@@ -175,6 +189,19 @@ function setupWebSocketListeners() {
         }
     });
     
+    adminWS.on('ephemeral', (data) => {
+        // Only signals for the open conversation are shown
+        if (data.conversation !== selectedUser) return;
+        const name = data.from_name || data.from;
+        if (data.event === 'typing') {
+            showTypingIndicator(`${name} печатает...`, data.ttl_ms);
+        } else if (data.event === 'viewing') {
+            showTypingIndicator(`${name} просматривает чат`, data.ttl_ms);
+        } else {
+            hideTypingIndicator();
+        }
+    });
+    
     adminWS.on('userConnected', (data) => {
         console.log('User connected:', data);
         addUserToList(data.user_id, data.user_name, true);
@@ -193,6 +220,22 @@ function setupWebSocketListeners() {
         updateUsersList(data.users);
     });
     
+    adminWS.on('debugStats', (data) => {
+        debugStats = data;
+        updateDebugInfo();
+    });
+    
+    adminWS.on('recentActivity', (data) => {
+        activityEvents = data.events || [];
+        renderActivityFeed();
+    });
+    
+    adminWS.on('activity', (data) => {
+        activityEvents.unshift(data.event);
+        activityEvents.length = Math.min(activityEvents.length, ACTIVITY_FEED_LIMIT);
+        renderActivityFeed();
+    });
+    
     adminWS.on('conversationHistory', (data) => {
         displayConversationHistory(data.with_user, data.messages);
     });
@@ -239,6 +282,11 @@ function setupUIListeners() {
             
             // Enable/disable send button
             sendBtn.disabled = length === 0 || !selectedUser || !adminWS || !adminWS.isConnected;
+            
+            // Let the user and other admins see the reply being typed
+            if (length > 0 && selectedUser && adminWS && adminWS.isConnected) {
+                adminWS.notifyTyping(selectedUser);
+            }
         });
         
         messageInput.addEventListener('keydown', (e) => {
@@ -652,6 +700,7 @@ function selectUser(userId, isArchived = false) {
     console.log(`Selecting user: ${userId} (archived: ${isArchived})`);
     
     selectedUser = userId;
+    hideTypingIndicator();
     
     // Сохраняем выбор в localStorage
     saveAdminDataToStorage();
@@ -723,6 +772,10 @@ function selectUser(userId, isArchived = false) {
     
     // Clear unread count
     updateUserUnreadCount(userId, 0, true);
+    if (adminWS && adminWS.isConnected) {
+        adminWS.markAsRead(userId);
+        adminWS.sendEphemeral('viewing', userId);
+    }
     
     // Load conversation normally (no special handling for archived)
     displayConversation(userId);
@@ -739,6 +792,36 @@ function selectUser(userId, isArchived = false) {
     }
 }
 
+/**
+ * Show a typing or viewing signal until it expires or is replaced
+ */
+function showTypingIndicator(text, ttlMs = 5000) {
+    const indicator = document.getElementById('typingIndicator');
+    if (!indicator) return;
+    
+    indicator.textContent = text;
+    indicator.classList.remove('hidden');
+    
+    if (typingIndicatorTimer) {
+        clearTimeout(typingIndicatorTimer);
+    }
+    typingIndicatorTimer = setTimeout(hideTypingIndicator, ttlMs);
+}
+
+/**
+ * Hide the typing indicator
+ */
+function hideTypingIndicator() {
+    const indicator = document.getElementById('typingIndicator');
+    if (indicator) {
+        indicator.classList.add('hidden');
+    }
+    if (typingIndicatorTimer) {
+        clearTimeout(typingIndicatorTimer);
+        typingIndicatorTimer = null;
+    }
+}
+
 /**
  * Send message to selected user
  */
@@ -778,6 +861,7 @@ function sendMessage() {
             // Clear input
             messageInput.value = '';
             document.getElementById('charCount').textContent = '0/1000';
+            adminWS.stopTyping();
             
             // Focus input
             messageInput.focus();
@@ -1032,12 +1116,37 @@ function showBroadcastModal() {
         modal.classList.remove('hidden');
     }
     
+    ['broadcastAddress', 'broadcastFlatFrom', 'broadcastFlatTo'].forEach(id => {
+        const input = document.getElementById(id);
+        if (input) {
+            input.value = '';
+        }
+    });
+    
     if (messageInput) {
         messageInput.value = '';
         messageInput.focus();
     }
 }
 
+/**
+ * Read the optional broadcast segment from the modal
+ */
+function getBroadcastSegment() {
+    const address = (document.getElementById('broadcastAddress')?.value || '').trim();
+    if (!address) {
+        return null;
+    }
+    
+    const flatFrom = document.getElementById('broadcastFlatFrom')?.value;
+    const flatTo = document.getElementById('broadcastFlatTo')?.value;
+    return {
+        address: address,
+        flat_from: flatFrom ? parseInt(flatFrom, 10) : null,
+        flat_to: flatTo ? parseInt(flatTo, 10) : null
+    };
+}
+
 /**
  * Hide broadcast modal
  */
@@ -1061,14 +1170,18 @@ function sendBroadcastMessage() {
     }
     
     const content = messageInput.value.trim();
+    const segment = getBroadcastSegment();
     
     sendBtn.disabled = true;
     
     try {
-        const success = adminWS.sendBroadcast(content);
+        const success = adminWS.sendBroadcast(content, segment);
         
         if (success) {
-            showAlert('Сообщение отправлено всем пользователям', 'success');
+            showAlert(
+                segment ? `Сообщение отправлено по адресу ${segment.address}` : 'Сообщение отправлено всем пользователям',
+                'success'
+            );
             hideBroadcastModal();
         } else {
             showAlert('Не удалось отправить сообщение', 'error');
@@ -1285,7 +1398,28 @@ window.adminPanel = {
 };
 
 /**
- * Update debug information
+ * Render the live activity feed, newest first
+ */
+function renderActivityFeed() {
+    const feedDiv = document.getElementById('activityFeed');
+    if (!feedDiv) return;
+    
+    if (activityEvents.length === 0) {
+        feedDiv.textContent = 'Нет событий';
+        return;
+    }
+    
+    feedDiv.innerHTML = activityEvents.map(event => {
+        const time = formatChatTime(event.timestamp).timeStr;
+        const target = event.kind === 'broadcast' ? '📢' : `→ ${escapeHtml(event.recipient_id)}`;
+        return `<div>
+            ${time} <b>${escapeHtml(event.sender_name)}</b> ${target}: ${escapeHtml(event.content.slice(0, 40))}
+        </div>`;
+    }).join('');
+}
+
+/**
+ * Update debug information; redrawn on each debug_stats push from the server
  */
 function updateDebugInfo() {
     const debugDiv = document.getElementById('debugInfo');
@@ -1300,17 +1434,29 @@ function updateDebugInfo() {
         currentAdmin: currentAdmin ? currentAdmin.login : 'none'
     };
     
+    let serverInfo = '';
+    if (debugStats) {
+        const connections = debugStats.connections || {};
+        serverInfo = `<br>Онлайн: ${connections.user || 0} польз., ${connections.admin || 0} адм.`;
+        // Receive-to-last-delivery latency of chat messages, from server traces
+        ['user_to_admin', 'admin_to_user', 'broadcast'].forEach(type => {
+            const stages = (debugStats.summary[type] || {}).stages_ms || {};
+            const latency = stages.last_delivery || stages.total;
+            if (latency) {
+                serverInfo += `<br>${type}: p50 ${latency.p50} мс, p99 ${latency.p99} мс`;
+            }
+        });
+    }
+    
     debugDiv.innerHTML = `
         WS: ${info.wsConnected ? '✅' : '❌'} | 
         Users: ${info.connectedUsersCount} | 
-        Selected: ${info.selectedUser} | 
-        Admin: ${info.currentAdmin}
+        Selected: ${escapeHtml(info.selectedUser)} | 
+        Admin: ${escapeHtml(info.currentAdmin)}
+        ${serverInfo}
     `;
 }
 
-// Auto-update debug info every 5 seconds
-setInterval(updateDebugInfo, 5000);
-
 // Make function available globally
 window.updateDebugInfo = updateDebugInfo;
 
@@ -5,6 +5,8 @@ let notificationMgr = null;
 let currentUser = null;
 let messageHistory = [];
 let unreadCount = 0;
+let offlineSenders = new Set(); // Senders of replayed messages not yet marked as read
+let typingIndicatorTimer = null;
 
 /**
  * Initialize user chat interface
@@ -84,6 +86,7 @@ function setupWebSocketListeners() {
     });
     
     chatWS.on('adminMessage', (data) => {
+        hideTypingIndicator();
         addMessage({
             content: data.message,
             sender: data.from,
@@ -127,6 +130,13 @@ function setupWebSocketListeners() {
     
     chatWS.on('offlineMessage', (data) => {
         console.log('Received offline message:', data);
+        if (data.message_type === 'broadcast') {
+            addBroadcastMessage(data.message, data.from_name || data.from, data.timestamp);
+            return;
+        }
+        if (data.message_type === 'admin_message') {
+            offlineSenders.add(data.from);
+        }
         addMessage({
             content: data.message,
             sender: data.from,
@@ -137,8 +147,23 @@ function setupWebSocketListeners() {
         });
     });
     
+    chatWS.on('ephemeral', (data) => {
+        if (data.event === 'typing') {
+            showTypingIndicator(`${data.from_name || 'Администратор'} печатает...`, data.ttl_ms);
+        } else if (data.event === 'viewing') {
+            showTypingIndicator('Администратор просматривает чат', data.ttl_ms);
+        } else {
+            hideTypingIndicator();
+        }
+    });
+    
     chatWS.on('offlineMessagesSummary', (data) => {
         console.log('Offline messages summary:', data);
+        // Replay no longer marks messages read; do it once the user can see them
+        if (!document.hidden) {
+            offlineSenders.forEach(sender => chatWS.markAsRead(sender));
+            offlineSenders.clear();
+        }
         if (data.count > 0) {
             addSystemMessage(`📬 ${data.message}`, 'info');
             showAlert(`Получено ${data.count} новых сообщений`, 'info');
@@ -162,6 +187,11 @@ function setupUIListeners() {
             
             // Enable/disable send button
             sendBtn.disabled = length === 0 || !chatWS || !chatWS.isConnected;
+            
+            // Let online admins see the user typing
+            if (length > 0 && chatWS && chatWS.isConnected) {
+                chatWS.notifyTyping();
+            }
         });
         
         messageInput.addEventListener('keydown', (e) => {
@@ -249,6 +279,7 @@ function sendMessage() {
             // Clear input
             messageInput.value = '';
             document.getElementById('charCount').textContent = '0/1000';
+            chatWS.stopTyping();
             
             // Focus input
             messageInput.focus();
@@ -380,6 +411,36 @@ function addMessage(message) {
     addMessageToUI(message, true);
 }
 
+/**
+ * Show a typing or viewing signal until it expires or is replaced
+ */
+function showTypingIndicator(text, ttlMs = 5000) {
+    const indicator = document.getElementById('typingIndicator');
+    if (!indicator) return;
+    
+    indicator.textContent = text;
+    indicator.classList.remove('hidden');
+    
+    if (typingIndicatorTimer) {
+        clearTimeout(typingIndicatorTimer);
+    }
+    typingIndicatorTimer = setTimeout(hideTypingIndicator, ttlMs);
+}
+
+/**
+ * Hide the typing indicator
+ */
+function hideTypingIndicator() {
+    const indicator = document.getElementById('typingIndicator');
+    if (indicator) {
+        indicator.classList.add('hidden');
+    }
+    if (typingIndicatorTimer) {
+        clearTimeout(typingIndicatorTimer);
+        typingIndicatorTimer = null;
+    }
+}
+
 /**
  * Add system message
  */
@@ -557,6 +618,8 @@ document.addEventListener('visibilitychange', () => {
     if (!document.hidden && chatWS && chatWS.isConnected) {
         // Mark messages as read when page becomes visible
         chatWS.markAsRead('admin');
+        offlineSenders.forEach(sender => chatWS.markAsRead(sender));
+        offlineSenders.clear();
     }
 });
 
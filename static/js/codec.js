@@ -0,0 +1,282 @@
+// Compact wire codec: MessagePack with short tags for keys, types and times.
+// Mirrors websocket/codec.py; the tables are append-only and must match it.
+
+const ChatCodec = (() => {
+    const FIELD_TAGS_V1 = [
+        'type', 'message', 'timestamp', 'from', 'from_name', 'message_type',
+        'message_id', 'id', 'sender_id', 'recipient_id', 'content', 'is_read',
+        'is_archived', 'user_id', 'user_name', 'name', 'is_admin', 'login',
+        'to_user', 'with_user', 'messages', 'client_msg_id', 'trace_id',
+        'duplicate', 'broadcast_id', 'cursor', 'broadcast_cursor', 'count',
+        'code', 'retry_after_ms', 'user_data', 'users', 'connected',
+        'conversations', 'participant_id', 'participant_name', 'last_message',
+        'last_message_time', 'unread_count', 'limit', 'offset', 'query',
+        'results', 'snippet', 'rank', 'event', 'events', 'address', 'flat',
+        'first_name', 'last_name', 'patronymic', 'segment', 'flat_from',
+        'flat_to', 'last_activity', 'kind', 'sender_name', 'message_ids',
+        'to', 'to_name', 'conversation', 'ttl_ms'
+    ];
+    const TYPE_TAGS_V1 = [
+        'welcome', 'user_message', 'admin_message', 'admin_sent', 'broadcast',
+        'offline_message', 'offline_messages_summary', 'message_ack',
+        'conversation_history', 'conversations_list', 'connected_users',
+        'user_connected', 'error', 'pong', 'ping', 'activity', 'recent_activity',
+        'search_results', 'debug_stats', 'user_to_admin', 'admin_to_user',
+        'get_conversation_history', 'get_conversations', 'mark_as_read', 'ack',
+        'get_connected_users', 'search_messages', 'subscribe_activity',
+        'unsubscribe_activity', 'get_recent_activity', 'subscribe_debug',
+        'unsubscribe_debug', 'batch', 'ephemeral'
+    ];
+    const FIELD_INDEX = new Map(FIELD_TAGS_V1.map((name, tag) => [name, tag]));
+    const TYPE_INDEX = new Map(TYPE_TAGS_V1.map((name, tag) => [name, tag]));
+    // Extension type carrying a timestamp as big-endian int64 epoch ms
+    const TIMESTAMP_EXT = 1;
+    const MOSCOW_OFFSET_MS = 3 * 60 * 60 * 1000;
+
+    const textEncoder = new TextEncoder();
+    const textDecoder = new TextDecoder();
+
+    /**
+     * Epoch ms as the server's Moscow ISO string, e.g. 2024-01-01T12:00:00.000+03:00
+     */
+    function msToMoscowIso(ms) {
+        return new Date(ms + MOSCOW_OFFSET_MS).toISOString().replace('Z', '+03:00');
+    }
+
+    class Writer {
+        constructor() {
+            this.buffer = new Uint8Array(256);
+            this.view = new DataView(this.buffer.buffer);
+            this.length = 0;
+        }
+
+        reserve(size) {
+            if (this.length + size <= this.buffer.length) return;
+            let capacity = this.buffer.length * 2;
+            while (capacity < this.length + size) capacity *= 2;
+            const buffer = new Uint8Array(capacity);
+            buffer.set(this.buffer.subarray(0, this.length));
+            this.buffer = buffer;
+            this.view = new DataView(buffer.buffer);
+        }
+
+        byte(value) {
+            this.reserve(1);
+            this.buffer[this.length++] = value;
+        }
+
+        bytes(values) {
+            this.reserve(values.length);
+            this.buffer.set(values, this.length);
+            this.length += values.length;
+        }
+
+        header(marker, size, value) {
+            this.reserve(1 + size);
+            this.buffer[this.length++] = marker;
+            if (size === 1) this.view.setUint8(this.length, value);
+            else if (size === 2) this.view.setUint16(this.length, value);
+            else this.view.setUint32(this.length, value);
+            this.length += size;
+        }
+
+        result() {
+            return this.buffer.slice(0, this.length);
+        }
+    }
+
+    function packInt(value, out) {
+        if (value >= 0 && value <= 0x7f) {
+            out.byte(value);
+        } else if (value < 0 && value >= -32) {
+            out.byte(value + 0x100);
+        } else if (value >= 0 && value < 0x100000000) {
+            if (value < 0x100) out.header(0xcc, 1, value);
+            else if (value < 0x10000) out.header(0xcd, 2, value);
+            else out.header(0xce, 4, value);
+        } else if (value < 0 && value >= -0x80000000) {
+            out.header(0xd2, 4, value >>> 0);
+        } else {
+            out.reserve(9);
+            out.buffer[out.length++] = 0xd3;
+            out.view.setBigInt64(out.length, BigInt(value));
+            out.length += 8;
+        }
+    }
+
+    function packStr(value, out) {
+        const encoded = textEncoder.encode(value);
+        const length = encoded.length;
+        if (length < 32) out.byte(0xa0 | length);
+        else if (length < 0x100) out.header(0xd9, 1, length);
+        else if (length < 0x10000) out.header(0xda, 2, length);
+        else out.header(0xdb, 4, length);
+        out.bytes(encoded);
+    }
+
+    function packLength(length, out, fix, marker16, marker32) {
+        if (length < 16) out.byte(fix | length);
+        else if (length < 0x10000) out.header(marker16, 2, length);
+        else out.header(marker32, 4, length);
+    }
+
+    function pack(value, out) {
+        if (value === null || value === undefined) {
+            out.byte(0xc0);
+        } else if (value === true) {
+            out.byte(0xc3);
+        } else if (value === false) {
+            out.byte(0xc2);
+        } else if (typeof value === 'number') {
+            if (Number.isSafeInteger(value)) {
+                packInt(value, out);
+            } else {
+                out.reserve(9);
+                out.buffer[out.length++] = 0xcb;
+                out.view.setFloat64(out.length, value);
+                out.length += 8;
+            }
+        } else if (typeof value === 'string') {
+            packStr(value, out);
+        } else if (Array.isArray(value)) {
+            packLength(value.length, out, 0x90, 0xdc, 0xdd);
+            value.forEach(item => pack(item, out));
+        } else if (typeof value === 'object') {
+            const entries = Object.entries(value).filter(([, item]) => item !== undefined);
+            packLength(entries.length, out, 0x80, 0xde, 0xdf);
+            for (const [key, item] of entries) {
+                const tag = FIELD_INDEX.get(key);
+                if (tag !== undefined) packInt(tag, out);
+                else packStr(key, out);
+                if (key === 'type' && typeof item !== 'string') {
+                    // Numbers here are read back as type tags
+                    throw new TypeError(`Message type must be a string, not ${typeof item}`);
+                }
+                if (key === 'type' && TYPE_INDEX.has(item)) packInt(TYPE_INDEX.get(item), out);
+                else pack(item, out);
+            }
+        } else {
+            throw new TypeError(`Cannot encode ${typeof value}`);
+        }
+    }
+
+    class Reader {
+        constructor(buffer) {
+            this.bytes = buffer instanceof Uint8Array ? buffer : new Uint8Array(buffer);
+            this.view = new DataView(this.bytes.buffer, this.bytes.byteOffset, this.bytes.byteLength);
+            this.position = 0;
+        }
+
+        take(size) {
+            if (this.position + size > this.bytes.length) {
+                throw new RangeError('Truncated frame');
+            }
+            const start = this.position;
+            this.position += size;
+            return start;
+        }
+
+        uint(size) {
+            const at = this.take(size);
+            if (size === 1) return this.view.getUint8(at);
+            if (size === 2) return this.view.getUint16(at);
+            return this.view.getUint32(at);
+        }
+
+        str(length) {
+            const at = this.take(length);
+            return textDecoder.decode(this.bytes.subarray(at, at + length));
+        }
+
+        array(length) {
+            const items = [];
+            for (let i = 0; i < length; i++) items.push(this.value());
+            return items;
+        }
+
+        map(length) {
+            const result = {};
+            for (let i = 0; i < length; i++) {
+                let key = this.value();
+                if (typeof key === 'number') {
+                    if (key < 0 || key >= FIELD_TAGS_V1.length) throw new RangeError(`Unknown field tag ${key}`);
+                    key = FIELD_TAGS_V1[key];
+                }
+                let value = this.value();
+                if (key === 'type' && typeof value === 'number') {
+                    if (value < 0 || value >= TYPE_TAGS_V1.length) throw new RangeError(`Unknown type tag ${value}`);
+                    value = TYPE_TAGS_V1[value];
+                }
+                result[key] = value;
+            }
+            return result;
+        }
+
+        value() {
+            const byte = this.uint(1);
+            if (byte <= 0x7f) return byte;
+            if (byte >= 0xe0) return byte - 0x100;
+            if (byte >= 0xa0 && byte <= 0xbf) return this.str(byte & 0x1f);
+            if (byte >= 0x90 && byte <= 0x9f) return this.array(byte & 0x0f);
+            if (byte >= 0x80 && byte <= 0x8f) return this.map(byte & 0x0f);
+            switch (byte) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xcc: return this.uint(1);
+                case 0xcd: return this.uint(2);
+                case 0xce: return this.uint(4);
+                case 0xcf: return Number(this.view.getBigUint64(this.take(8)));
+                case 0xd0: return this.view.getInt8(this.take(1));
+                case 0xd1: return this.view.getInt16(this.take(2));
+                case 0xd2: return this.view.getInt32(this.take(4));
+                case 0xd3: return Number(this.view.getBigInt64(this.take(8)));
+                case 0xca: return this.view.getFloat32(this.take(4));
+                case 0xcb: return this.view.getFloat64(this.take(8));
+                case 0xd9: return this.str(this.uint(1));
+                case 0xda: return this.str(this.uint(2));
+                case 0xdb: return this.str(this.uint(4));
+                case 0xc4:
+                case 0xc5:
+                case 0xc6: {
+                    const length = this.uint(byte === 0xc4 ? 1 : byte === 0xc5 ? 2 : 4);
+                    const at = this.take(length);
+                    return this.bytes.slice(at, at + length);
+                }
+                case 0xdc: return this.array(this.uint(2));
+                case 0xdd: return this.array(this.uint(4));
+                case 0xde: return this.map(this.uint(2));
+                case 0xdf: return this.map(this.uint(4));
+                case 0xd7:
+                    if (this.view.getInt8(this.take(1)) === TIMESTAMP_EXT) {
+                        return msToMoscowIso(Number(this.view.getBigInt64(this.take(8))));
+                    }
+                    break;
+            }
+            throw new RangeError(`Unsupported MessagePack byte 0x${byte.toString(16)}`);
+        }
+    }
+
+    return {
+        /**
+         * Encode a message object as a binary frame
+         */
+        encode(message) {
+            const out = new Writer();
+            pack(message, out);
+            return out.result();
+        },
+
+        /**
+         * Decode a binary frame (ArrayBuffer or Uint8Array) into a message object
+         */
+        decode(buffer) {
+            const reader = new Reader(buffer);
+            const value = reader.value();
+            if (reader.position !== reader.bytes.length) {
+                throw new RangeError('Trailing bytes after frame');
+            }
+            return value;
+        }
+    };
+})();
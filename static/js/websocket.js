@@ -11,6 +11,20 @@ class ChatWebSocket {
         this.heartbeatInterval = null;
         this.messageQueue = [];
         this.eventListeners = {};
+        this.unackedMessages = new Map(); // client_msg_id -> outgoing message awaiting message_ack
+        this.maxUnackedMessages = 100;
+        this.pendingAckId = 0; // Highest received message id not yet acked
+        this.pendingBroadcastAckId = 0; // Highest received broadcast id not yet acked
+        this.ackTimer = null;
+        this.ackDelay = 500; // Batch acks for messages arriving close together
+        this.typingTarget = null; // Conversation the last typing signal went to
+        this.typingSentAt = 0;
+        this.typingTimer = null;
+        this.typingRefresh = 2000; // Repeat "typing" at most this often while keys are pressed
+        this.typingIdle = 3000; // Send "typing_stopped" after this long without input
+        // Wire format: 'json' text frames or 'compact' binary frames (see codec.js)
+        this.codec = (localStorage.getItem('chatCodec') === 'compact' && typeof ChatCodec !== 'undefined')
+            ? 'compact' : 'json';
         
         // Bind methods
         this.connect = this.connect.bind(this);
@@ -41,9 +55,17 @@ class ChatWebSocket {
         try {
             const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
             const host = window.location.host;
-            const wsUrl = `${protocol}//${host}/ws/${userData.login}?token=${encodeURIComponent(token)}`;
+            let wsUrl = `${protocol}//${host}/ws/${userData.login}?token=${encodeURIComponent(token)}`;
+            if (this.codec === 'compact') {
+                wsUrl += '&codec=compact';
+            }
+            // Admins receive bursts of stream events packed into batch frames
+            if (userData.is_admin) {
+                wsUrl += '&batch=1';
+            }
             
             this.ws = new WebSocket(wsUrl);
+            this.ws.binaryType = 'arraybuffer';
             
             this.ws.onopen = this.onOpen;
             this.ws.onmessage = this.onMessage;
@@ -84,15 +106,22 @@ class ChatWebSocket {
      */
     sendMessage(message) {
         if (!this.isConnected || !this.ws || this.ws.readyState !== WebSocket.OPEN) {
-            // Queue message for later sending
-            this.messageQueue.push(message);
+            // Queue message for later sending (tracked messages are resent from unackedMessages)
+            if (!this.isTracked(message)) {
+                this.messageQueue.push(message);
+            }
             this.emit('error', { message: 'Not connected to chat server' });
             return false;
         }
         
         try {
-            const messageStr = typeof message === 'string' ? message : JSON.stringify(message);
-            this.ws.send(messageStr);
+            if (typeof message === 'string') {
+                this.ws.send(message);
+            } else if (this.codec === 'compact') {
+                this.ws.send(ChatCodec.encode(message));
+            } else {
+                this.ws.send(JSON.stringify(message));
+            }
             return true;
         } catch (error) {
             console.error('Error sending message:', error);
@@ -101,11 +130,44 @@ class ChatWebSocket {
         }
     }
     
+    /**
+     * Generate a client message id so the server can drop retried frames
+     */
+    generateClientMessageId() {
+        if (window.crypto && window.crypto.randomUUID) {
+            return window.crypto.randomUUID();
+        }
+        return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
+    }
+    
+    /**
+     * Check whether a message is tracked until the server acknowledges it
+     */
+    isTracked(message) {
+        return !!(message && message.client_msg_id && this.unackedMessages.has(message.client_msg_id));
+    }
+    
+    /**
+     * Send a message that is retried with the same client id until acked
+     */
+    sendTrackedMessage(message) {
+        message.client_msg_id = this.generateClientMessageId();
+        this.unackedMessages.set(message.client_msg_id, message);
+        
+        // Bound memory if the server never answers
+        if (this.unackedMessages.size > this.maxUnackedMessages) {
+            const oldest = this.unackedMessages.keys().next().value;
+            this.unackedMessages.delete(oldest);
+        }
+        
+        return this.sendMessage(message);
+    }
+    
     /**
      * Send user message to admin
      */
     sendUserMessage(content) {
-        return this.sendMessage({
+        return this.sendTrackedMessage({
             type: 'user_to_admin',
             message: content
         });
@@ -115,7 +177,7 @@ class ChatWebSocket {
      * Send admin message to user
      */
     sendAdminMessage(content, toUser) {
-        return this.sendMessage({
+        return this.sendTrackedMessage({
             type: 'admin_to_user',
             to_user: toUser,
             message: content
@@ -123,13 +185,20 @@ class ChatWebSocket {
     }
     
     /**
-     * Send broadcast message (admin only)
+     * Send broadcast message (admin only).
+     * Optional segment {address, flat_from, flat_to} limits the recipients.
      */
-    sendBroadcast(content) {
-        return this.sendMessage({
+    sendBroadcast(content, segment = null) {
+        const message = {
             type: 'broadcast',
             message: content
-        });
+        };
+        if (segment && segment.address) {
+            message.address = segment.address;
+            message.flat_from = segment.flat_from;
+            message.flat_to = segment.flat_to;
+        }
+        return this.sendTrackedMessage(message);
     }
     
     /**
@@ -163,6 +232,148 @@ class ChatWebSocket {
         });
     }
     
+    /**
+     * Acknowledge delivery of everything up to messageId and/or broadcastId
+     */
+    ack(messageId, broadcastId = 0) {
+        const message = { type: 'ack' };
+        if (messageId) message.message_id = messageId;
+        if (broadcastId) message.broadcast_id = broadcastId;
+        return this.sendMessage(message);
+    }
+    
+    /**
+     * Schedule a batched ack for a received message id and/or broadcast id.
+     * Both watermarks go out together in one frame.
+     */
+    scheduleAck(messageId, broadcastId = 0, immediate = false) {
+        if (!messageId && !broadcastId) return;
+        
+        this.pendingAckId = Math.max(this.pendingAckId, messageId || 0);
+        this.pendingBroadcastAckId = Math.max(this.pendingBroadcastAckId, broadcastId || 0);
+        
+        if (this.ackTimer) {
+            clearTimeout(this.ackTimer);
+            this.ackTimer = null;
+        }
+        
+        const flush = () => {
+            this.ackTimer = null;
+            // Only ack over a live socket; otherwise the server replays from the old cursor
+            if ((this.pendingAckId || this.pendingBroadcastAckId) && this.isConnected) {
+                this.ack(this.pendingAckId, this.pendingBroadcastAckId);
+                this.pendingAckId = 0;
+                this.pendingBroadcastAckId = 0;
+            }
+        };
+        
+        if (immediate) {
+            flush();
+        } else {
+            this.ackTimer = setTimeout(flush, this.ackDelay);
+        }
+    }
+    
+    /**
+     * Full-text search over message history (admin only).
+     * Options: user, peer, date_from, date_to, limit, offset.
+     */
+    searchMessages(query, options = {}) {
+        return this.sendMessage({
+            type: 'search_messages',
+            query: query,
+            ...options
+        });
+    }
+    
+    /**
+     * Subscribe to the live activity feed (admin only); the server answers
+     * with the latest events and then pushes each new one
+     */
+    subscribeActivity(limit = 20) {
+        return this.sendMessage({
+            type: 'subscribe_activity',
+            limit: limit
+        });
+    }
+    
+    /**
+     * Stop receiving live activity events
+     */
+    unsubscribeActivity() {
+        return this.sendMessage({
+            type: 'unsubscribe_activity'
+        });
+    }
+    
+    /**
+     * Subscribe to server-side debug stats (admin only); the server pushes
+     * a debug_stats snapshot every few seconds
+     */
+    subscribeDebug() {
+        return this.sendMessage({
+            type: 'subscribe_debug'
+        });
+    }
+    
+    /**
+     * Stop receiving debug stats
+     */
+    unsubscribeDebug() {
+        return this.sendMessage({
+            type: 'unsubscribe_debug'
+        });
+    }
+    
+    /**
+     * Send a typing or viewing signal; it is never stored and may be
+     * dropped by the server's throttle. Admins name the tenant in toUser.
+     */
+    sendEphemeral(event, toUser = null) {
+        // Not queued while disconnected: a stale signal is worse than none
+        if (!this.isConnected) return false;
+        const message = { type: 'ephemeral', event: event };
+        if (toUser) {
+            message.to_user = toUser;
+        }
+        return this.sendMessage(message);
+    }
+    
+    /**
+     * Call on every keystroke: sends "typing" at most every typingRefresh ms
+     * and "typing_stopped" once input pauses
+     */
+    notifyTyping(toUser = null) {
+        const now = Date.now();
+        if (this.typingTarget !== toUser) {
+            this.stopTyping();
+        }
+        if (this.typingTarget !== toUser || now - this.typingSentAt >= this.typingRefresh) {
+            this.typingTarget = toUser;
+            this.typingSentAt = now;
+            this.sendEphemeral('typing', toUser);
+        }
+        if (this.typingTimer) {
+            clearTimeout(this.typingTimer);
+        }
+        this.typingTimer = setTimeout(() => this.stopTyping(), this.typingIdle);
+    }
+    
+    /**
+     * Tell the conversation typing has stopped (after sending or when idle)
+     */
+    stopTyping() {
+        if (this.typingTimer) {
+            clearTimeout(this.typingTimer);
+            this.typingTimer = null;
+        }
+        if (this.typingSentAt) {
+            this.sendEphemeral('typing_stopped', this.typingTarget);
+        }
+        this.typingTarget = null;
+        this.typingSentAt = 0;
+    }
+    
     /**
      * Request connected users list (admin only)
      */
@@ -199,6 +410,9 @@ class ChatWebSocket {
             this.sendMessage(message);
         }
         
+        // Retry messages the server never acknowledged; it drops ones it already stored
+        this.unackedMessages.forEach(message => this.sendMessage(message));
+        
         this.emit('connected');
     }
     
@@ -207,7 +421,9 @@ class ChatWebSocket {
      */
     onMessage(event) {
         try {
-            const data = JSON.parse(event.data);
+            const data = event.data instanceof ArrayBuffer
+                ? ChatCodec.decode(event.data)
+                : JSON.parse(event.data);
             this.handleMessage(data);
         } catch (error) {
             console.error('Error parsing WebSocket message:', error);
@@ -228,8 +444,28 @@ class ChatWebSocket {
             this.heartbeatInterval = null;
         }
         
+        // Unacked ids will be replayed by the server on reconnect
+        if (this.ackTimer) {
+            clearTimeout(this.ackTimer);
+            this.ackTimer = null;
+        }
+        this.pendingAckId = 0;
+        this.pendingBroadcastAckId = 0;
+        
         this.emit('disconnected', { code: event.code, reason: event.reason });
         
+        // Server is shedding load: reconnect after the delay it suggested
+        if (event.code === 4029) {
+            let retryAfter = this.reconnectDelay;
+            try {
+                retryAfter = JSON.parse(event.reason).retry_after_ms || retryAfter;
+            } catch (error) {
+                console.warn('Could not parse retry delay:', event.reason);
+            }
+            this.scheduleReconnect(retryAfter);
+            return;
+        }
+        
         // Attempt to reconnect if not intentionally closed
         if (event.code !== 1000 && this.reconnectAttempts < this.maxReconnectAttempts) {
             this.scheduleReconnect();
@@ -250,6 +486,20 @@ class ChatWebSocket {
     handleMessage(data) {
         const messageType = data.type;
         
+        // Coalesced admin events: handle each one in order
+        if (messageType === 'batch') {
+            (data.events || []).forEach(event => this.handleMessage(event));
+            return;
+        }
+        
+        // Acknowledge delivered messages and broadcasts so reconnects resume
+        // after them. Replayed ones are acked once by the summary that follows.
+        if (['user_message', 'admin_message'].includes(messageType)) {
+            this.scheduleAck(data.message_id);
+        } else if (messageType === 'broadcast') {
+            this.scheduleAck(0, data.broadcast_id);
+        }
+        
         switch (messageType) {
             case 'welcome':
                 this.emit('welcome', data);
@@ -283,6 +533,26 @@ class ChatWebSocket {
                 this.emit('conversationHistory', data);
                 break;
                 
+            case 'activity':
+                this.emit('activity', data);
+                break;
+                
+            case 'ephemeral':
+                this.emit('ephemeral', data);
+                break;
+                
+            case 'recent_activity':
+                this.emit('recentActivity', data);
+                break;
+                
+            case 'debug_stats':
+                this.emit('debugStats', data);
+                break;
+                
+            case 'search_results':
+                this.emit('searchResults', data);
+                break;
+                
             case 'conversations_list':
                 this.emit('conversationsList', data);
                 break;
@@ -292,9 +562,15 @@ class ChatWebSocket {
                 break;
                 
             case 'offline_messages_summary':
+                this.scheduleAck(data.cursor, data.broadcast_cursor, true);
                 this.emit('offlineMessagesSummary', data);
                 break;
                 
+            case 'message_ack':
+                this.unackedMessages.delete(data.client_msg_id);
+                this.emit('messageAck', data);
+                break;
+                
             case 'pong':
                 // Heartbeat response
                 break;
@@ -312,10 +588,13 @@ class ChatWebSocket {
     /**
      * Schedule reconnection attempt
      */
-    scheduleReconnect() {
-        this.reconnectAttempts++;
+    scheduleReconnect(serverDelay = null) {
+        // A server-suggested delay does not count against the attempt budget
+        if (serverDelay === null) {
+            this.reconnectAttempts++;
+        }
         
-        const delay = Math.min(
+        const delay = serverDelay !== null ? serverDelay : Math.min(
             this.reconnectDelay * Math.pow(2, this.reconnectAttempts - 1),
             this.maxReconnectDelay
         );
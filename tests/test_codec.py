@@ -0,0 +1,191 @@
+"""
+Round trips and malformed input for the compact wire codec
+"""
+import struct
+
+import pytest
+
+from utils.timezone import ms_to_moscow_iso
+from websocket.codec import TIMESTAMP_EXT, CodecError, CompactCodec, JsonCodec, decode_frame
+
+codec = CompactCodec()
+
+
+def round_trip(value):
+    return codec.decode(codec.encode(value))
+
+
+@pytest.mark.parametrize("value, marker, size", [
+    (0, None, 1),
+    (0x7f, None, 1),
+    (0x80, 0xcc, 2),
+    (0xff, 0xcc, 2),
+    (0x100, 0xcd, 3),
+    (0xffff, 0xcd, 3),
+    (0x10000, 0xce, 5),
+    (0xffffffff, 0xce, 5),
+    (0x100000000, 0xcf, 9),
+    (2 ** 64 - 1, 0xcf, 9),
+    (-1, None, 1),
+    (-32, None, 1),
+    (-33, 0xd0, 2),
+    (-0x80, 0xd0, 2),
+    (-0x81, 0xd1, 3),
+    (-0x8000, 0xd1, 3),
+    (-0x8001, 0xd2, 5),
+    (-0x80000000, 0xd2, 5),
+    (-0x80000001, 0xd3, 9),
+    (-2 ** 63, 0xd3, 9),
+])
+def test_int_width_boundaries(value, marker, size):
+    encoded = codec.encode(value)
+    assert len(encoded) == size
+    if marker is not None:
+        assert encoded[0] == marker
+    assert codec.decode(encoded) == value
+
+
+@pytest.mark.parametrize("length, marker, header", [
+    (0, 0xa0, 1),
+    (31, 0xbf, 1),
+    (32, 0xd9, 2),
+    (0xff, 0xd9, 2),
+    (0x100, 0xda, 3),
+    (0xffff, 0xda, 3),
+    (0x10000, 0xdb, 5),
+])
+def test_str_lengths(length, marker, header):
+    value = "x" * length
+    encoded = codec.encode(value)
+    assert encoded[0] == marker
+    assert len(encoded) == header + length
+    assert codec.decode(encoded) == value
+
+
+def test_str_length_counts_utf8_bytes():
+    value = "ж" * 16  # 32 bytes in UTF-8
+    encoded = codec.encode(value)
+    assert encoded[0] == 0xd9
+    assert codec.decode(encoded) == value
+
+
+@pytest.mark.parametrize("length, marker, header", [
+    (0, 0xc4, 2),
+    (0xff, 0xc4, 2),
+    (0x100, 0xc5, 3),
+    (0xffff, 0xc5, 3),
+    (0x10000, 0xc6, 5),
+])
+def test_bin_lengths(length, marker, header):
+    value = bytes(range(256)) * (length // 256) + bytes(length % 256)
+    encoded = codec.encode(value)
+    assert encoded[0] == marker
+    assert len(encoded) == header + length
+    assert codec.decode(encoded) == value
+
+
+@pytest.mark.parametrize("length, marker", [(15, 0x9f), (16, 0xdc), (0x10000, 0xdd)])
+def test_array_lengths(length, marker):
+    value = list(range(length))
+    encoded = codec.encode(value)
+    assert encoded[0] == marker
+    assert codec.decode(encoded) == value
+
+
+@pytest.mark.parametrize("length, marker", [(15, 0x8f), (16, 0xde)])
+def test_map_lengths(length, marker):
+    value = {f"key{i}": i for i in range(length)}
+    encoded = codec.encode(value)
+    assert encoded[0] == marker
+    assert codec.decode(encoded) == value
+
+
+def test_known_fields_and_types_are_tagged():
+    message = {"type": "user_message", "message": "hi", "extra": [1.5, None, True, False]}
+    encoded = codec.encode(message)
+    assert b"user_message" not in encoded
+    assert b"message" not in encoded.replace(b"hi", b"")
+    assert b"extra" in encoded
+    assert codec.decode(encoded) == message
+
+
+def test_unknown_type_string_is_sent_as_is():
+    assert round_trip({"type": "not_in_table"}) == {"type": "not_in_table"}
+
+
+@pytest.mark.parametrize("message_type", [5, 5.0, None, ["ping"]])
+def test_non_string_type_is_rejected(message_type):
+    with pytest.raises(TypeError):
+        codec.encode({"type": message_type})
+
+
+def test_non_string_keys_are_stringified():
+    assert round_trip({1: "a"}) == {"1": "a"}
+
+
+@pytest.mark.parametrize("ms", [
+    0,
+    1704099600123,   # 2024-01-01T12:00:00.123+03:00
+    1704099600999,
+    1700000000001,
+    253402289999999,  # 9999-12-31T23:59:59.999 UTC
+])
+def test_timestamp_extension(ms):
+    value = ms_to_moscow_iso(ms)
+    encoded = codec.encode({"timestamp": value})
+    marker = encoded.index(0xd7)
+    assert encoded[marker + 1] == TIMESTAMP_EXT
+    assert struct.unpack_from(">q", encoded, marker + 2)[0] == ms
+    assert codec.decode(encoded) == {"timestamp": value}
+
+
+def test_timestamp_extension_is_exact_to_the_millisecond():
+    for ms in range(1704099600000, 1704099602000):
+        encoded = codec.encode({"timestamp": ms_to_moscow_iso(ms)})
+        assert struct.unpack_from(">q", encoded, len(encoded) - 8)[0] == ms
+
+
+@pytest.mark.parametrize("value", ["not a time+03:00", "2024-01-01T12:00:00Z", "2024-01-01"])
+def test_timestamp_field_that_is_not_a_moscow_time_stays_a_string(value):
+    encoded = codec.encode({"timestamp": value})
+    assert 0xd7 not in encoded
+    assert codec.decode(encoded) == {"timestamp": value}
+
+
+def test_every_truncation_is_rejected():
+    encoded = codec.encode({
+        "type": "conversation_history",
+        "messages": [{"id": 70000, "content": "x" * 40, "timestamp": ms_to_moscow_iso(1704099600123)}],
+        "blob": b"\x00" * 300,
+        "count": -200,
+    })
+    for end in range(len(encoded)):
+        with pytest.raises(CodecError):
+            codec.decode(encoded[:end])
+
+
+@pytest.mark.parametrize("data", [
+    codec.encode({"type": "ping"}) + b"\x00",   # trailing bytes
+    bytes([0x81, 0x7f, 0x00]),                   # unknown field tag
+    bytes([0x81, 0x00, 0x7f]),                   # unknown type tag
+    bytes([0xc1]),                               # never used in MessagePack
+    bytes([0xd7, 0x02]) + bytes(8),              # unknown extension type
+    bytes([0x81, 0xc0, 0x00]),                   # nil map key
+    bytes([0xa2, 0xff, 0xfe]),                   # invalid UTF-8
+    bytes([0xdb, 0xff, 0xff, 0xff, 0xff]),       # length past the end
+])
+def test_malformed_frames_are_rejected(data):
+    with pytest.raises(CodecError):
+        codec.decode(data)
+
+
+def test_text_is_not_a_compact_frame():
+    with pytest.raises(CodecError):
+        codec.decode('{"type": "ping"}')
+
+
+def test_decode_frame_picks_codec_by_frame_kind():
+    assert decode_frame('{"type": "ping"}') == {"type": "ping"}
+    assert decode_frame(codec.encode({"type": "ping"})) == {"type": "ping"}
+    with pytest.raises(CodecError):
+        JsonCodec().decode("{not json")
@@ -0,0 +1,89 @@
+"""
+Parsing of streamed CSV and NDJSON user imports
+"""
+import asyncio
+import csv
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from routers.ops import iter_upload_records
+
+HEADER = "first_name,last_name,patronymic,login,password,address,flat,is_admin\n"
+
+
+class UploadStub:
+    """Stands in for a Request whose body arrives in small chunks"""
+
+    def __init__(self, body: bytes, chunk_size: int = 7):
+        self.body = body
+        self.chunk_size = chunk_size
+
+    async def stream(self):
+        for start in range(0, len(self.body), self.chunk_size):
+            yield self.body[start:start + self.chunk_size]
+
+
+def parse(body: str, format: str = "csv", chunk_size: int = 7) -> list:
+    async def collect():
+        return [record async for record in iter_upload_records(UploadStub(body.encode(), chunk_size), format)]
+    return asyncio.run(collect())
+
+
+def row(login: str, address: str = "Lenina 1") -> str:
+    return f'Ivan,Ivanov,Ivanovich,{login},secret,"{address}",5,false\n'
+
+
+def test_csv_rows_become_records():
+    records = parse(HEADER + row("a@q.com") + "\n" + row("b@q.com"))
+    assert [(number, record["login"], error) for number, record, error in records] == [
+        (1, "a@q.com", None), (2, "b@q.com", None)
+    ]
+
+
+def test_quoted_field_may_span_lines():
+    records = parse(HEADER + row("a@q.com", 'Lenina 1\nkorpus "B"'.replace('"', '""')) + row("b@q.com"))
+    assert records[0][1]["address"] == 'Lenina 1\nkorpus "B"'
+    assert records[1][1]["login"] == "b@q.com"
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 4096])
+def test_parsing_does_not_depend_on_chunking(chunk_size):
+    body = "﻿" + HEADER.replace("\n", "\r\n") + row("a@q.com", "Мира\n7").replace("\n", "\r\n")
+    records = parse(body, chunk_size=chunk_size)
+    assert len(records) == 1
+    assert records[0][1]["address"] == "Мира\r\n7"
+    assert records[0][1]["is_admin"] == "false"
+
+
+# csv.Error, which is not a ValueError, e.g. for a field over the size limit
+OVERSIZED = "x" * (csv.field_size_limit() + 1)
+
+
+def test_malformed_row_is_reported_and_import_continues():
+    records = parse(HEADER + row("a@q.com", OVERSIZED) + "only,three,columns\n" + row("c@q.com"), chunk_size=65536)
+    assert [number for number, _, _ in records] == [1, 2, 3]
+    assert records[0][1] is None and "field larger than field limit" in records[0][2]
+    assert records[1][1] is None and "columns" in records[1][2]
+    assert records[2][1]["login"] == "c@q.com"
+
+
+@pytest.mark.parametrize("body", [
+    "",
+    "\n\n",
+    "first_name,last_name\n" + row("a@q.com"),
+    HEADER.replace("\n", f",{OVERSIZED}\n") + row("a@q.com"),
+])
+def test_missing_or_bad_header_is_a_400(body):
+    with pytest.raises(HTTPException) as raised:
+        parse(body)
+    assert raised.value.status_code == 400
+
+
+def test_ndjson_records_and_errors():
+    lines = [json.dumps({"login": "a@q.com"}), "", "[1, 2]", "{broken", json.dumps({"login": "b@q.com"})]
+    records = parse("\n".join(lines), format="ndjson")
+    assert [(number, record and record["login"]) for number, record, _ in records] == [
+        (1, "a@q.com"), (2, None), (3, None), (4, "b@q.com")
+    ]
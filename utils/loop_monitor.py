@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Optional
+
+from fastapi import HTTPException
+
+from utils.metrics import load_shed, registry
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_ENABLED = os.getenv("LOOP_LAG_ENABLED", "1") == "1"
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.05"))
+# Smoothed lag at which expensive requests wait for the loop to catch up
+LOOP_LAG_DEFER_MS = float(os.getenv("LOOP_LAG_DEFER_MS", "100"))
+# Smoothed lag at which new WebSocket connects are turned away
+LOOP_LAG_REJECT_MS = float(os.getenv("LOOP_LAG_REJECT_MS", "300"))
+# How long a deferred request waits before it is answered "busy"
+LOOP_LAG_MAX_DEFER_SECONDS = float(os.getenv("LOOP_LAG_MAX_DEFER_SECONDS", "2"))
+LOOP_LAG_SMOOTHING = 0.3
+
+# Shedding levels, in the order work is given up
+NORMAL = 0
+DEFER = 1
+REJECT = 2
+LEVEL_NAMES = {NORMAL: "normal", DEFER: "defer", REJECT: "reject"}
+
+
+class LoopLagMonitor:
+    """Measures event-loop lag and decides what work to shed.
+
+    A task sleeps interval seconds and records how late it woke up; the
+    overshoot is how long ready callbacks waited behind other work. The
+    smoothed lag moves between levels with hysteresis (a level is left once
+    lag falls below half its threshold) so shedding does not flap:
+
+      DEFER   history, conversation lists, search and stats over HTTP wait
+              for capacity and are answered "busy" if it does not come back
+              in time; over a WebSocket they are answered "busy" at once, so
+              the connection's own live frames are not held up behind them
+      REJECT  new WebSocket connects also get the retry-later close
+
+    Live message delivery and pings are never shed.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = LOOP_LAG_ENABLED,
+        interval: float = LOOP_LAG_INTERVAL,
+        defer_ms: float = LOOP_LAG_DEFER_MS,
+        reject_ms: float = LOOP_LAG_REJECT_MS,
+        max_defer: float = LOOP_LAG_MAX_DEFER_SECONDS
+    ):
+        self.enabled = enabled
+        self.interval = interval
+        self.defer_seconds = defer_ms / 1000
+        self.reject_seconds = reject_ms / 1000
+        self.max_defer = max_defer
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.level = NORMAL
+        self.level_changes = 0
+        self._capacity: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start sampling on the running loop"""
+        if self.enabled and self._task is None:
+            self._capacity = asyncio.Event()
+            self._capacity.set()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.lag = 0.0
+        self.level = NORMAL
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.observe(max(0.0, time.perf_counter() - started - self.interval))
+
+    def observe(self, lag: float):
+        """Fold one lag sample into the smoothed value and update the level"""
+        self.lag += LOOP_LAG_SMOOTHING * (lag - self.lag)
+        self.max_lag = max(self.max_lag, lag)
+        level = self._level_for(self.lag)
+        if level != self.level:
+            logger.warning(
+                f"Event loop lag {self.lag * 1000:.0f} ms: shedding level "
+                f"{LEVEL_NAMES[self.level]} -> {LEVEL_NAMES[level]}"
+            )
+            self.level = level
+            self.level_changes += 1
+        if self._capacity is not None:
+            if self.level == NORMAL:
+                self._capacity.set()
+            else:
+                self._capacity.clear()
+
+    def _level_for(self, lag: float) -> int:
+        if lag >= self.reject_seconds or (self.level == REJECT and lag >= self.reject_seconds / 2):
+            return REJECT
+        if lag >= self.defer_seconds or (self.level >= DEFER and lag >= self.defer_seconds / 2):
+            return DEFER
+        return NORMAL
+
+    @property
+    def rejecting_connects(self) -> bool:
+        return self.level >= REJECT
+
+    async def wait_for_capacity(self, action: str) -> bool:
+        """Hold an expensive request until the loop catches up.
+
+        Returns False if it is still overloaded after max_defer seconds;
+        the caller should then answer "busy" instead of doing the work.
+        """
+        if self.level == NORMAL or self._capacity is None:
+            return True
+        load_shed.labels(f"{action}_deferred").inc()
+        try:
+            await asyncio.wait_for(self._capacity.wait(), timeout=self.max_defer)
+            return True
+        except asyncio.TimeoutError:
+            load_shed.labels(f"{action}_rejected").inc()
+            return False
+
+    def has_capacity(self, action: str) -> bool:
+        """Non-waiting check for callers that must not block; counts a refusal"""
+        if self.level == NORMAL:
+            return True
+        load_shed.labels(f"{action}_rejected").inc()
+        return False
+
+    def retry_after(self) -> float:
+        """Suggested delay before retrying shed work, jittered"""
+        return self.max_defer + random.uniform(0, self.max_defer)
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "lag_ms": round(self.lag * 1000, 3),
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "level": LEVEL_NAMES[self.level],
+            "level_changes": self.level_changes,
+            "defer_ms": self.defer_seconds * 1000,
+            "reject_ms": self.reject_seconds * 1000,
+        }
+
+
+async def defer_when_overloaded():
+    """Dependency for expensive endpoints: wait out loop lag or answer 503"""
+    if not await loop_monitor.wait_for_capacity("http"):
+        raise HTTPException(
+            status_code=503,
+            detail="Сервер перегружен, попробуйте позже",
+            headers={"Retry-After": str(max(1, round(loop_monitor.retry_after())))}
+        )
+
+
+# Global event loop lag monitor instance
+loop_monitor = LoopLagMonitor()
+
+registry.gauge(
+    "chat_event_loop_lag_seconds", "Smoothed event loop lag",
+    callback=lambda: loop_monitor.lag
+)
+registry.gauge(
+    "chat_load_shed_level", "Load shedding level: 0 normal, 1 defer, 2 reject connects",
+    callback=lambda: loop_monitor.level
+)
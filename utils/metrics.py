@@ -0,0 +1,295 @@
+import functools
+import os
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Label sets past this many per metric are folded into one "other" series,
+# so a client sending made-up frame types cannot grow the registry
+METRICS_MAX_SERIES = int(os.getenv("METRICS_MAX_SERIES", "100"))
+
+OTHER = "other"
+
+# Seconds; covers a sub-millisecond socket write up to a slow SQLite commit
+DEFAULT_LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+
+class HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        # Per-bucket counts; made cumulative only when exposed
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric(ABC):
+    """A named metric with a fixed list of label names.
+
+    Children are created on the first use of a label set and then reused;
+    hot paths should bind them once with labels() and keep the child.
+    Everything runs on the event loop, so no locking is needed.
+    """
+
+    type_name = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), max_series: int = METRICS_MAX_SERIES):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.max_series = max_series
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.label_names:
+            self._default = self._new_child()
+            self._children[()] = self._default
+
+    @abstractmethod
+    def _new_child(self):
+        """A fresh child holding the values of one label set"""
+
+    def labels(self, *values: str):
+        """Child for a label set, created on first use"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}")
+            if len(self._children) >= self.max_series:
+                values = (OTHER,) * len(self.label_names)
+                child = self._children.get(values)
+            if child is None:
+                child = self._new_child()
+                self._children[values] = child
+        return child
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """Exposition lines for every child"""
+
+    def expose(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, values)} {_format_value(child.value)}"
+            for values, child in self._children.items()
+        ]
+
+
+class Gauge(Metric):
+    """Gauge that is set directly, or computed at scrape time by a callback.
+
+    A callback returns either a number or, for labelled gauges, a mapping of
+    label value tuples to numbers; it costs nothing until /metrics is read.
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, *args, callback: Optional[Callable] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.callback = callback
+
+    def _new_child(self):
+        return GaugeChild()
+
+    def set(self, value: float):
+        self._default.set(value)
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default.dec(amount)
+
+    def samples(self) -> List[str]:
+        if self.callback is not None:
+            values = self.callback()
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            values = {label_values: child.value for label_values, child in self._children.items()}
+        return [
+            f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}"
+            for label_values, value in values.items()
+        ]
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS, **kwargs):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(*args, **kwargs)
+
+    def _new_child(self):
+        return HistogramChild(self.bounds)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float("inf"),), child.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, values, le)} {cumulative}")
+            labels = _format_labels(self.label_names, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """All metrics of the process, rendered in Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = (), **kwargs) -> Counter:
+        return self.register(Counter(name, help, labels, **kwargs))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = (), **kwargs) -> Gauge:
+        return self.register(Gauge(name, help, labels, **kwargs))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), **kwargs) -> Histogram:
+        return self.register(Histogram(name, help, labels, **kwargs))
+
+    def expose(self) -> str:
+        return "\n".join(metric.expose() for metric in self._metrics.values()) + "\n"
+
+
+def timed(child: HistogramChild):
+    """Decorator recording the duration of a coroutine function in a histogram child"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+# Global metrics registry
+registry = MetricsRegistry()
+
+# WebSocket connections
+ws_connects = registry.counter("chat_ws_connects_total", "WebSocket connections accepted", ["role"])
+ws_disconnects = registry.counter("chat_ws_disconnects_total", "WebSocket connections closed", ["role"])
+ws_frames = registry.counter("chat_ws_frames_received_total", "Inbound WebSocket frames by type", ["type"])
+ws_bytes_sent = registry.counter(
+    "chat_ws_bytes_sent_total", "Payload bytes sent, before permessage-deflate, by codec", ["codec"]
+)
+ws_send_failures = registry.counter(
+    "chat_ws_send_failures_total", "Failed sends to a connection, by delivery path", ["path"]
+)
+ws_handshakes = registry.counter(
+    "chat_ws_handshakes_total", "WebSocket connects admitted or queued for a handshake slot", ["outcome"]
+)
+ws_handshakes_rejected = registry.counter(
+    "chat_ws_handshakes_rejected_total", "WebSocket connects refused by admission control, by reason", ["reason"]
+)
+ws_batch_events = registry.histogram(
+    "chat_ws_batch_events", "Events per coalesced admin frame",
+    buckets=(1, 2, 5, 10, 20, 50, 100)
+)
+
+ephemeral_events = registry.counter(
+    "chat_ephemeral_events_total", "Typing and viewing signals by outcome", ["outcome"]
+)
+
+# Fan-out of one frame to many connections
+fanout_seconds = registry.histogram(
+    "chat_fanout_seconds", "Time to deliver one frame to all its recipients", ["operation"]
+)
+fanout_recipients = registry.counter(
+    "chat_fanout_recipients_total", "Frames delivered by fan-out operations", ["operation"]
+)
+
+# Message storage
+message_manager_seconds = registry.histogram(
+    "chat_message_manager_seconds", "MessageManager method latency", ["method"]
+)
+
+# Load shedding under event loop lag
+load_shed = registry.counter("chat_load_shed_total", "Work deferred or refused because the event loop lagged", ["action"])
+
+# Database
+db_query_seconds = registry.histogram("chat_db_query_seconds", "SQL statement execution time", ["statement"])
+db_query_errors = registry.counter("chat_db_query_errors_total", "SQL statements that raised", ["statement"])
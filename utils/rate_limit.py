@@ -0,0 +1,84 @@
+"""
+Token-bucket rate limiting primitives
+"""
+
+from collections import OrderedDict
+from typing import Optional
+import time
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, at most `capacity` stored"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def acquire(self, cost: float = 1.0, now: Optional[float] = None) -> float:
+        """Take `cost` tokens if available.
+
+        Returns 0.0 on success, otherwise the number of seconds until enough
+        tokens will have accumulated (nothing is taken in that case).
+        """
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (cost - self.tokens) / self.rate
+
+    def refund(self, cost: float = 1.0):
+        """Give back tokens taken by acquire() for work that did not happen"""
+        self.tokens = min(self.capacity, self.tokens + cost)
+
+
+class KeyedTokenBuckets:
+    """Token buckets per key with LRU eviction to bound memory.
+
+    An evicted key simply starts again with a full bucket, which is the
+    same state as a key that has been idle long enough to refill.
+    """
+
+    def __init__(self, rate: float, capacity: float, max_keys: int = 10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def acquire(self, key: str, cost: float = 1.0) -> float:
+        """Take tokens from the bucket for `key`; see TokenBucket.acquire"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.capacity, now)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.acquire(cost, now)
+
+    def refund(self, key: str, cost: float = 1.0):
+        """Give back tokens taken for `key`; a no-op if it was evicted since"""
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.refund(cost)
+
+    def forget(self, key: str):
+        """Drop the bucket for `key`"""
+        self._buckets.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
@@ -2,18 +2,94 @@
 Утилиты для работы с временными зонами
 """
 
+import os
+import time
 from datetime import datetime, timezone, timedelta
+from functools import lru_cache
+from typing import Optional
 
 # Московское время (UTC+3)
 MOSCOW_TZ = timezone(timedelta(hours=3))
+MOSCOW_OFFSET_MS = 3 * 3600 * 1000
+MOSCOW_OFFSET_SUFFIX = "+03:00"
+
+# Шаг грубых часов в миллисекундах: в пределах шага время и его ISO-строка
+# берутся из кэша
+COARSE_CLOCK_RESOLUTION_MS = int(os.getenv("COARSE_CLOCK_RESOLUTION_MS", "10"))
+
+
+def now_ms() -> int:
+    """Текущее время в миллисекундах с начала эпохи (UTC)"""
+    return time.time_ns() // 1_000_000
+
+
+@lru_cache(maxsize=4096)
+def _moscow_second_prefix(seconds: int) -> str:
+    return datetime.fromtimestamp(seconds, MOSCOW_TZ).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def ms_to_moscow_iso(ms: int) -> str:
+    """Миллисекунды эпохи в ISO строку московского времени.
+
+    Префикс до секунд кэшируется, поэтому сообщения одной секунды
+    форматируются без создания datetime.
+    """
+    seconds, millis = divmod(ms, 1000)
+    return f"{_moscow_second_prefix(seconds)}.{millis:03d}{MOSCOW_OFFSET_SUFFIX}"
+
+
+def ms_to_moscow_time(ms: int) -> datetime:
+    """Миллисекунды эпохи в datetime московского времени"""
+    return datetime.fromtimestamp(ms / 1000, MOSCOW_TZ)
+
+
+def datetime_to_ms(dt: datetime) -> int:
+    """datetime в миллисекунды эпохи; время без зоны считается московским"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=MOSCOW_TZ)
+    return int(dt.timestamp() * 1000)
+
+
+class CoarseClock:
+    """Часы с точностью до resolution_ms.
+
+    Исходящие кадры помечаются временем на каждом send; в пределах одного
+    шага они получают одно и то же значение и одну и ту же ISO-строку,
+    которая форматируется лишь однажды.
+    """
+
+    def __init__(self, resolution_ms: int = COARSE_CLOCK_RESOLUTION_MS):
+        self.resolution_ms = max(1, resolution_ms)
+        self._tick = -1
+        self._ms = 0
+        self._iso: Optional[str] = None
+
+    def now_ms(self) -> int:
+        tick = now_ms() // self.resolution_ms
+        if tick != self._tick:
+            self._tick = tick
+            self._ms = tick * self.resolution_ms
+            self._iso = None
+        return self._ms
+
+    def now_iso(self) -> str:
+        ms = self.now_ms()
+        if self._iso is None:
+            self._iso = ms_to_moscow_iso(ms)
+        return self._iso
+
+
+# Глобальные грубые часы
+coarse_clock = CoarseClock()
+
 
 def get_moscow_time() -> datetime:
     """Получить текущее время в московской временной зоне (UTC+3)"""
     return datetime.now(MOSCOW_TZ)
 
 def get_moscow_time_iso() -> str:
-    """Получить текущее время в московской временной зоне в формате ISO"""
-    return get_moscow_time().isoformat()
+    """Получить текущее время в московской временной зоне в формате ISO (по грубым часам)"""
+    return coarse_clock.now_iso()
 
 def to_moscow_time(dt: datetime) -> datetime:
     """Конвертировать datetime в московское время"""
@@ -29,4 +105,11 @@ def to_moscow_time_iso(dt: datetime) -> str:
 def parse_iso_to_moscow(iso_string: str) -> datetime:
     """Парсить ISO строку и конвертировать в московское время"""
     dt = datetime.fromisoformat(iso_string.replace('Z', '+00:00'))
-    return to_moscow_time(dt)
\ No newline at end of file
+    return to_moscow_time(dt)
+
+def parse_moscow_datetime(iso_string: str) -> datetime:
+    """Парсить ISO строку в московское время; время без зоны считается московским"""
+    dt = datetime.fromisoformat(iso_string.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=MOSCOW_TZ)
+    return dt.astimezone(MOSCOW_TZ)
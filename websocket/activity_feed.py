@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from sqlalchemy import desc, select
+
+from database.database import new_async_session
+from schemas.schemas import BroadcastModel, MessageModel, UserModel
+from utils.timezone import get_moscow_time_iso, ms_to_moscow_iso
+from websocket.codec import Frame
+from websocket.coalescing import coalescer
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_FEED_SIZE = int(os.getenv("ACTIVITY_FEED_SIZE", "200"))
+
+
+class ActivityFeed:
+    """The latest messages across all conversations, kept in memory.
+
+    Entries are appended once per logical message with the sender name
+    already resolved, so the admin activity view and its live stream never
+    touch the messages table. The ring buffer is filled once at startup from
+    the newest rows by primary key.
+
+    Recording never waits on subscribers: frames for them are queued and
+    sent in order by a single background task, and a subscriber that falls
+    more than `size` events behind loses the oldest ones.
+    """
+
+    def __init__(self, size: int = ACTIVITY_FEED_SIZE):
+        self.size = size
+        self._entries: Deque[Dict[str, Any]] = deque(maxlen=size)
+        self.subscribers: Set[str] = set()
+        self._outbox: Deque[Frame] = deque(maxlen=size)
+        self._pusher: Optional[asyncio.Task] = None
+
+    async def warm(self):
+        """Fill the buffer with the newest messages and broadcasts"""
+        async with new_async_session() as session:
+            message_rows = (await session.execute(
+                select(MessageModel, UserModel.first_name, UserModel.last_name).outerjoin(
+                    UserModel, MessageModel.sender_id == UserModel.login
+                ).order_by(desc(MessageModel.id)).limit(self.size)
+            )).all()
+            broadcast_rows = (await session.execute(
+                select(BroadcastModel, UserModel.first_name, UserModel.last_name).outerjoin(
+                    UserModel, BroadcastModel.sender_id == UserModel.login
+                ).order_by(desc(BroadcastModel.id)).limit(self.size)
+            )).all()
+
+        entries = []
+        seen_copies = set()
+        for message, first_name, last_name in message_rows:
+            # A tenant message is stored once per admin; list it once
+            if message.message_type == "user_message":
+                copy_key = (message.sender_id, message.timestamp, message.content)
+                if copy_key in seen_copies:
+                    continue
+                seen_copies.add(copy_key)
+            sender_name = f"{first_name} {last_name}" if first_name else message.sender_id
+            entries.append(self.message_entry(message, sender_name))
+        for broadcast, first_name, last_name in broadcast_rows:
+            sender_name = f"{first_name} {last_name}" if first_name else broadcast.sender_id
+            entries.append(self.broadcast_entry(broadcast, sender_name))
+        entries.sort(key=lambda entry: entry["timestamp"])
+
+        self._entries.clear()
+        self._entries.extend(entries[-self.size:])
+        logger.info(f"Activity feed warmed with {len(self._entries)} entries")
+
+    @staticmethod
+    def message_entry(message: MessageModel, sender_name: str) -> Dict[str, Any]:
+        return {
+            "kind": "message",
+            "id": message.id,
+            "sender_id": message.sender_id,
+            "sender_name": sender_name,
+            "recipient_id": message.recipient_id,
+            "content": message.content,
+            "timestamp": ms_to_moscow_iso(message.timestamp),
+            "message_type": message.message_type,
+        }
+
+    @staticmethod
+    def broadcast_entry(broadcast: BroadcastModel, sender_name: str) -> Dict[str, Any]:
+        return {
+            "kind": "broadcast",
+            "id": broadcast.id,
+            "sender_id": broadcast.sender_id,
+            "sender_name": sender_name,
+            "recipient_id": "broadcast",
+            "content": broadcast.content,
+            "timestamp": ms_to_moscow_iso(broadcast.timestamp),
+            "message_type": "broadcast",
+            "address": broadcast.address,
+        }
+
+    def record_message(self, message: MessageModel):
+        """Record a freshly saved message; never fails the caller"""
+        from websocket.connection_manager import manager
+
+        try:
+            self.add(self.message_entry(message, manager._get_user_display_name(message.sender_id)))
+        except Exception as e:
+            logger.error(f"Failed to record activity: {e}")
+
+    def record_broadcast(self, broadcast: BroadcastModel):
+        """Record a freshly saved broadcast; never fails the caller"""
+        from websocket.connection_manager import manager
+
+        try:
+            self.add(self.broadcast_entry(broadcast, manager._get_user_display_name(broadcast.sender_id)))
+        except Exception as e:
+            logger.error(f"Failed to record activity: {e}")
+
+    def add(self, entry: Dict[str, Any]):
+        """Append an entry and queue it for subscribed admins"""
+        self._entries.append(entry)
+        if not self.subscribers:
+            return
+
+        self._outbox.append(Frame({
+            "type": "activity",
+            "event": entry,
+            "timestamp": get_moscow_time_iso()
+        }))
+        if self._pusher is None:
+            self._pusher = asyncio.create_task(self._push())
+
+    async def _push(self):
+        """Send queued frames to subscribers until the outbox is empty"""
+        from websocket.connection_manager import manager
+
+        try:
+            while self._outbox:
+                frame = self._outbox.popleft()
+                for user_id in list(self.subscribers):
+                    websocket = manager.active_connections.get(user_id)
+                    if websocket is None:
+                        self.subscribers.discard(user_id)
+                        continue
+                    try:
+                        await coalescer.send(user_id, websocket, frame)
+                    except Exception as e:
+                        logger.error(f"Failed to push activity to {user_id}: {e}")
+                        self.subscribers.discard(user_id)
+        finally:
+            self._pusher = None
+
+    def recent(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Newest entries first, at most limit of them"""
+        entries = list(reversed(self._entries))
+        return entries if limit is None else entries[:limit]
+
+    def clear(self):
+        self._entries.clear()
+        self._outbox.clear()
+
+    def subscribe(self, user_id: str):
+        self.subscribers.add(user_id)
+
+    def unsubscribe(self, user_id: str):
+        self.subscribers.discard(user_id)
+
+
+# Global activity feed instance
+activity_feed = ActivityFeed()
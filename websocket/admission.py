@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+import os
+import random
+from typing import Dict, Optional
+
+from fastapi import WebSocket
+
+from utils.loop_monitor import loop_monitor
+from utils.metrics import load_shed, registry, ws_handshakes, ws_handshakes_rejected
+from utils.rate_limit import KeyedTokenBuckets
+
+logger = logging.getLogger(__name__)
+
+# Close code telling the client to reconnect later; the reason carries
+# {"retry_after_ms": N} with server-chosen jitter so retries spread out.
+RETRY_LATER_CLOSE_CODE = 4029
+
+WS_HANDSHAKE_CONCURRENCY = int(os.getenv("WS_HANDSHAKE_CONCURRENCY", "32"))
+WS_HANDSHAKE_QUEUE_TIMEOUT = float(os.getenv("WS_HANDSHAKE_QUEUE_TIMEOUT", "5"))
+WS_CONNECT_RATE_PER_IP = float(os.getenv("WS_CONNECT_RATE_PER_IP", "10"))
+WS_CONNECT_BURST_PER_IP = float(os.getenv("WS_CONNECT_BURST_PER_IP", "50"))
+WS_CONNECT_RATE_PER_LOGIN = float(os.getenv("WS_CONNECT_RATE_PER_LOGIN", "0.5"))
+WS_CONNECT_BURST_PER_LOGIN = float(os.getenv("WS_CONNECT_BURST_PER_LOGIN", "5"))
+WS_RETRY_BASE_SECONDS = float(os.getenv("WS_RETRY_BASE_SECONDS", "1"))
+WS_RETRY_JITTER_SECONDS = float(os.getenv("WS_RETRY_JITTER_SECONDS", "5"))
+
+
+class AdmissionController:
+    """Admission control for new WebSocket connections.
+
+    A connect is admitted only if the event loop is not so far behind that
+    connects are being shed, the per-IP token bucket allows it and a
+    handshake slot frees up within the queue timeout. The slot covers
+    authentication, offline replay and admin notifications, and is
+    released before the connection enters its message loop.
+
+    The per-login bucket is charged by admit_login() only once the token
+    has been verified for that login, so unauthenticated connects to
+    /ws/<login> cannot lock the real user out.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = WS_HANDSHAKE_CONCURRENCY,
+        queue_timeout: float = WS_HANDSHAKE_QUEUE_TIMEOUT,
+        retry_base: float = WS_RETRY_BASE_SECONDS,
+        retry_jitter: float = WS_RETRY_JITTER_SECONDS
+    ):
+        self.concurrency = concurrency
+        self.queue_timeout = queue_timeout
+        self.retry_base = retry_base
+        self.retry_jitter = retry_jitter
+        self.ip_buckets = KeyedTokenBuckets(WS_CONNECT_RATE_PER_IP, WS_CONNECT_BURST_PER_IP)
+        self.login_buckets = KeyedTokenBuckets(WS_CONNECT_RATE_PER_LOGIN, WS_CONNECT_BURST_PER_LOGIN)
+        self._slots = asyncio.Semaphore(concurrency)
+
+        self.in_progress = 0
+        self.queued = 0
+        self.admitted_total = 0
+        self.queued_total = 0
+        self.rejected_total: Dict[str, int] = {}
+
+    async def admit(self, client_ip: str) -> Optional[float]:
+        """Try to admit a connect.
+
+        Returns None once a handshake slot is held (call release() when the
+        handshake finishes), or the suggested retry delay in seconds.
+        """
+        if loop_monitor.rejecting_connects:
+            load_shed.labels("ws_connect_rejected").inc()
+            return self._reject("loop_lag", loop_monitor.retry_after())
+
+        wait = self.ip_buckets.acquire(client_ip)
+        if wait:
+            return self._reject("ip_rate", wait)
+
+        if self._slots.locked():
+            self.queued += 1
+            self.queued_total += 1
+            ws_handshakes.labels("queued").inc()
+            try:
+                await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                return self._reject("handshake_queue_timeout")
+            finally:
+                self.queued -= 1
+        else:
+            await self._slots.acquire()
+
+        self.in_progress += 1
+        self.admitted_total += 1
+        ws_handshakes.labels("admitted").inc()
+        return None
+
+    def admit_login(self, login: str) -> Optional[float]:
+        """Charge an authenticated connect to its login's bucket.
+
+        Returns None if allowed, or the suggested retry delay in seconds.
+        """
+        wait = self.login_buckets.acquire(login)
+        if wait:
+            return self._reject("login_rate", wait)
+        return None
+
+    def release(self):
+        """Release a handshake slot taken by admit()"""
+        self.in_progress -= 1
+        self._slots.release()
+
+    def retry_after(self, minimum: float = 0.0) -> float:
+        """Suggested delay before reconnecting, jittered to spread a storm"""
+        return max(minimum, self.retry_base) + random.uniform(0, self.retry_jitter)
+
+    async def reject(self, websocket: WebSocket, retry_after: float, subprotocol: Optional[str] = None):
+        """Close a connect with the retry-later code.
+
+        The socket is accepted first: browsers only see a close code on an
+        established connection, a pre-accept close surfaces as HTTP 403.
+        """
+        reason = json.dumps({"retry_after_ms": int(retry_after * 1000)})
+        try:
+            await websocket.accept(subprotocol=subprotocol)
+            await websocket.close(code=RETRY_LATER_CLOSE_CODE, reason=reason)
+        except Exception as e:
+            logger.debug(f"Failed to send retry-later close: {e}")
+
+    def _reject(self, reason: str, wait: float = 0.0) -> float:
+        self.rejected_total[reason] = self.rejected_total.get(reason, 0) + 1
+        ws_handshakes_rejected.labels(reason).inc()
+        logger.warning(f"WebSocket connect rejected: {reason}")
+        return self.retry_after(wait)
+
+    def get_stats(self) -> dict:
+        """Counters for queued, admitted and rejected connects"""
+        return {
+            "handshake_concurrency": self.concurrency,
+            "handshakes_in_progress": self.in_progress,
+            "handshakes_queued": self.queued,
+            "admitted_total": self.admitted_total,
+            "queued_total": self.queued_total,
+            "rejected_total": dict(self.rejected_total),
+        }
+
+
+# Global admission controller instance
+admission = AdmissionController()
+
+registry.gauge(
+    "chat_ws_handshakes_in_progress", "WebSocket handshakes holding a slot",
+    callback=lambda: admission.in_progress
+)
+registry.gauge(
+    "chat_ws_handshakes_queued", "WebSocket connects waiting for a handshake slot",
+    callback=lambda: admission.queued
+)
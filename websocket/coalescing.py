@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Optional, Union
+
+from fastapi import WebSocket
+
+from utils.metrics import ws_batch_events, ws_send_failures
+from utils.timezone import get_moscow_time_iso
+from websocket.codec import Frame, send_frame
+from websocket.tracing import MessageTrace, tracer
+
+logger = logging.getLogger(__name__)
+
+WS_BATCH_ENABLED = os.getenv("WS_BATCH_ENABLED", "1") == "1"
+# How long the first queued event waits for others to join its batch
+WS_BATCH_WINDOW_MS = float(os.getenv("WS_BATCH_WINDOW_MS", "10"))
+# A batch is sent as soon as it holds this many events
+WS_BATCH_MAX_EVENTS = int(os.getenv("WS_BATCH_MAX_EVENTS", "50"))
+# High-rate admin stream events that may wait for a batch; every other frame
+# (replies, direct admin_message, errors) flushes the queue and goes out at once
+WS_BATCH_TYPES = frozenset(
+    filter(None, os.getenv("WS_BATCH_TYPES", "user_message,admin_sent,user_connected,activity,ephemeral").split(","))
+)
+
+
+class _Queue:
+    __slots__ = ("websocket", "events", "traces", "task")
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.events: List[Dict[str, Any]] = []
+        # Traces to mark delivered once the queued events are actually sent
+        self.traces: List[MessageTrace] = []
+        self.task: Optional[asyncio.Task] = None
+
+
+class FrameCoalescer:
+    """Packs bursts of stream events for admin connections into batch frames.
+
+    Admins that connect with ?batch=1 get events of WS_BATCH_TYPES queued
+    per connection; the queue is sent window_ms after its first event, or
+    as soon as it holds max_events, as one frame:
+
+      {"type": "batch", "events": [...], "count": n, "timestamp": ...}
+
+    A queue holding a single event is sent as that event. Any other frame
+    sent through send() flushes the queue first, so it is neither delayed
+    nor reordered ahead of earlier events. Frames written with send_frame()
+    directly, such as the router's replies to requests, bypass the queue
+    and can arrive up to window_ms ahead of stream events queued before
+    them. Connections that did not opt in are sent to directly.
+
+    With traced=True the current trace gets a delivery for the recipient
+    when the frame is written, which for a queued event is when its batch
+    goes out.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = WS_BATCH_ENABLED,
+        window_ms: float = WS_BATCH_WINDOW_MS,
+        max_events: int = WS_BATCH_MAX_EVENTS,
+        batch_types=WS_BATCH_TYPES
+    ):
+        self.enabled = enabled
+        self.window = window_ms / 1000
+        self.max_events = max(1, max_events)
+        self.batch_types = frozenset(batch_types)
+        self._queues: Dict[str, _Queue] = {}
+        self.batches_sent = 0
+        self.events_batched = 0
+
+    def enable(self, user_id: str, websocket: WebSocket):
+        """Start coalescing stream events for this connection"""
+        if self.enabled:
+            self._queues[user_id] = _Queue(websocket)
+
+    def is_batching(self, user_id: str) -> bool:
+        return user_id in self._queues
+
+    def forget(self, user_id: str):
+        """Drop a closed connection's queue; its events are replayed on reconnect"""
+        queue = self._queues.pop(user_id, None)
+        if queue is None:
+            return
+        if queue.task is not None and queue.task is not asyncio.current_task():
+            queue.task.cancel()
+        self._mark(user_id, queue.traces, ok=False)
+
+    async def send(
+        self,
+        user_id: str,
+        websocket: WebSocket,
+        message: Union[Frame, Dict[str, Any]],
+        traced: bool = False
+    ):
+        """Send a frame to a connection, batching it if it is a stream event.
+
+        Send errors propagate to the caller, as with send_frame; the caller
+        records a failed delivery for its own frame.
+        """
+        queue = self._queues.get(user_id)
+        if queue is None or queue.websocket is not websocket:
+            await send_frame(websocket, message)
+            if traced:
+                tracer.delivered(user_id)
+            return
+
+        event = message.message if isinstance(message, Frame) else message
+        if event.get("type") not in self.batch_types:
+            await self.flush(user_id)
+            await send_frame(websocket, message)
+            if traced:
+                tracer.delivered(user_id)
+            return
+
+        queue.events.append(event)
+        trace = tracer.current() if traced else None
+        if trace is not None:
+            queue.traces.append(trace)
+        if len(queue.events) >= self.max_events:
+            await self.flush(user_id)
+        elif queue.task is None:
+            queue.task = asyncio.create_task(self._flush_later(user_id, queue))
+
+    async def flush(self, user_id: str):
+        """Send whatever is queued for a connection now"""
+        queue = self._queues.get(user_id)
+        if queue is None:
+            return
+        if queue.task is not None:
+            if queue.task is not asyncio.current_task():
+                queue.task.cancel()
+            queue.task = None
+        if not queue.events:
+            return
+
+        events, queue.events = queue.events, []
+        traces, queue.traces = queue.traces, []
+        ws_batch_events.observe(len(events))
+        try:
+            if len(events) == 1:
+                await send_frame(queue.websocket, events[0])
+            else:
+                await send_frame(queue.websocket, {
+                    "type": "batch",
+                    "events": events,
+                    "count": len(events),
+                    "timestamp": get_moscow_time_iso()
+                })
+        except Exception:
+            self._mark(user_id, traces, ok=False)
+            raise
+        if len(events) > 1:
+            self.batches_sent += 1
+            self.events_batched += len(events)
+        self._mark(user_id, traces, ok=True)
+
+    @staticmethod
+    def _mark(user_id: str, traces: List[MessageTrace], ok: bool):
+        for trace in traces:
+            trace.add_delivery(user_id, ok)
+
+    async def _flush_later(self, user_id: str, queue: _Queue):
+        await asyncio.sleep(self.window)
+        if self._queues.get(user_id) is not queue:
+            return
+        try:
+            await self.flush(user_id)
+        except Exception as e:
+            logger.error(f"Failed to send batch to {user_id}: {e}")
+            ws_send_failures.labels("batch").inc()
+            self.forget(user_id)
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "window_ms": self.window * 1000,
+            "max_events": self.max_events,
+            "batch_types": sorted(self.batch_types),
+            "batching_connections": len(self._queues),
+            "queued_events": sum(len(queue.events) for queue in self._queues.values()),
+            "batches_sent": self.batches_sent,
+            "events_batched": self.events_batched,
+        }
+
+
+# Global frame coalescer instance
+coalescer = FrameCoalescer()
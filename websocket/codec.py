@@ -0,0 +1,371 @@
+import json
+import os
+import struct
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple, Union
+
+from fastapi import WebSocket
+from starlette.websockets import WebSocketDisconnect
+
+from utils.metrics import ws_bytes_sent
+from utils.timezone import MOSCOW_OFFSET_SUFFIX, ms_to_moscow_iso
+
+JSON = "json"
+COMPACT = "compact"
+
+# Subprotocols a client may offer instead of the ?codec= query parameter
+SUBPROTOCOLS = {"chat.json.v1": JSON, "chat.compact.v1": COMPACT}
+
+WS_DEFAULT_CODEC = os.getenv("WS_DEFAULT_CODEC", JSON)
+
+# Compact codec tables, version 1. Keys and "type" values found here are sent
+# as their index instead of the string. Append only: clients decode by index
+# (static/js/codec.js holds the same lists).
+FIELD_TAGS_V1 = (
+    "type", "message", "timestamp", "from", "from_name", "message_type",
+    "message_id", "id", "sender_id", "recipient_id", "content", "is_read",
+    "is_archived", "user_id", "user_name", "name", "is_admin", "login",
+    "to_user", "with_user", "messages", "client_msg_id", "trace_id",
+    "duplicate", "broadcast_id", "cursor", "broadcast_cursor", "count",
+    "code", "retry_after_ms", "user_data", "users", "connected",
+    "conversations", "participant_id", "participant_name", "last_message",
+    "last_message_time", "unread_count", "limit", "offset", "query",
+    "results", "snippet", "rank", "event", "events", "address", "flat",
+    "first_name", "last_name", "patronymic", "segment", "flat_from",
+    "flat_to", "last_activity", "kind", "sender_name", "message_ids",
+    "to", "to_name", "conversation", "ttl_ms",
+)
+TYPE_TAGS_V1 = (
+    "welcome", "user_message", "admin_message", "admin_sent", "broadcast",
+    "offline_message", "offline_messages_summary", "message_ack",
+    "conversation_history", "conversations_list", "connected_users",
+    "user_connected", "error", "pong", "ping", "activity", "recent_activity",
+    "search_results", "debug_stats", "user_to_admin", "admin_to_user",
+    "get_conversation_history", "get_conversations", "mark_as_read", "ack",
+    "get_connected_users", "search_messages", "subscribe_activity",
+    "unsubscribe_activity", "get_recent_activity", "subscribe_debug",
+    "unsubscribe_debug", "batch", "ephemeral",
+)
+# String values under these keys that are Moscow ISO times travel as epoch ms
+TIMESTAMP_FIELDS = frozenset({"timestamp", "last_message_time", "last_activity", "received_at"})
+
+# MessagePack extension type carrying a Moscow timestamp as big-endian int64 ms
+TIMESTAMP_EXT = 1
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_ONE_MS = timedelta(milliseconds=1)
+
+
+class CodecError(ValueError):
+    """Frame that cannot be decoded"""
+
+
+class JsonCodec:
+    """The original protocol: one JSON text frame per message"""
+
+    name = JSON
+    binary = False
+
+    def encode(self, message: Any) -> str:
+        return json.dumps(message)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        try:
+            return json.loads(data)
+        except json.JSONDecodeError as e:
+            raise CodecError(str(e)) from e
+
+
+class CompactCodec:
+    """Binary frames in MessagePack with short tags for keys, types and times.
+
+    Any MessagePack decoder can read the frames; the tables above turn the
+    integer keys and types back into names, and extension type 1 holds an
+    epoch-ms timestamp to be shown in Moscow time.
+    """
+
+    name = COMPACT
+    binary = True
+
+    def __init__(self, fields=FIELD_TAGS_V1, types=TYPE_TAGS_V1):
+        self.fields = fields
+        self.types = types
+        self.field_tags = {name: tag for tag, name in enumerate(fields)}
+        self.type_tags = {name: tag for tag, name in enumerate(types)}
+
+    def encode(self, message: Any) -> bytes:
+        out = bytearray()
+        self._pack(message, out)
+        return bytes(out)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        if isinstance(data, str):
+            raise CodecError("compact frames are binary")
+        try:
+            value, position = self._unpack(memoryview(data), 0)
+        except (IndexError, struct.error, UnicodeDecodeError, RecursionError) as e:
+            raise CodecError(f"truncated or malformed frame: {e}") from e
+        if position != len(data):
+            raise CodecError("trailing bytes after frame")
+        return value
+
+    def _pack(self, value: Any, out: bytearray):
+        if value is None:
+            out.append(0xc0)
+        elif value is True:
+            out.append(0xc3)
+        elif value is False:
+            out.append(0xc2)
+        elif isinstance(value, int):
+            _pack_int(value, out)
+        elif isinstance(value, float):
+            out.append(0xcb)
+            out += struct.pack(">d", value)
+        elif isinstance(value, str):
+            _pack_str(value, out)
+        elif isinstance(value, dict):
+            _pack_header(len(value), out, 0x80, 0xde, 0xdf)
+            for key, item in value.items():
+                if not isinstance(key, str):
+                    # As json.dumps does; integer keys would read back as tags
+                    key = str(key)
+                tag = self.field_tags.get(key)
+                if tag is not None:
+                    _pack_int(tag, out)
+                else:
+                    _pack_str(key, out)
+                if key == "type" and not isinstance(item, str):
+                    # Integers here are read back as type tags
+                    raise TypeError(f"Message type must be a string, not {type(item).__name__}")
+                if key == "type" and item in self.type_tags:
+                    _pack_int(self.type_tags[item], out)
+                elif key in TIMESTAMP_FIELDS and isinstance(item, str) and item.endswith(MOSCOW_OFFSET_SUFFIX):
+                    _pack_timestamp(item, out)
+                else:
+                    self._pack(item, out)
+        elif isinstance(value, (list, tuple)):
+            _pack_header(len(value), out, 0x90, 0xdc, 0xdd)
+            for item in value:
+                self._pack(item, out)
+        elif isinstance(value, (bytes, bytearray)):
+            length = len(value)
+            if length < 0x100:
+                out += struct.pack(">BB", 0xc4, length)
+            elif length < 0x10000:
+                out += struct.pack(">BH", 0xc5, length)
+            else:
+                out += struct.pack(">BI", 0xc6, length)
+            out += value
+        else:
+            raise TypeError(f"Cannot encode {type(value).__name__}")
+
+    def _unpack(self, data: memoryview, position: int) -> Tuple[Any, int]:
+        byte = data[position]
+        position += 1
+        if byte <= 0x7f:
+            return byte, position
+        if byte >= 0xe0:
+            return byte - 0x100, position
+        if 0xa0 <= byte <= 0xbf:
+            return _read_str(data, position, byte & 0x1f)
+        if 0x90 <= byte <= 0x9f:
+            return self._unpack_array(data, position, byte & 0x0f)
+        if 0x80 <= byte <= 0x8f:
+            return self._unpack_map(data, position, byte & 0x0f)
+        if byte == 0xc0:
+            return None, position
+        if byte == 0xc2:
+            return False, position
+        if byte == 0xc3:
+            return True, position
+        if byte in _FIXED_FORMATS:
+            fmt, size = _FIXED_FORMATS[byte]
+            return struct.unpack_from(fmt, data, position)[0], position + size
+        if byte in (0xd9, 0xda, 0xdb):
+            size = _LENGTH_SIZES[byte]
+            length = int.from_bytes(data[position:position + size], "big")
+            return _read_str(data, position + size, length)
+        if byte in (0xc4, 0xc5, 0xc6):
+            size = _LENGTH_SIZES[byte]
+            length = int.from_bytes(data[position:position + size], "big")
+            start = position + size
+            if start + length > len(data):
+                raise CodecError("truncated binary")
+            return bytes(data[start:start + length]), start + length
+        if byte in (0xdc, 0xdd):
+            size = _LENGTH_SIZES[byte]
+            return self._unpack_array(data, position + size, int.from_bytes(data[position:position + size], "big"))
+        if byte in (0xde, 0xdf):
+            size = _LENGTH_SIZES[byte]
+            return self._unpack_map(data, position + size, int.from_bytes(data[position:position + size], "big"))
+        if byte == 0xd7 and data[position] == TIMESTAMP_EXT:
+            ms = struct.unpack_from(">q", data, position + 1)[0]
+            return ms_to_moscow_iso(ms), position + 9
+        raise CodecError(f"unsupported MessagePack byte 0x{byte:02x}")
+
+    def _unpack_array(self, data: memoryview, position: int, length: int) -> Tuple[list, int]:
+        items = []
+        for _ in range(length):
+            item, position = self._unpack(data, position)
+            items.append(item)
+        return items, position
+
+    def _unpack_map(self, data: memoryview, position: int, length: int) -> Tuple[dict, int]:
+        result = {}
+        for _ in range(length):
+            key, position = self._unpack(data, position)
+            if isinstance(key, int):
+                if not 0 <= key < len(self.fields):
+                    raise CodecError(f"unknown field tag {key}")
+                key = self.fields[key]
+            elif not isinstance(key, str):
+                raise CodecError("map keys must be strings or field tags")
+            value, position = self._unpack(data, position)
+            if key == "type" and isinstance(value, int):
+                if not 0 <= value < len(self.types):
+                    raise CodecError(f"unknown type tag {value}")
+                value = self.types[value]
+            result[key] = value
+        return result, position
+
+
+_FIXED_FORMATS = {
+    0xca: (">f", 4), 0xcb: (">d", 8),
+    0xcc: (">B", 1), 0xcd: (">H", 2), 0xce: (">I", 4), 0xcf: (">Q", 8),
+    0xd0: (">b", 1), 0xd1: (">h", 2), 0xd2: (">i", 4), 0xd3: (">q", 8),
+}
+_LENGTH_SIZES = {0xd9: 1, 0xda: 2, 0xdb: 4, 0xc4: 1, 0xc5: 2, 0xc6: 4, 0xdc: 2, 0xdd: 4, 0xde: 2, 0xdf: 4}
+
+
+def _pack_int(value: int, out: bytearray):
+    if 0 <= value <= 0x7f:
+        out.append(value)
+    elif -32 <= value < 0:
+        out.append(value + 0x100)
+    elif value >= 0:
+        if value < 0x100:
+            out += struct.pack(">BB", 0xcc, value)
+        elif value < 0x10000:
+            out += struct.pack(">BH", 0xcd, value)
+        elif value < 0x100000000:
+            out += struct.pack(">BI", 0xce, value)
+        else:
+            out += struct.pack(">BQ", 0xcf, value)
+    elif value >= -0x80:
+        out += struct.pack(">Bb", 0xd0, value)
+    elif value >= -0x8000:
+        out += struct.pack(">Bh", 0xd1, value)
+    elif value >= -0x80000000:
+        out += struct.pack(">Bi", 0xd2, value)
+    else:
+        out += struct.pack(">Bq", 0xd3, value)
+
+
+def _pack_str(value: str, out: bytearray):
+    encoded = value.encode("utf-8")
+    length = len(encoded)
+    if length < 32:
+        out.append(0xa0 | length)
+    elif length < 0x100:
+        out += struct.pack(">BB", 0xd9, length)
+    elif length < 0x10000:
+        out += struct.pack(">BH", 0xda, length)
+    else:
+        out += struct.pack(">BI", 0xdb, length)
+    out += encoded
+
+
+def _pack_header(length: int, out: bytearray, fix: int, marker16: int, marker32: int):
+    if length < 16:
+        out.append(fix | length)
+    elif length < 0x10000:
+        out += struct.pack(">BH", marker16, length)
+    else:
+        out += struct.pack(">BI", marker32, length)
+
+
+def _pack_timestamp(value: str, out: bytearray):
+    try:
+        # Integer arithmetic, so the value never depends on float rounding
+        ms = (datetime.fromisoformat(value) - _EPOCH) // _ONE_MS
+    except (ValueError, TypeError):
+        _pack_str(value, out)
+        return
+    out += struct.pack(">BBq", 0xd7, TIMESTAMP_EXT, ms)
+
+
+def _read_str(data: memoryview, position: int, length: int) -> Tuple[str, int]:
+    end = position + length
+    if end > len(data):
+        raise CodecError("truncated string")
+    return str(data[position:end], "utf-8"), end
+
+
+CODECS = {JSON: JsonCodec(), COMPACT: CompactCodec()}
+
+
+def negotiate_codec(websocket: WebSocket) -> Tuple[Union[JsonCodec, CompactCodec], Optional[str]]:
+    """Pick the codec for a new connection: ?codec= first, then an offered subprotocol.
+
+    Returns the codec and the subprotocol to echo when accepting; a client
+    that offers subprotocols must get one of them back.
+    """
+    requested = websocket.query_params.get("codec")
+    offered = websocket.scope.get("subprotocols") or []
+    subprotocol = next((protocol for protocol in offered if protocol in SUBPROTOCOLS), None)
+    if requested not in CODECS:
+        requested = SUBPROTOCOLS[subprotocol] if subprotocol else WS_DEFAULT_CODEC
+    return CODECS.get(requested, CODECS[JSON]), subprotocol
+
+
+def codec_for(websocket: WebSocket) -> Union[JsonCodec, CompactCodec]:
+    """The codec negotiated for a connection (JSON if none was)"""
+    try:
+        return websocket.state.codec
+    except AttributeError:
+        return CODECS[JSON]
+
+
+class Frame:
+    """An outbound message, encoded at most once per codec.
+
+    Fan-out builds one Frame and sends it to every recipient, so a message
+    going to many clients is serialized once for JSON and once for compact.
+    """
+
+    __slots__ = ("message", "_encoded")
+
+    def __init__(self, message: Dict[str, Any]):
+        self.message = message
+        self._encoded: Dict[str, Union[str, bytes]] = {}
+
+    def encode(self, codec) -> Union[str, bytes]:
+        data = self._encoded.get(codec.name)
+        if data is None:
+            data = self._encoded[codec.name] = codec.encode(self.message)
+        return data
+
+
+async def send_frame(websocket: WebSocket, message: Union[Frame, Dict[str, Any]]):
+    """Send a message to one connection in its negotiated codec"""
+    codec = codec_for(websocket)
+    data = message.encode(codec) if isinstance(message, Frame) else codec.encode(message)
+    if codec.binary:
+        await websocket.send_bytes(data)
+    else:
+        await websocket.send_text(data)
+    ws_bytes_sent.labels(codec.name).inc(len(data))
+
+
+async def receive_frame(websocket: WebSocket) -> Union[str, bytes]:
+    """Next inbound frame as text or bytes; raises WebSocketDisconnect on close"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    text = message.get("text")
+    return text if text is not None else message.get("bytes", b"")
+
+
+def decode_frame(data: Union[str, bytes]) -> Any:
+    """Text frames are JSON and binary frames compact, whatever was negotiated"""
+    return CODECS[COMPACT].decode(data) if isinstance(data, bytes) else CODECS[JSON].decode(data)
@@ -1,13 +1,30 @@
-from typing import Dict, List
+from typing import Any, Dict, List, Optional, Set, Union
 from fastapi import WebSocket
-import json
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 import logging
+import time
 
+from utils.metrics import fanout_recipients, fanout_seconds, registry, ws_connects, ws_disconnects, ws_send_failures
 from utils.timezone import get_moscow_time_iso
+from websocket.activity_feed import activity_feed
+from websocket.codec import Frame
+from websocket.coalescing import coalescer
+from websocket.ephemeral import EPHEMERAL_TTL_MS
+from websocket.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
+_broadcast_seconds = fanout_seconds.labels("broadcast")
+_broadcast_recipients = fanout_recipients.labels("broadcast")
+_send_to_admin_seconds = fanout_seconds.labels("send_to_admin")
+_send_to_admin_recipients = fanout_recipients.labels("send_to_admin")
+
+
+def _role(user_data: Optional[dict]) -> str:
+    return "admin" if user_data and user_data.get('is_admin', False) else "user"
+
+
 class ConnectionManager:
     """Manages WebSocket connections for chat functionality"""
     
@@ -15,15 +32,26 @@ class ConnectionManager:
         self.active_connections: Dict[str, WebSocket] = {}
         self.user_info: Dict[str, dict] = {}  # Store user info for connected users
         self.all_users: Dict[str, dict] = {}  # Store info for all users who ever connected
+        # Online non-admin users by address and flat, for segment broadcasts
+        self.segments: Dict[str, Dict[int, Set[str]]] = {}
+        # Online admins, so per-keystroke signals do not scan every connection
+        self.admins: Set[str] = set()
     
-    async def connect(self, user_id: str, websocket: WebSocket, user_data: dict = None):
+    async def connect(self, user_id: str, websocket: WebSocket, user_data: dict = None, subprotocol: str = None):
         """Accept a WebSocket connection and store user information"""
-        await websocket.accept()
+        await websocket.accept(subprotocol=subprotocol)
         self.active_connections[user_id] = websocket
         if user_data:
+            self._unindex_segment(user_id)
             self.user_info[user_id] = user_data
             # Also store in all_users for persistent history
             self.all_users[user_id] = user_data
+            self._index_segment(user_id, user_data)
+            if user_data.get('is_admin', False):
+                self.admins.add(user_id)
+            else:
+                self.admins.discard(user_id)
+        ws_connects.labels(_role(user_data)).inc()
         
         logger.info(f"User {user_id} connected. Total connections: {len(self.active_connections)}")
         
@@ -35,26 +63,37 @@ class ConnectionManager:
         """Remove a WebSocket connection"""
         if user_id in self.active_connections:
             del self.active_connections[user_id]
+            ws_disconnects.labels(_role(self.user_info.get(user_id))).inc()
+        coalescer.forget(user_id)
+        self.admins.discard(user_id)
+        self._unindex_segment(user_id)
         if user_id in self.user_info:
             del self.user_info[user_id]
         
         logger.info(f"User {user_id} disconnected. Total connections: {len(self.active_connections)}")
     
-    async def send_personal_message(self, message: str, user_id: str):
-        """Send a message to a specific user"""
+    async def send_personal_message(self, message: Union[Frame, Dict[str, Any]], user_id: str):
+        """Send a message to a specific user in their connection's codec"""
         if user_id in self.active_connections:
             try:
-                await self.active_connections[user_id].send_text(message)
+                await coalescer.send(user_id, self.active_connections[user_id], message, traced=True)
                 return True
             except Exception as e:
                 logger.error(f"Failed to send message to {user_id}: {e}")
+                ws_send_failures.labels("personal").inc()
+                tracer.delivered(user_id, ok=False)
                 # Remove disconnected user
                 self.disconnect(user_id)
                 return False
         return False
     
-    async def send_to_admin(self, message: str, sender_id: str, session=None):
-        """Send a message from user to all connected administrators"""
+    async def send_to_admin(self, message: str, sender_id: str, session=None, client_msg_id: str = None):
+        """Send a message from user to all connected administrators.
+
+        Returns the canonical id of the stored message (the first admin copy),
+        or None if nothing was stored, and whether it had already been stored
+        under the same client message id.
+        """
         admin_count = 0
         message_data = {
             "type": "user_message",
@@ -63,6 +102,7 @@ class ConnectionManager:
             "message": message,
             "timestamp": get_moscow_time_iso()
         }
+        saved_ids = {}  # admin login -> id of the row stored for that admin
         
         # ALWAYS save message to database first
         if session:
@@ -76,32 +116,50 @@ class ConnectionManager:
                 result = await session.execute(admin_query)
                 admin_logins = [row[0] for row in result.fetchall()]
                 
-                # Save message for each admin
-                for admin_login in admin_logins:
-                    await message_manager.save_message(
-                        session, sender_id, admin_login, message, "user_message"
-                    )
-                    logger.info(f"Saved message from {sender_id} to admin {admin_login}")
+                # Save one copy per admin, all in one transaction
+                saved = await message_manager.save_message_copies(
+                    session, sender_id, admin_logins, message, "user_message", client_msg_id
+                )
+                saved_ids = {admin_login: row.id for admin_login, row in saved.items()}
+                if saved:
+                    # One feed entry per tenant message, not per admin copy
+                    activity_feed.record_message(min(saved.values(), key=lambda row: row.id))
                 
+            except IntegrityError:
+                # A concurrent retry with the same client id won the insert
+                from websocket.message_manager import message_manager
+                logger.info(f"Duplicate client message {client_msg_id} from {sender_id} ignored")
+                return await message_manager.find_client_message(session, sender_id, client_msg_id), True
             except Exception as e:
                 logger.error(f"Failed to save message to database: {e}")
         
         # Send to online admins
-        for user_id, websocket in self.active_connections.items():
+        started = time.perf_counter()
+        tracer.mark("fanout_start")
+        for user_id, websocket in list(self.active_connections.items()):
             user_data = self.user_info.get(user_id, {})
             if user_data.get('is_admin', False):
                 try:
-                    await websocket.send_text(json.dumps(message_data))
+                    # Each admin acks against the id of their own copy
+                    await coalescer.send(user_id, websocket, {**message_data, "message_id": saved_ids.get(user_id)}, traced=True)
                     admin_count += 1
                 except Exception as e:
                     logger.error(f"Failed to send message to admin {user_id}: {e}")
+                    ws_send_failures.labels("admin").inc()
+                    tracer.delivered(user_id, ok=False)
                     self.disconnect(user_id)
+        _send_to_admin_seconds.observe(time.perf_counter() - started)
+        _send_to_admin_recipients.inc(admin_count)
         
         logger.info(f"Message from {sender_id} sent to {admin_count} online admins and saved to database")
-        return True  # Always return True since we saved to database
+        return (min(saved_ids.values()) if saved_ids else None), False
     
-    async def send_to_user(self, message: str, user_id: str, sender_id: str = "admin", session=None):
-        """Send a message from admin to a specific user"""
+    async def send_to_user(self, message: str, user_id: str, sender_id: str = "admin", session=None, client_msg_id: str = None):
+        """Send a message from admin to a specific user.
+
+        Returns the id of the stored message, or None if nothing was stored,
+        and whether it had already been stored under the same client message id.
+        """
         message_data = {
             "type": "admin_message",
             "from": sender_id,
@@ -110,24 +168,32 @@ class ConnectionManager:
             "timestamp": get_moscow_time_iso()
         }
         
-        success = False
+        message_id = None
         
         # ALWAYS save message to database first
         if session:
             try:
                 from websocket.message_manager import message_manager
-                await message_manager.save_message(
-                    session, sender_id, user_id, message, "admin_message"
+                saved = await message_manager.save_message(
+                    session, sender_id, user_id, message, "admin_message", client_msg_id
                 )
+                message_id = saved.id
+                message_data["message_id"] = saved.id
+                activity_feed.record_message(saved)
                 logger.info(f"Saved message from {sender_id} to user {user_id}")
-                success = True
+            except IntegrityError:
+                # A concurrent retry with the same client id won the insert
+                from websocket.message_manager import message_manager
+                logger.info(f"Duplicate client message {client_msg_id} from {sender_id} ignored")
+                return await message_manager.find_client_message(session, sender_id, client_msg_id), True
             except Exception as e:
                 logger.error(f"Failed to save message to database: {e}")
         
         # Try to send to online user
+        tracer.mark("fanout_start")
         if user_id in self.active_connections:
             try:
-                await self.send_personal_message(json.dumps(message_data), user_id)
+                await self.send_personal_message(message_data, user_id)
                 
                 # Also send copy to admin for history (if sender is admin)
                 if sender_id != user_id:
@@ -135,22 +201,38 @@ class ConnectionManager:
                     history_data["type"] = "admin_sent"
                     history_data["to"] = user_id
                     history_data["to_name"] = self._get_user_display_name(user_id)
+                    history_frame = Frame(history_data)
                     
                     # Send to all admins
-                    for admin_id, websocket in self.active_connections.items():
+                    for admin_id, websocket in list(self.active_connections.items()):
                         admin_data = self.user_info.get(admin_id, {})
                         if admin_data.get('is_admin', False):
                             try:
-                                await websocket.send_text(json.dumps(history_data))
+                                await coalescer.send(admin_id, websocket, history_frame)
                             except Exception as e:
                                 logger.error(f"Failed to send history to admin {admin_id}: {e}")
+                                ws_send_failures.labels("admin_history").inc()
             except Exception as e:
                 logger.error(f"Failed to send message to online user {user_id}: {e}")
         
-        return success
+        return message_id, False
     
-    async def broadcast(self, message: str, sender_id: str = "admin", exclude_admins: bool = True):
-        """Send a broadcast message to all connected users (excluding admins by default)"""
+    async def broadcast(
+        self,
+        message: str,
+        sender_id: str = "admin",
+        exclude_admins: bool = True,
+        address: Optional[str] = None,
+        flat_from: Optional[int] = None,
+        flat_to: Optional[int] = None,
+        broadcast_id: Optional[int] = None
+    ):
+        """Send a broadcast message to all connected users (excluding admins by default).
+
+        With an address, only online users at that address (and flat range)
+        receive it; they are looked up in the segment index, so the cost is
+        proportional to the segment rather than to all connections.
+        """
         message_data = {
             "type": "broadcast",
             "from": sender_id,
@@ -158,9 +240,23 @@ class ConnectionManager:
             "message": message,
             "timestamp": get_moscow_time_iso()
         }
+        if broadcast_id is not None:
+            message_data["broadcast_id"] = broadcast_id
+        
+        if address is not None:
+            message_data["segment"] = {"address": address, "flat_from": flat_from, "flat_to": flat_to}
+            recipients = self.get_segment_members(address, flat_from, flat_to)
+        else:
+            recipients = list(self.active_connections.keys())
         
+        frame = Frame(message_data)
         sent_count = 0
-        for user_id, websocket in self.active_connections.items():
+        started = time.perf_counter()
+        tracer.mark("fanout_start")
+        for user_id in recipients:
+            websocket = self.active_connections.get(user_id)
+            if websocket is None:
+                continue
             user_data = self.user_info.get(user_id, {})
             
             # Skip admins if exclude_admins is True
@@ -168,15 +264,107 @@ class ConnectionManager:
                 continue
             
             try:
-                await websocket.send_text(json.dumps(message_data))
+                await coalescer.send(user_id, websocket, frame, traced=True)
                 sent_count += 1
             except Exception as e:
                 logger.error(f"Failed to broadcast to {user_id}: {e}")
+                ws_send_failures.labels("broadcast").inc()
+                tracer.delivered(user_id, ok=False)
                 self.disconnect(user_id)
+        _broadcast_seconds.observe(time.perf_counter() - started)
+        _broadcast_recipients.inc(sent_count)
         
         logger.info(f"Broadcast message sent to {sent_count} users")
         return sent_count
     
+    async def send_ephemeral(self, sender_id: str, event: str, to_user: Optional[str] = None) -> int:
+        """Relay a typing or viewing signal to a conversation's online participants.
+
+        Conversations are between one tenant and the admins: a tenant's
+        signal goes to every online admin, an admin's to the tenant in
+        to_user and to the other online admins. Nothing is stored, and a
+        failed send is left for the receive loop to clean up.
+        """
+        sender_is_admin = sender_id in self.admins
+        conversation_id = to_user if sender_is_admin else sender_id
+        frame = Frame({
+            "type": "ephemeral",
+            "event": event,
+            "from": sender_id,
+            "from_name": self._get_user_display_name(sender_id),
+            "conversation": conversation_id,
+            "ttl_ms": EPHEMERAL_TTL_MS,
+            "timestamp": get_moscow_time_iso()
+        })
+        recipients = [admin_id for admin_id in self.admins if admin_id != sender_id]
+        if sender_is_admin and to_user not in self.admins:
+            recipients.append(to_user)
+        
+        sent_count = 0
+        for user_id in recipients:
+            websocket = self.active_connections.get(user_id)
+            if websocket is None:
+                continue
+            try:
+                await coalescer.send(user_id, websocket, frame)
+                sent_count += 1
+            except Exception as e:
+                logger.debug(f"Failed to relay {event} to {user_id}: {e}")
+                ws_send_failures.labels("ephemeral").inc()
+        return sent_count
+    
+    def get_segment_members(
+        self,
+        address: str,
+        flat_from: Optional[int] = None,
+        flat_to: Optional[int] = None
+    ) -> List[str]:
+        """Get online non-admin users at an address, optionally within a flat range"""
+        flats = self.segments.get(address)
+        if not flats:
+            return []
+        
+        if flat_from is None and flat_to is None:
+            selected = flats.keys()
+        else:
+            low = flat_from if flat_from is not None else min(flats)
+            high = flat_to if flat_to is not None else max(flats)
+            # Walk whichever is smaller: the requested range or the occupied flats
+            if high - low + 1 <= len(flats):
+                selected = [flat for flat in range(low, high + 1) if flat in flats]
+            else:
+                selected = [flat for flat in flats if low <= flat <= high]
+        
+        members = []
+        for flat in selected:
+            members.extend(flats[flat])
+        return members
+    
+    def _index_segment(self, user_id: str, user_data: dict):
+        """Add an online non-admin user to the address/flat index"""
+        address = user_data.get('address')
+        flat = user_data.get('flat')
+        if user_data.get('is_admin', False) or address is None or flat is None:
+            return
+        self.segments.setdefault(address, {}).setdefault(flat, set()).add(user_id)
+    
+    def _unindex_segment(self, user_id: str):
+        """Remove a user from the address/flat index"""
+        user_data = self.user_info.get(user_id)
+        if not user_data:
+            return
+        flats = self.segments.get(user_data.get('address'))
+        if not flats:
+            return
+        members = flats.get(user_data.get('flat'))
+        if members is None:
+            return
+        members.discard(user_id)
+        if not members:
+            del flats[user_data.get('flat')]
+            if not flats:
+                del self.segments[user_data.get('address')]
+    
     def get_connected_users(self, exclude_admins: bool = True) -> List[dict]:
         """Get list of connected users with their information"""
         users = []
@@ -241,6 +429,13 @@ class ConnectionManager:
         """Check if a user is currently connected"""
         return user_id in self.active_connections
     
+    def count_connections_by_role(self) -> Dict[tuple, int]:
+        """Open connections keyed by role label, for the connections gauge"""
+        counts = {("admin",): 0, ("user",): 0}
+        for user_id in self.active_connections:
+            counts[(_role(self.user_info.get(user_id)),)] += 1
+        return counts
+    
     def is_admin(self, user_id: str) -> bool:
         """Check if a user is an administrator"""
         user_data = self.user_info.get(user_id, {})
@@ -284,15 +479,22 @@ class ConnectionManager:
             "user_name": self._get_user_display_name(user_id),
             "timestamp": get_moscow_time_iso()
         }
+        frame = Frame(notification)
         
-        for admin_id, websocket in self.active_connections.items():
+        for admin_id, websocket in list(self.active_connections.items()):
             admin_data = self.user_info.get(admin_id, {})
             if admin_data.get('is_admin', False):
                 try:
-                    await websocket.send_text(json.dumps(notification))
+                    await coalescer.send(admin_id, websocket, frame)
                 except Exception as e:
                     logger.error(f"Failed to notify admin {admin_id} about user connection: {e}")
+                    ws_send_failures.labels("notify").inc()
 
 
 # Global connection manager instance
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager()
+
+registry.gauge(
+    "chat_ws_connections", "Open WebSocket connections by role", ["role"],
+    callback=manager.count_connections_by_role
+)
\ No newline at end of file
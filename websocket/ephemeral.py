@@ -0,0 +1,81 @@
+import logging
+import os
+from typing import Dict
+
+from utils.metrics import ephemeral_events
+from utils.rate_limit import KeyedTokenBuckets
+
+logger = logging.getLogger(__name__)
+
+# Signals clients may send; anything else is dropped
+EPHEMERAL_EVENTS = frozenset({"typing", "typing_stopped", "viewing"})
+
+# How long a client shows a signal unless it is repeated or cancelled
+EPHEMERAL_TTL_MS = int(os.getenv("EPHEMERAL_TTL_MS", "5000"))
+# Per sender: steady signals per second and burst
+EPHEMERAL_SENDER_RATE = float(os.getenv("EPHEMERAL_SENDER_RATE", "2"))
+EPHEMERAL_SENDER_BURST = float(os.getenv("EPHEMERAL_SENDER_BURST", "4"))
+# Per conversation, across all its participants
+EPHEMERAL_CONVERSATION_RATE = float(os.getenv("EPHEMERAL_CONVERSATION_RATE", "4"))
+EPHEMERAL_CONVERSATION_BURST = float(os.getenv("EPHEMERAL_CONVERSATION_BURST", "8"))
+EPHEMERAL_MAX_KEYS = int(os.getenv("EPHEMERAL_MAX_KEYS", "20000"))
+
+# Outcomes counted per signal
+SENT = "sent"
+THROTTLED = "throttled"
+SHED = "shed"
+INVALID = "invalid"
+
+
+class EphemeralThrottle:
+    """Token buckets per sender and per conversation for ephemeral signals.
+
+    Signals over either limit are dropped without a reply: a typing
+    indicator that misses one refresh is still shown for its TTL, and a
+    lost "stopped" simply expires. Buckets are LRU-bounded, so state stays
+    constant however many tenants type at once, and they are kept across
+    reconnects so closing the socket does not refill a sender's bucket.
+    """
+
+    def __init__(
+        self,
+        sender_rate: float = EPHEMERAL_SENDER_RATE,
+        sender_burst: float = EPHEMERAL_SENDER_BURST,
+        conversation_rate: float = EPHEMERAL_CONVERSATION_RATE,
+        conversation_burst: float = EPHEMERAL_CONVERSATION_BURST,
+        max_keys: int = EPHEMERAL_MAX_KEYS
+    ):
+        self.senders = KeyedTokenBuckets(sender_rate, sender_burst, max_keys)
+        self.conversations = KeyedTokenBuckets(conversation_rate, conversation_burst, max_keys)
+        self.outcomes: Dict[str, int] = {}
+
+    def allow(self, sender_id: str, conversation_id: str) -> bool:
+        """Account for one signal; False if it must be dropped.
+
+        A signal refused by the conversation limit does not cost the sender
+        a token, so a busy conversation cannot use up its participants'
+        allowance for other conversations.
+        """
+        if self.senders.acquire(sender_id):
+            self.count(THROTTLED)
+            return False
+        if self.conversations.acquire(conversation_id):
+            self.senders.refund(sender_id)
+            self.count(THROTTLED)
+            return False
+        return True
+
+    def count(self, outcome: str):
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        ephemeral_events.labels(outcome).inc()
+
+    def get_stats(self) -> dict:
+        return {
+            "tracked_senders": len(self.senders),
+            "tracked_conversations": len(self.conversations),
+            "outcomes": dict(self.outcomes),
+        }
+
+
+# Global ephemeral signal throttle instance
+ephemeral_throttle = EphemeralThrottle()
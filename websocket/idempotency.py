@@ -0,0 +1,43 @@
+from collections import OrderedDict
+from typing import Optional, Tuple
+import time
+
+
+class RecentClientMessages:
+    """Bounded, time-windowed memory of client message ids already stored.
+
+    Retries arrive seconds after the original, so a short window answers
+    almost every duplicate without touching the database. Entries older than
+    the window, or beyond max_entries, are evicted oldest first; the unique
+    index on messages is the fallback for anything evicted.
+    """
+
+    def __init__(self, max_entries: int = 10000, window_seconds: float = 600.0):
+        self.max_entries = max_entries
+        self.window_seconds = window_seconds
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, int]]" = OrderedDict()
+
+    def get(self, sender_id: str, client_msg_id: str) -> Optional[int]:
+        """Return the canonical message id for a client id seen recently"""
+        self._evict(time.monotonic())
+        entry = self._entries.get((sender_id, client_msg_id))
+        return entry[1] if entry else None
+
+    def remember(self, sender_id: str, client_msg_id: str, message_id: int):
+        """Record the canonical server id for a client message id"""
+        now = time.monotonic()
+        key = (sender_id, client_msg_id)
+        self._entries.pop(key, None)
+        self._entries[key] = (now, message_id)
+        self._evict(now)
+
+    def _evict(self, now: float):
+        cutoff = now - self.window_seconds
+        while self._entries:
+            stored_at, _ = next(iter(self._entries.values()))
+            if stored_at >= cutoff and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
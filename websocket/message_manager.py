@@ -1,27 +1,47 @@
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterator
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_, or_, desc, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 import logging
+import os
 
-from schemas.schemas import MessageModel, MessageSchema, ConversationSchema, UserModel
-from utils.timezone import get_moscow_time
+from database.cold_storage import cold_storage, record_row
+from database.search import build_match_expression, make_snippet, match_clause, messages_fts
+from schemas.schemas import MESSAGE_ROW_FIELDS, MessageModel, MessageSchema, ConversationSchema, UserModel, DeliveryCursorModel, BroadcastModel
+from utils.metrics import message_manager_seconds, timed
+from utils.timezone import datetime_to_ms, ms_to_moscow_iso, now_ms
+from websocket.activity_feed import activity_feed
+from websocket.idempotency import RecentClientMessages
+from websocket.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
+# Users seen for the first time get broadcasts from this many days back
+BROADCAST_REPLAY_WINDOW_DAYS = int(os.getenv("BROADCAST_REPLAY_WINDOW_DAYS", "7"))
+# Full-text search ranks at most this many of the newest matches
+SEARCH_CANDIDATE_WINDOW = int(os.getenv("SEARCH_CANDIDATE_WINDOW", "2000"))
+
+# Columns selected by the projected read paths, in MESSAGE_ROW_FIELDS order
+MESSAGE_ROW_COLUMNS = tuple(getattr(MessageModel, name) for name in MESSAGE_ROW_FIELDS)
+
 class MessageManager:
     """Manages chat messages and conversation history"""
     
     def __init__(self):
-        pass
+        self.recent_client_messages = RecentClientMessages()
+        self.recent_client_broadcasts = RecentClientMessages()
     
+    @timed(message_manager_seconds.labels("save_message"))
     async def save_message(
         self, 
         session: AsyncSession,
         sender_id: str, 
         recipient_id: str, 
         content: str,
-        message_type: str = "user_message"
+        message_type: str = "user_message",
+        client_msg_id: Optional[str] = None
     ) -> MessageModel:
         """Save a message to the database"""
         try:
@@ -30,13 +50,15 @@ class MessageManager:
                 recipient_id=recipient_id,
                 content=content,
                 message_type=message_type,
-                timestamp=get_moscow_time(),
-                is_read=False
+                timestamp=now_ms(),
+                is_read=False,
+                client_msg_id=client_msg_id
             )
             
             session.add(message)
             await session.commit()
             await session.refresh(message)
+            tracer.mark("persist")
             
             logger.info(f"Message saved: {sender_id} -> {recipient_id} ({message_type})")
             return message
@@ -46,6 +68,83 @@ class MessageManager:
             logger.error(f"Failed to save message: {e}")
             raise
     
+    @timed(message_manager_seconds.labels("save_message_copies"))
+    async def save_message_copies(
+        self,
+        session: AsyncSession,
+        sender_id: str,
+        recipient_ids: List[str],
+        content: str,
+        message_type: str = "user_message",
+        client_msg_id: Optional[str] = None
+    ) -> Dict[str, MessageModel]:
+        """Save one message for several recipients in a single transaction.
+
+        Either every copy is stored or none is, so a failure part-way
+        through cannot leave some recipients without the message. Returns
+        the stored rows by recipient. The caller records the activity,
+        once for the whole set.
+        """
+        try:
+            timestamp = now_ms()
+            messages = {
+                recipient_id: MessageModel(
+                    sender_id=sender_id,
+                    recipient_id=recipient_id,
+                    content=content,
+                    message_type=message_type,
+                    timestamp=timestamp,
+                    is_read=False,
+                    client_msg_id=client_msg_id
+                )
+                for recipient_id in recipient_ids
+            }
+            
+            session.add_all(messages.values())
+            await session.commit()
+            tracer.mark("persist")
+            
+            logger.info(f"Message saved: {sender_id} -> {len(messages)} recipients ({message_type})")
+            return messages
+            
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Failed to save message copies: {e}")
+            raise
+    
+    @timed(message_manager_seconds.labels("find_client_message"))
+    async def find_client_message(
+        self,
+        session: AsyncSession,
+        sender_id: str,
+        client_msg_id: str
+    ) -> Optional[int]:
+        """Get the canonical id of a message already stored under a client id.
+
+        The in-memory window answers retries; the database is only consulted
+        on a miss, e.g. after a restart.
+        """
+        message_id = self.recent_client_messages.get(sender_id, client_msg_id)
+        if message_id is not None:
+            return message_id
+        
+        query = select(func.min(MessageModel.id)).where(
+            and_(
+                MessageModel.sender_id == sender_id,
+                MessageModel.client_msg_id == client_msg_id
+            )
+        )
+        result = await session.execute(query)
+        message_id = result.scalar()
+        if message_id is not None:
+            self.recent_client_messages.remember(sender_id, client_msg_id, message_id)
+        return message_id
+    
+    def remember_client_message(self, sender_id: str, client_msg_id: str, message_id: int):
+        """Record the canonical id for a freshly stored client message"""
+        self.recent_client_messages.remember(sender_id, client_msg_id, message_id)
+    
+    @timed(message_manager_seconds.labels("get_conversation_history"))
     async def get_conversation_history(
         self,
         session: AsyncSession,
@@ -56,6 +155,24 @@ class MessageManager:
         include_archived: bool = False
     ) -> List[MessageSchema]:
         """Get conversation history between two users"""
+        rows = await self.get_conversation_history_rows(session, user1_id, user2_id, limit, offset, include_archived)
+        return [MessageSchema(**dict(zip(MESSAGE_ROW_FIELDS, row))) for row in rows]
+    
+    @timed(message_manager_seconds.labels("get_conversation_history_rows"))
+    async def get_conversation_history_rows(
+        self,
+        session: AsyncSession,
+        user1_id: str,
+        user2_id: str,
+        limit: int = 50,
+        offset: int = 0,
+        include_archived: bool = False
+    ) -> List[tuple]:
+        """Conversation history as plain tuples in MESSAGE_ROW_FIELDS order, oldest first.
+
+        Only the needed columns are selected and rows come straight from the
+        cursor, with no ORM objects or Pydantic models in between.
+        """
         try:
             # Base query
             base_conditions = [
@@ -69,35 +186,137 @@ class MessageManager:
             if not include_archived:
                 base_conditions.append(MessageModel.is_archived == False)
             
-            query = select(MessageModel).where(
+            query = select(*MESSAGE_ROW_COLUMNS).where(
                 and_(*base_conditions)
             ).order_by(desc(MessageModel.timestamp)).limit(limit).offset(offset)
             
             result = await session.execute(query)
-            messages = result.scalars().all()
-            
-            # Convert to schemas and reverse order (oldest first)
-            message_schemas = [
-                MessageSchema(
-                    id=msg.id,
-                    sender_id=msg.sender_id,
-                    recipient_id=msg.recipient_id,
-                    content=msg.content,
-                    timestamp=msg.timestamp,
-                    is_read=msg.is_read,
-                    message_type=msg.message_type,
-                    is_archived=msg.is_archived
-                ) for msg in reversed(messages)
-            ]
+            rows = list(result.tuples())
+            hot_count = len(rows)
+            
+            # Past the end of the hot table, continue into cold segments;
+            # everything there is older than any hot message
+            if hot_count < limit:
+                if rows:
+                    hot_total = offset + hot_count
+                else:
+                    count_query = select(func.count(MessageModel.id)).where(and_(*base_conditions))
+                    hot_total = (await session.execute(count_query)).scalar() or 0
+                records = await cold_storage.read_conversation_records(
+                    session, user1_id, user2_id,
+                    max(0, offset - hot_total), limit - hot_count, include_archived
+                )
+                rows.extend(record_row(record) for record in records)
+            
+            # Reverse order (oldest first)
+            rows.reverse()
             
             archive_status = "including archived" if include_archived else "non-archived only"
-            logger.info(f"Retrieved {len(message_schemas)} messages ({archive_status}) for conversation {user1_id} <-> {user2_id}")
-            return message_schemas
+            logger.info(f"Retrieved {len(rows)} messages ({archive_status}) for conversation {user1_id} <-> {user2_id}")
+            return rows
             
         except Exception as e:
             logger.error(f"Failed to get conversation history: {e}")
             raise
     
+    @timed(message_manager_seconds.labels("search_messages"))
+    async def search_messages(
+        self,
+        session: AsyncSession,
+        query: str,
+        user_id: Optional[str] = None,
+        peer_id: Optional[str] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        include_archived: bool = True,
+        limit: int = 20,
+        offset: int = 0
+    ) -> List[Dict[str, Any]]:
+        """Full-text search over message content, best matches first.
+
+        Scopes: user_id limits to messages sent or received by that user,
+        adding peer_id limits to the conversation between the two, and
+        date_from/date_to bound the timestamp (Moscow time).
+
+        Only the newest SEARCH_CANDIDATE_WINDOW matches are ranked, so a
+        common word costs the same on a million rows as on a thousand.
+        """
+        expression = build_match_expression(query)
+        if not expression:
+            return []
+        
+        conditions = [match_clause(expression)]
+        scope = None
+        if user_id and peer_id:
+            scope = or_(
+                and_(MessageModel.sender_id == user_id, MessageModel.recipient_id == peer_id),
+                and_(MessageModel.sender_id == peer_id, MessageModel.recipient_id == user_id)
+            )
+        elif user_id:
+            scope = or_(MessageModel.sender_id == user_id, MessageModel.recipient_id == user_id)
+        if scope is not None:
+            # Bound the index scan to the scope's id range; a quiet user
+            # otherwise costs a walk over every match in the table
+            bounds = (await session.execute(
+                select(func.min(MessageModel.id), func.max(MessageModel.id)).where(scope)
+            )).one()
+            if bounds[0] is None:
+                return []
+            conditions.append(messages_fts.c.rowid.between(bounds[0], bounds[1]))
+            conditions.append(scope)
+        if date_from is not None:
+            conditions.append(MessageModel.timestamp >= datetime_to_ms(date_from))
+        if date_to is not None:
+            conditions.append(MessageModel.timestamp <= datetime_to_ms(date_to))
+        if not include_archived:
+            conditions.append(MessageModel.is_archived == False)
+        
+        # Newest matches first is the index's natural order, so the window
+        # stops the scan early; bm25 rank is only computed inside it
+        candidates = select(
+            messages_fts.c.rowid.label("id"),
+            messages_fts.c.rank.label("rank")
+        ).select_from(messages_fts).join(
+            MessageModel, MessageModel.id == messages_fts.c.rowid
+        ).where(and_(*conditions)).order_by(desc(messages_fts.c.rowid)).limit(SEARCH_CANDIDATE_WINDOW).subquery()
+        
+        ranked_query = select(candidates.c.id, candidates.c.rank).order_by(
+            candidates.c.rank
+        ).limit(limit).offset(offset)
+        ranked = (await session.execute(ranked_query)).all()
+        if not ranked:
+            return []
+        
+        ids = [row.id for row in ranked]
+        details_query = select(
+            MessageModel.id,
+            MessageModel.sender_id,
+            MessageModel.recipient_id,
+            MessageModel.content,
+            MessageModel.timestamp,
+            MessageModel.message_type,
+            MessageModel.is_archived
+        ).where(MessageModel.id.in_(ids))
+        details = {row.id: row for row in await session.execute(details_query)}
+        
+        results = []
+        for message_id, rank in ranked:
+            row = details.get(message_id)
+            if row is None:
+                continue
+            results.append({
+                "id": message_id,
+                "sender_id": row.sender_id,
+                "recipient_id": row.recipient_id,
+                "timestamp": ms_to_moscow_iso(row.timestamp),
+                "message_type": row.message_type,
+                "is_archived": row.is_archived,
+                "snippet": make_snippet(row.content, query),
+                "rank": rank
+            })
+        return results
+    
+    @timed(message_manager_seconds.labels("get_user_conversations"))
     async def get_user_conversations(
         self,
         session: AsyncSession,
@@ -205,6 +424,7 @@ class MessageManager:
             logger.error(f"Failed to get user conversations: {e}")
             raise
     
+    @timed(message_manager_seconds.labels("mark_messages_as_read"))
     async def mark_messages_as_read(
         self,
         session: AsyncSession,
@@ -235,6 +455,7 @@ class MessageManager:
             logger.error(f"Failed to mark messages as read: {e}")
             raise
     
+    @timed(message_manager_seconds.labels("get_unread_messages"))
     async def get_unread_messages(
         self,
         session: AsyncSession,
@@ -243,7 +464,7 @@ class MessageManager:
     ) -> List[MessageSchema]:
         """Get all unread messages for a user (excluding archived messages)"""
         try:
-            query = select(MessageModel).where(
+            query = select(*MESSAGE_ROW_COLUMNS).where(
                 and_(
                     MessageModel.recipient_id == user_id,
                     MessageModel.is_read == False,
@@ -252,29 +473,270 @@ class MessageManager:
             ).order_by(MessageModel.timestamp).limit(limit)
             
             result = await session.execute(query)
-            messages = result.scalars().all()
-            
-            # Convert to schemas
-            message_schemas = [
-                MessageSchema(
-                    id=msg.id,
-                    sender_id=msg.sender_id,
-                    recipient_id=msg.recipient_id,
-                    content=msg.content,
-                    timestamp=msg.timestamp,
-                    is_read=msg.is_read,
-                    message_type=msg.message_type,
-                    is_archived=msg.is_archived
-                ) for msg in messages
-            ]
+            messages = [MessageSchema(**dict(zip(MESSAGE_ROW_FIELDS, row))) for row in result.tuples()]
             
-            logger.info(f"Retrieved {len(message_schemas)} unread non-archived messages for user {user_id}")
-            return message_schemas
+            logger.info(f"Retrieved {len(messages)} unread non-archived messages for user {user_id}")
+            return messages
             
         except Exception as e:
             logger.error(f"Failed to get unread messages: {e}")
             raise
 
+    @timed(message_manager_seconds.labels("get_delivery_cursor"))
+    async def get_delivery_cursor(
+        self,
+        session: AsyncSession,
+        user_id: str
+    ) -> int:
+        """Get the last acknowledged message id for a user.
+
+        Users without a stored cursor are bootstrapped from the legacy is_read
+        flag, so messages that were unread before cursors existed still replay.
+        """
+        query = select(DeliveryCursorModel.last_message_id).where(
+            DeliveryCursorModel.user_login == user_id
+        )
+        result = await session.execute(query)
+        cursor = result.scalar_one_or_none()
+        if cursor is not None:
+            return cursor
+
+        unread_query = select(func.min(MessageModel.id)).where(
+            and_(
+                MessageModel.recipient_id == user_id,
+                MessageModel.is_read == False,
+                MessageModel.is_archived == False
+            )
+        )
+        first_unread = (await session.execute(unread_query)).scalar()
+        if first_unread is not None:
+            cursor = first_unread - 1
+        else:
+            last_query = select(func.max(MessageModel.id)).where(MessageModel.recipient_id == user_id)
+            cursor = (await session.execute(last_query)).scalar() or 0
+
+        await self.advance_delivery_cursor(session, user_id, cursor)
+        logger.info(f"Bootstrapped delivery cursor for {user_id} at {cursor}")
+        return cursor
+
+    @timed(message_manager_seconds.labels("advance_delivery_cursor"))
+    async def advance_delivery_cursor(
+        self,
+        session: AsyncSession,
+        user_id: str,
+        message_id: int
+    ) -> None:
+        """Move a user's delivery cursor forward; older acks are ignored"""
+        try:
+            query = sqlite_insert(DeliveryCursorModel).values(
+                user_login=user_id, last_message_id=message_id
+            )
+            query = query.on_conflict_do_update(
+                index_elements=[DeliveryCursorModel.user_login],
+                set_={"last_message_id": func.max(DeliveryCursorModel.last_message_id, query.excluded.last_message_id)}
+            )
+            await session.execute(query)
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Failed to advance delivery cursor: {e}")
+            raise
+
+    async def iter_messages_after(
+        self,
+        session: AsyncSession,
+        user_id: str,
+        after_id: int,
+        batch_size: int = 200
+    ) -> AsyncIterator[List[tuple]]:
+        """Yield non-archived messages for a user with id > after_id, in id order,
+        as plain tuples in MESSAGE_ROW_FIELDS order.
+
+        Each batch is a range scan over ix_messages_recipient_id_id, so replay
+        cost depends only on how far behind the cursor is.
+        """
+        while True:
+            query = select(*MESSAGE_ROW_COLUMNS).where(
+                and_(
+                    MessageModel.recipient_id == user_id,
+                    MessageModel.id > after_id,
+                    MessageModel.is_archived == False
+                )
+            ).order_by(MessageModel.id).limit(batch_size)
+
+            result = await session.execute(query)
+            rows = list(result.tuples())
+            if not rows:
+                return
+
+            yield rows
+
+            if len(rows) < batch_size:
+                return
+            after_id = rows[-1][0]
+    
+    @timed(message_manager_seconds.labels("save_broadcast"))
+    async def save_broadcast(
+        self,
+        session: AsyncSession,
+        sender_id: str,
+        content: str,
+        address: Optional[str] = None,
+        flat_from: Optional[int] = None,
+        flat_to: Optional[int] = None,
+        client_msg_id: Optional[str] = None
+    ) -> Optional[BroadcastModel]:
+        """Append a broadcast to the log.
+
+        Returns None if a broadcast with the same client id was stored
+        concurrently; look it up with find_client_broadcast.
+        """
+        try:
+            broadcast = BroadcastModel(
+                sender_id=sender_id,
+                content=content,
+                timestamp=now_ms(),
+                address=address,
+                flat_from=flat_from,
+                flat_to=flat_to,
+                client_msg_id=client_msg_id
+            )
+            session.add(broadcast)
+            await session.commit()
+            await session.refresh(broadcast)
+            tracer.mark("persist")
+            
+            if client_msg_id:
+                self.recent_client_broadcasts.remember(sender_id, client_msg_id, broadcast.id)
+            logger.info(f"Broadcast {broadcast.id} saved from {sender_id} (address: {address})")
+            activity_feed.record_broadcast(broadcast)
+            return broadcast
+            
+        except IntegrityError:
+            await session.rollback()
+            return None
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Failed to save broadcast: {e}")
+            raise
+    
+    @timed(message_manager_seconds.labels("find_client_broadcast"))
+    async def find_client_broadcast(
+        self,
+        session: AsyncSession,
+        sender_id: str,
+        client_msg_id: str
+    ) -> Optional[int]:
+        """Get the id of a broadcast already stored under a client id"""
+        broadcast_id = self.recent_client_broadcasts.get(sender_id, client_msg_id)
+        if broadcast_id is not None:
+            return broadcast_id
+        
+        query = select(BroadcastModel.id).where(
+            and_(
+                BroadcastModel.sender_id == sender_id,
+                BroadcastModel.client_msg_id == client_msg_id
+            )
+        )
+        broadcast_id = (await session.execute(query)).scalar()
+        if broadcast_id is not None:
+            self.recent_client_broadcasts.remember(sender_id, client_msg_id, broadcast_id)
+        return broadcast_id
+    
+    @timed(message_manager_seconds.labels("get_broadcast_watermark"))
+    async def get_broadcast_watermark(
+        self,
+        session: AsyncSession,
+        user_id: str
+    ) -> int:
+        """Get the last acknowledged broadcast id for a user.
+
+        Users without a watermark start BROADCAST_REPLAY_WINDOW_DAYS back, so
+        a first connect shows recent announcements without the whole log.
+        """
+        query = select(DeliveryCursorModel.last_broadcast_id).where(
+            DeliveryCursorModel.user_login == user_id
+        )
+        row = (await session.execute(query)).first()
+        if row is not None and row[0] is not None:
+            return row[0]
+        
+        if row is None:
+            # The watermark lives on the delivery cursor row; create it first
+            await self.get_delivery_cursor(session, user_id)
+        
+        since = now_ms() - BROADCAST_REPLAY_WINDOW_DAYS * 24 * 3600 * 1000
+        first_recent = (await session.execute(
+            select(func.min(BroadcastModel.id)).where(BroadcastModel.timestamp >= since)
+        )).scalar()
+        if first_recent is not None:
+            watermark = first_recent - 1
+        else:
+            watermark = (await session.execute(select(func.max(BroadcastModel.id)))).scalar() or 0
+        
+        await self.advance_broadcast_watermark(session, user_id, watermark)
+        logger.info(f"Bootstrapped broadcast watermark for {user_id} at {watermark}")
+        return watermark
+    
+    @timed(message_manager_seconds.labels("advance_broadcast_watermark"))
+    async def advance_broadcast_watermark(
+        self,
+        session: AsyncSession,
+        user_id: str,
+        broadcast_id: int
+    ) -> None:
+        """Move a user's broadcast watermark forward; older acks are ignored"""
+        try:
+            from sqlalchemy import update
+            
+            query = update(DeliveryCursorModel).where(
+                DeliveryCursorModel.user_login == user_id
+            ).values(
+                last_broadcast_id=func.max(func.coalesce(DeliveryCursorModel.last_broadcast_id, 0), broadcast_id)
+            )
+            await session.execute(query)
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Failed to advance broadcast watermark: {e}")
+            raise
+    
+    async def iter_broadcasts_after(
+        self,
+        session: AsyncSession,
+        after_id: int,
+        address: Optional[str] = None,
+        flat: Optional[int] = None,
+        batch_size: int = 200
+    ) -> AsyncIterator[List[BroadcastModel]]:
+        """Yield broadcasts with id > after_id that reach the given address and flat.
+
+        Each batch is a range scan over the broadcasts primary key; the segment
+        filter only looks at rows in that range, so cost is O(new broadcasts).
+        """
+        segment_match = BroadcastModel.address.is_(None)
+        if address is not None:
+            in_range = [BroadcastModel.address == address]
+            if flat is not None:
+                in_range.append(or_(BroadcastModel.flat_from.is_(None), BroadcastModel.flat_from <= flat))
+                in_range.append(or_(BroadcastModel.flat_to.is_(None), BroadcastModel.flat_to >= flat))
+            segment_match = or_(segment_match, and_(*in_range))
+        
+        while True:
+            query = select(BroadcastModel).where(
+                and_(BroadcastModel.id > after_id, segment_match)
+            ).order_by(BroadcastModel.id).limit(batch_size)
+            
+            broadcasts = (await session.execute(query)).scalars().all()
+            if not broadcasts:
+                return
+            
+            yield broadcasts
+            if len(broadcasts) < batch_size:
+                return
+            after_id = broadcasts[-1].id
+
+    @timed(message_manager_seconds.labels("get_unread_count"))
     async def get_unread_count(
         self,
         session: AsyncSession,
@@ -299,6 +761,7 @@ class MessageManager:
             logger.error(f"Failed to get unread count: {e}")
             return 0
     
+    @timed(message_manager_seconds.labels("delete_conversation"))
     async def delete_conversation(
         self,
         session: AsyncSession,
@@ -320,6 +783,7 @@ class MessageManager:
             await session.commit()
             
             deleted_count = result.rowcount
+            await cold_storage.delete_conversation(session, user_id, other_user_id)
             logger.info(f"Deleted {deleted_count} messages from conversation {user_id} <-> {other_user_id}")
             return deleted_count
             
@@ -333,34 +797,14 @@ class MessageManager:
         session: AsyncSession,
         limit: int = 20
     ) -> List[Dict[str, Any]]:
-        """Get recent messages across all conversations (admin only)"""
-        try:
-            query = select(MessageModel, UserModel).join(
-                UserModel, MessageModel.sender_id == UserModel.login
-            ).order_by(desc(MessageModel.timestamp)).limit(limit)
-            
-            result = await session.execute(query)
-            rows = result.fetchall()
-            
-            messages = []
-            for message, user in rows:
-                messages.append({
-                    "id": message.id,
-                    "sender_id": message.sender_id,
-                    "sender_name": f"{user.first_name} {user.last_name}",
-                    "recipient_id": message.recipient_id,
-                    "content": message.content,
-                    "timestamp": message.timestamp,
-                    "message_type": message.message_type,
-                    "is_read": message.is_read
-                })
-            
-            logger.info(f"Retrieved {len(messages)} recent messages")
-            return messages
-            
-        except Exception as e:
-            logger.error(f"Failed to get recent messages: {e}")
-            raise
+        """Get recent messages across all conversations (admin only).
+
+        Served from the in-memory activity feed; the session is unused and
+        kept for callers of the old signature.
+        """
+        messages = activity_feed.recent(limit)
+        logger.info(f"Retrieved {len(messages)} recent messages")
+        return messages
 
 
 # Global message manager instance
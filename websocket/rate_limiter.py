@@ -0,0 +1,124 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# What to do with a frame that exceeds its limit
+DROP = "drop"              # silently ignore the frame
+ERROR = "error"            # ignore it and send an error frame back
+DISCONNECT = "disconnect"  # close the connection
+
+ALL_MESSAGES = "*"
+
+WS_MESSAGE_LIMIT_ACTION = os.getenv("WS_MESSAGE_LIMIT_ACTION", ERROR)
+WS_MESSAGE_FLOOD_ACTION = os.getenv("WS_MESSAGE_FLOOD_ACTION", DISCONNECT)
+
+# message type -> (tokens per second, burst, action). ALL_MESSAGES caps the
+# whole connection; the typed limits cover frames that fan out to every
+# admin or run several queries.
+DEFAULT_LIMITS: Dict[str, Tuple[float, float, str]] = {
+    ALL_MESSAGES: (20.0, 60.0, WS_MESSAGE_FLOOD_ACTION),
+    "user_to_admin": (1.0, 10.0, WS_MESSAGE_LIMIT_ACTION),
+    "admin_to_user": (5.0, 20.0, WS_MESSAGE_LIMIT_ACTION),
+    "message": (1.0, 10.0, WS_MESSAGE_LIMIT_ACTION),
+    "broadcast": (0.2, 3.0, WS_MESSAGE_LIMIT_ACTION),
+    "get_conversations": (0.5, 5.0, WS_MESSAGE_LIMIT_ACTION),
+    "get_conversation_history": (2.0, 10.0, WS_MESSAGE_LIMIT_ACTION),
+    "search_messages": (2.0, 10.0, WS_MESSAGE_LIMIT_ACTION),
+    "subscribe_activity": (0.5, 5.0, WS_MESSAGE_LIMIT_ACTION),
+    "get_recent_activity": (1.0, 5.0, WS_MESSAGE_LIMIT_ACTION),
+    "subscribe_debug": (0.5, 5.0, WS_MESSAGE_LIMIT_ACTION),
+    "get_connected_users": (0.5, 5.0, WS_MESSAGE_LIMIT_ACTION),
+    "mark_as_read": (5.0, 20.0, DROP),
+}
+
+
+class MessageRateExceeded(Exception):
+    """Raised when a connection must be closed for flooding"""
+
+
+class MessageRateLimiter:
+    """Token-bucket limits per connection and per message type.
+
+    State per user is one bucket for the whole connection plus one per
+    limited message type that was actually used, so it is bounded by the
+    size of the limits table. It is kept across reconnects, so closing the
+    socket does not reset a limit, and is dropped once the user has been
+    idle long enough for every bucket to be full again, at which point a
+    fresh set of buckets is the same state.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[float, float, str]]] = None):
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self._buckets: "OrderedDict[str, Dict[str, TokenBucket]]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self.limited_total: Dict[str, int] = {}
+        self.idle_expiry = self._refill_time()
+
+    def _refill_time(self) -> float:
+        """Seconds after which any bucket in the limits table is full again"""
+        return max((burst / rate for rate, burst, _ in self.limits.values() if rate > 0), default=0.0)
+
+    def configure(self, message_type: str, rate: float, burst: float, action: str = ERROR):
+        """Set or replace the limit for a message type"""
+        if action not in (DROP, ERROR, DISCONNECT):
+            raise ValueError(f"Unknown rate limit action: {action}")
+        self.limits[message_type] = (rate, burst, action)
+        self.idle_expiry = self._refill_time()
+
+    def check(self, user_id: str, message_type: str) -> Optional[Tuple[str, float]]:
+        """Account for one frame.
+
+        Returns None if the frame may be processed, otherwise the action to
+        take and the number of seconds until it would be allowed.
+        """
+        now = time.monotonic()
+        self._expire(now)
+        buckets = self._buckets.get(user_id)
+        if buckets is None:
+            buckets = self._buckets[user_id] = {}
+        else:
+            self._buckets.move_to_end(user_id)
+        self._last_used[user_id] = now
+
+        for limit_key in (ALL_MESSAGES, message_type):
+            limit = self.limits.get(limit_key)
+            if limit is None:
+                continue
+            rate, burst, action = limit
+            bucket = buckets.get(limit_key)
+            if bucket is None:
+                bucket = buckets[limit_key] = TokenBucket(rate, burst)
+            wait = bucket.acquire(now=now)
+            if wait:
+                self.limited_total[limit_key] = self.limited_total.get(limit_key, 0) + 1
+                logger.warning(f"Rate limit '{limit_key}' exceeded by {user_id}: {action}")
+                return action, wait
+            if limit_key == message_type:
+                break
+        return None
+
+    def _expire(self, now: float):
+        """Drop users idle for longer than idle_expiry, oldest first"""
+        while self._buckets:
+            user_id = next(iter(self._buckets))
+            if now - self._last_used[user_id] < self.idle_expiry:
+                break
+            self._buckets.popitem(last=False)
+            del self._last_used[user_id]
+
+    def get_stats(self) -> dict:
+        """Number of tracked users and frames limited per limit key"""
+        return {
+            "tracked_users": len(self._buckets),
+            "limited_total": dict(self.limited_total),
+        }
+
+
+# Global message rate limiter instance
+message_limiter = MessageRateLimiter()
@@ -1,22 +1,53 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, HTTPException, Depends
 from fastapi.websockets import WebSocketState
-from typing import Optional
-import json
+from typing import Optional, Union
 import logging
-from datetime import datetime
 
 from websocket.connection_manager import manager
 from websocket.message_manager import message_manager
+from websocket.admission import admission
+from websocket.activity_feed import activity_feed
+from websocket.tracing import tracer
+from websocket.coalescing import coalescer
+from websocket.ephemeral import EPHEMERAL_EVENTS, INVALID, SENT, SHED, ephemeral_throttle
+from websocket.serializers import (
+    conversation_history_frame, conversation_history_message, offline_message_dict, offline_message_frame
+)
+from websocket.codec import (
+    JSON, CodecError, codec_for, decode_frame, negotiate_codec, receive_frame, send_frame
+)
+from websocket.rate_limiter import message_limiter, MessageRateExceeded, DISCONNECT, ERROR
 from database.database import SessionDep, get_session
+from database.profiling import query_profiler
 from authorization.auth import security, verify_jwt_token
+from authorization.cache import user_cache
 from schemas.schemas import UserModel
 from sqlalchemy import select
-from utils.timezone import get_moscow_time_iso
+from utils.loop_monitor import NORMAL, loop_monitor
+from utils.metrics import load_shed, ws_bytes_sent, ws_frames
+from utils.timezone import get_moscow_time_iso, ms_to_moscow_iso, parse_moscow_datetime
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Frame types with their own handler; anything else is a legacy chat
+# message and is rate limited as "message"
+HANDLED_FRAME_TYPES = frozenset({
+    "ephemeral", "user_to_admin", "admin_to_user", "get_conversation_history",
+    "search_messages", "subscribe_activity", "unsubscribe_activity",
+    "get_recent_activity", "subscribe_debug", "unsubscribe_debug",
+    "get_conversations", "mark_as_read", "ack", "get_connected_users",
+    "broadcast", "ping"
+})
+
+# Read-only requests that are refused while the event loop is overloaded;
+# live messages, acks and pings are always handled right away
+DEFERRABLE_FRAME_TYPES = frozenset({
+    "get_conversation_history", "get_conversations", "search_messages",
+    "get_recent_activity", "get_connected_users"
+})
+
 async def get_websocket_user(token: str, session: SessionDep) -> Optional[dict]:
     try:
         payload = verify_jwt_token(token)
@@ -27,6 +58,10 @@ async def get_websocket_user(token: str, session: SessionDep) -> Optional[dict]:
         if not user_id:
             return None
 
+        cached_user = user_cache.get(user_id)
+        if cached_user is not None:
+            return dict(cached_user)
+
         query = select(UserModel).where(UserModel.login == user_id)
         result = await session.execute(query)
         user = result.scalar_one_or_none()
@@ -34,14 +69,18 @@ async def get_websocket_user(token: str, session: SessionDep) -> Optional[dict]:
         if not user:
             return None
         
-        return {
+        user_data = {
             "login": user.login,
             "first_name": user.first_name,
             "last_name": user.last_name,
             "patronymic": user.patronymic,
             "is_admin": user.is_admin,
-            "id": user.id
+            "id": user.id,
+            "address": user.address,
+            "flat": user.flat
         }
+        user_cache.put_user(user_id, user_data)
+        return dict(user_data)
         
     except Exception as e:
         logger.error(f"WebSocket authentication error: {e}")
@@ -51,9 +90,24 @@ async def get_websocket_user(token: str, session: SessionDep) -> Optional[dict]:
 async def websocket_endpoint(
     websocket: WebSocket,
     user_id: str,
-    token: str = Query(..., description="JWT authentication token")
+    token: str = Query(..., description="JWT authentication token"),
+    cursor: Optional[int] = Query(None, description="Last message id received; defaults to the stored delivery cursor"),
+    batch: bool = Query(False, description="Admins only: coalesce stream events into batch frames")
 ):
 
+    # Wire format: ?codec= or an offered subprotocol, JSON text by default
+    codec, subprotocol = negotiate_codec(websocket)
+    websocket.state.codec = codec
+
+    # Admission control: shed reconnect storms before doing any real work
+    client_ip = websocket.client.host if websocket.client else "unknown"
+    retry_after = await admission.admit(client_ip)
+    if retry_after is not None:
+        await admission.reject(websocket, retry_after, subprotocol)
+        return
+    handshake_slot_held = True
+    connected = False
+
     session_gen = get_session()
     session = await session_gen.__anext__()
     
@@ -62,7 +116,15 @@ async def websocket_endpoint(
         if not user_data or user_data["login"] != user_id:
             await websocket.close(code=4001, reason="Authentication failed")
             return
-        await manager.connect(user_id, websocket, user_data)
+        # Per-login limit, charged only for a verified token
+        retry_after = admission.admit_login(user_id)
+        if retry_after is not None:
+            await admission.reject(websocket, retry_after, subprotocol)
+            return
+        await manager.connect(user_id, websocket, user_data, subprotocol)
+        connected = True
+        if batch and user_data["is_admin"]:
+            coalescer.enable(user_id, websocket)
 
         welcome_message = {
             "type": "welcome",
@@ -74,62 +136,16 @@ async def websocket_endpoint(
             },
             "timestamp": get_moscow_time_iso()
         }
-        await websocket.send_text(json.dumps(welcome_message))
+        await send_frame(websocket, welcome_message)
         
-        # Send unread messages to user (both regular users and admins)
+        # Replay everything after the user's delivery cursor. Messages stay
+        # unread until the client marks them, and the cursor only moves when
+        # the client acks, so a socket dying mid-replay loses nothing.
         try:
-            unread_messages = await message_manager.get_unread_messages(session, user_id)
-            if unread_messages:
-                logger.info(f"Sending {len(unread_messages)} unread messages to {user_id}")
-                
-                for message in unread_messages:
-                    # Get sender name from database if not in memory
-                    sender_name = manager._get_user_display_name(message.sender_id)
-                    if sender_name == message.sender_id:  # If no display name found in memory
-                        # Try to get from database
-                        try:
-                            from sqlalchemy import select
-                            from schemas.schemas import UserModel
-                            
-                            user_query = select(UserModel).where(UserModel.login == message.sender_id)
-                            user_result = await session.execute(user_query)
-                            user_db = user_result.scalar_one_or_none()
-                            
-                            if user_db:
-                                sender_name = f"{user_db.first_name} {user_db.last_name}"
-                            
-                        except Exception as db_error:
-                            logger.warning(f"Could not get sender name from DB: {db_error}")
-                            sender_name = message.sender_id
-                    
-                    offline_message = {
-                        "type": "offline_message",
-                        "from": message.sender_id,
-                        "from_name": sender_name,
-                        "message": message.content,
-                        "timestamp": message.timestamp.isoformat(),
-                        "message_type": message.message_type,
-                        "message_id": message.id
-                    }
-                    
-                    await websocket.send_text(json.dumps(offline_message))
-                
-                # Mark all messages as read after sending (more efficient)
-                unique_senders = set(msg.sender_id for msg in unread_messages)
-                for sender_id in unique_senders:
-                    await message_manager.mark_messages_as_read(session, user_id, sender_id)
-                
-                # Send summary
-                summary_message = {
-                    "type": "offline_messages_summary",
-                    "count": len(unread_messages),
-                    "message": f"Вы получили {len(unread_messages)} сообщений, пока были оффлайн",
-                    "timestamp": get_moscow_time_iso()
-                }
-                await websocket.send_text(json.dumps(summary_message))
-                
+            with query_profiler.unit("ws replay"):
+                await replay_pending_messages(websocket, user_id, user_data, session, cursor)
         except Exception as e:
-            logger.error(f"Error sending unread messages to {user_id}: {e}")
+            logger.error(f"Error replaying pending messages to {user_id}: {e}")
             import traceback
             traceback.print_exc()
         
@@ -148,16 +164,28 @@ async def websocket_endpoint(
                 "timestamp": get_moscow_time_iso()
             }
             print(f"[DEBUG] Sending message: {users_message}")
-            await websocket.send_text(json.dumps(users_message))
+            await send_frame(websocket, users_message)
+        
+        # Handshake finished; let the next queued connect in
+        admission.release()
+        handshake_slot_held = False
         
         # Main message loop
         while True:
             try:
-                data = await websocket.receive_text()
-                await handle_websocket_message(websocket, user_id, user_data, data, session)
+                # Hand the pooled connection back while waiting for the
+                # client; the session checks one out again on its next query
+                await session.close()
+                data = await receive_frame(websocket)
+                with query_profiler.unit("ws message"), tracer.trace(user_id):
+                    await handle_websocket_message(websocket, user_id, user_data, data, session)
                 
             except WebSocketDisconnect:
                 break
+            except MessageRateExceeded:
+                logger.warning(f"Closing connection of {user_id}: message rate exceeded")
+                await websocket.close(code=1008, reason="Message rate exceeded")
+                break
             except Exception as e:
                 logger.error(f"Error handling message from {user_id}: {e}")
                 error_message = {
@@ -166,7 +194,7 @@ async def websocket_endpoint(
                     "timestamp": get_moscow_time_iso()
                 }
                 try:
-                    await websocket.send_text(json.dumps(error_message))
+                    await send_frame(websocket, error_message)
                 except:
                     break
     
@@ -175,45 +203,177 @@ async def websocket_endpoint(
     
     finally:
         # Cleanup
-        manager.disconnect(user_id)
+        if handshake_slot_held:
+            admission.release()
+        # A connect that never got past authentication must not touch the
+        # state of the user it claimed to be. Rate limit state outlives the
+        # connection: message limits expire by idle time, ephemeral ones by LRU
+        if connected:
+            activity_feed.unsubscribe(user_id)
+            tracer.unsubscribe(user_id)
+            manager.disconnect(user_id)
         try:
             await session.close()
         except:
             pass
 
+async def resolve_sender_name(session: SessionDep, sender_id: str, sender_names: dict) -> str:
+    """Get a sender's display name, from memory or the database, caching it in sender_names"""
+    sender_name = sender_names.get(sender_id)
+    if sender_name is None:
+        sender_name = manager._get_user_display_name(sender_id)
+        if sender_name == sender_id:  # If no display name found in memory
+            try:
+                user_query = select(UserModel).where(UserModel.login == sender_id)
+                user_result = await session.execute(user_query)
+                user_db = user_result.scalar_one_or_none()
+                if user_db:
+                    sender_name = f"{user_db.first_name} {user_db.last_name}"
+            except Exception as db_error:
+                logger.warning(f"Could not get sender name from DB: {db_error}")
+        sender_names[sender_id] = sender_name
+    return sender_name
+
+async def replay_pending_messages(
+    websocket: WebSocket,
+    user_id: str,
+    user_data: dict,
+    session: SessionDep,
+    cursor: Optional[int] = None
+) -> int:
+    """Stream messages after the delivery cursor, then broadcasts after the
+    broadcast watermark, to a freshly connected user"""
+    if cursor is None:
+        cursor = await message_manager.get_delivery_cursor(session, user_id)
+    
+    sender_names = {}
+    count = 0
+    last_id = cursor
+    # Rows are written straight to JSON, without per-message models or dicts
+    write_json = codec_for(websocket).name == JSON
+    async for batch in message_manager.iter_messages_after(session, user_id, cursor):
+        for row in batch:
+            sender_name = await resolve_sender_name(session, row[1], sender_names)
+            if write_json:
+                frame = offline_message_frame(row, sender_name)
+                await websocket.send_text(frame)
+                ws_bytes_sent.labels(JSON).inc(len(frame))
+            else:
+                await send_frame(websocket, offline_message_dict(row, sender_name))
+            count += 1
+            last_id = row[0]
+    
+    broadcast_count = 0
+    broadcast_cursor = None
+    if not user_data["is_admin"]:
+        broadcast_cursor = await message_manager.get_broadcast_watermark(session, user_id)
+        async for batch in message_manager.iter_broadcasts_after(
+            session, broadcast_cursor, user_data.get("address"), user_data.get("flat")
+        ):
+            for broadcast in batch:
+                offline_broadcast = {
+                    "type": "offline_message",
+                    "from": broadcast.sender_id,
+                    "from_name": await resolve_sender_name(session, broadcast.sender_id, sender_names),
+                    "message": broadcast.content,
+                    "timestamp": ms_to_moscow_iso(broadcast.timestamp),
+                    "message_type": "broadcast",
+                    "broadcast_id": broadcast.id
+                }
+                await send_frame(websocket, offline_broadcast)
+                broadcast_count += 1
+                broadcast_cursor = broadcast.id
+    
+    if count or broadcast_count:
+        logger.info(
+            f"Replayed {count} messages after cursor {cursor} and "
+            f"{broadcast_count} broadcasts to {user_id}"
+        )
+        count += broadcast_count
+        summary_message = {
+            "type": "offline_messages_summary",
+            "count": count,
+            "cursor": last_id,
+            "broadcast_cursor": broadcast_cursor,
+            "message": f"Вы получили {count} сообщений, пока были оффлайн",
+            "timestamp": get_moscow_time_iso()
+        }
+        await send_frame(websocket, summary_message)
+    return count
+
 async def handle_websocket_message(
     websocket: WebSocket,
     user_id: str,
     user_data: dict,
-    data: str,
+    data: Union[str, bytes],
     session: SessionDep
 ):
-    """Handle incoming WebSocket messages"""
+    """Handle incoming WebSocket messages.
+
+    Text frames are JSON and binary frames use the compact codec; plain text
+    that is not JSON is still accepted as a chat message.
+    """
     
     try:
-        message_data = json.loads(data)
+        message_data = decode_frame(data)
         message_type = message_data.get("type", "message")
+        ws_frames.labels(message_type if isinstance(message_type, str) else "invalid").inc()
+        query_profiler.rename_unit(f"ws {message_type}")
+        tracer.parsed(message_type if isinstance(message_type, str) else "invalid")
+        
+        # Charged once per frame, before dispatch
+        handled = isinstance(message_type, str) and message_type in HANDLED_FRAME_TYPES
+        if not await enforce_rate_limit(websocket, user_id, message_type if handled else "message"):
+            return
+        
+        if message_type in DEFERRABLE_FRAME_TYPES and not await refuse_if_overloaded(websocket, message_type):
+            return
         
-        if message_type == "user_to_admin":
-            await handle_user_to_admin_message(user_id, user_data, message_data, session)
+        if message_type == "ephemeral":
+            await handle_ephemeral(user_id, user_data, message_data)
+            
+        elif message_type == "user_to_admin":
+            await handle_user_to_admin_message(websocket, user_id, user_data, message_data, session)
             
         elif message_type == "admin_to_user":
-            await handle_admin_to_user_message(user_id, user_data, message_data, session)
+            await handle_admin_to_user_message(websocket, user_id, user_data, message_data, session)
             
         elif message_type == "get_conversation_history":
             await handle_get_conversation_history(websocket, user_id, user_data, message_data, session)
             
+        elif message_type == "search_messages":
+            await handle_search_messages(websocket, user_id, user_data, message_data, session)
+            
+        elif message_type == "subscribe_activity":
+            await handle_subscribe_activity(websocket, user_id, user_data, message_data)
+            
+        elif message_type == "unsubscribe_activity":
+            activity_feed.unsubscribe(user_id)
+            
+        elif message_type == "get_recent_activity":
+            await handle_get_recent_activity(websocket, user_data, message_data)
+            
+        elif message_type == "subscribe_debug":
+            if user_data["is_admin"]:
+                tracer.subscribe(user_id)
+            
+        elif message_type == "unsubscribe_debug":
+            tracer.unsubscribe(user_id)
+            
         elif message_type == "get_conversations":
             await handle_get_conversations(websocket, user_id, user_data, session)
             
         elif message_type == "mark_as_read":
             await handle_mark_as_read(user_id, message_data, session)
             
+        elif message_type == "ack":
+            await handle_ack(user_id, message_data, session)
+            
         elif message_type == "get_connected_users":
             await handle_get_connected_users(websocket, user_id, user_data)
             
         elif message_type == "broadcast":
-            await handle_broadcast_message(user_id, user_data, message_data, session)
+            await handle_broadcast_message(websocket, user_id, user_data, message_data, session)
             
         elif message_type == "ping":
             # Heartbeat/ping response
@@ -221,7 +381,11 @@ async def handle_websocket_message(
                 "type": "pong",
                 "timestamp": get_moscow_time_iso()
             }
-            await websocket.send_text(json.dumps(pong_message))
+            await send_frame(websocket, pong_message)
+            
+        elif isinstance(data, bytes):
+            # Compact frames have no plain-text fallback
+            logger.debug(f"Ignoring binary frame of unknown type {message_type!r} from {user_id}")
             
         else:
             # Handle simple text messages (backward compatibility)
@@ -233,19 +397,107 @@ async def handle_websocket_message(
                 await manager.send_to_admin(data, user_id, session)
                 # Message is now saved inside send_to_admin if needed
     
-    except json.JSONDecodeError:
+    except CodecError as e:
+        if isinstance(data, bytes):
+            logger.warning(f"Undecodable binary frame from {user_id}: {e}")
+            ws_frames.labels("invalid").inc()
+            if not await enforce_rate_limit(websocket, user_id, "invalid"):
+                return
+            await send_frame(websocket, {
+                "type": "error",
+                "code": "invalid_frame",
+                "message": "Не удалось разобрать сообщение",
+                "timestamp": get_moscow_time_iso()
+            })
+            return
         # Handle non-JSON messages
+        ws_frames.labels("text").inc()
+        tracer.parsed("text")
+        if not await enforce_rate_limit(websocket, user_id, "message"):
+            return
         if user_data["is_admin"]:
             await manager.broadcast(data, user_id, exclude_admins=True)
         else:
             await manager.send_to_admin(data, user_id, session)
             # Message is now saved inside send_to_admin if needed
     
+    except MessageRateExceeded:
+        raise
+    
     except Exception as e:
         logger.error(f"Error handling message type {message_type}: {e}")
         raise
 
+async def enforce_rate_limit(
+    websocket: WebSocket,
+    user_id: str,
+    message_type: str
+) -> bool:
+    """Apply inbound rate limits; returns False if the frame must be skipped"""
+    verdict = message_limiter.check(user_id, message_type)
+    if verdict is None:
+        return True
+    
+    action, retry_after = verdict
+    if action == DISCONNECT:
+        raise MessageRateExceeded(message_type)
+    if action == ERROR:
+        error_message = {
+            "type": "error",
+            "code": "rate_limited",
+            "message": "Слишком много запросов, попробуйте позже",
+            "message_type": message_type,
+            "retry_after_ms": int(retry_after * 1000),
+            "timestamp": get_moscow_time_iso()
+        }
+        await send_frame(websocket, error_message)
+    return False
+
+async def refuse_if_overloaded(websocket: WebSocket, message_type: str) -> bool:
+    """Answer an expensive request "busy" while the loop lags; returns False if it was refused.
+
+    Unlike the HTTP endpoints this does not wait for capacity: the receive
+    loop would stop reading the connection's live frames in the meantime.
+    """
+    if loop_monitor.has_capacity("ws_request"):
+        return True
+    busy_message = {
+        "type": "error",
+        "code": "overloaded",
+        "message": "Сервер перегружен, попробуйте позже",
+        "message_type": message_type,
+        "retry_after_ms": int(loop_monitor.retry_after() * 1000),
+        "timestamp": get_moscow_time_iso()
+    }
+    await send_frame(websocket, busy_message)
+    return False
+
+def get_client_msg_id(message_data: dict) -> Optional[str]:
+    """Extract an optional client-generated message id used to deduplicate retries"""
+    client_msg_id = message_data.get("client_msg_id")
+    if not isinstance(client_msg_id, str) or not client_msg_id or len(client_msg_id) > 64:
+        return None
+    return client_msg_id
+
+async def send_message_ack(
+    websocket: WebSocket,
+    client_msg_id: str,
+    message_id: int,
+    duplicate: bool = False
+):
+    """Echo the canonical server id for a client message id back to the sender"""
+    ack_message = {
+        "type": "message_ack",
+        "client_msg_id": client_msg_id,
+        "message_id": message_id,
+        "duplicate": duplicate,
+        "trace_id": tracer.current_trace_id(),
+        "timestamp": get_moscow_time_iso()
+    }
+    await send_frame(websocket, ack_message)
+
 async def handle_user_to_admin_message(
+    websocket: WebSocket,
     user_id: str,
     user_data: dict,
     message_data: dict,
@@ -256,12 +508,23 @@ async def handle_user_to_admin_message(
     if not message:
         return
     
+    client_msg_id = get_client_msg_id(message_data)
+    if client_msg_id:
+        existing_id = await message_manager.find_client_message(session, user_id, client_msg_id)
+        if existing_id is not None:
+            await send_message_ack(websocket, client_msg_id, existing_id, duplicate=True)
+            return
+    
     # Send to all connected admins
-    await manager.send_to_admin(message, user_id, session)
+    message_id, duplicate = await manager.send_to_admin(message, user_id, session, client_msg_id)
     
     # Message is now saved inside send_to_admin if needed
+    if client_msg_id and message_id is not None:
+        message_manager.remember_client_message(user_id, client_msg_id, message_id)
+        await send_message_ack(websocket, client_msg_id, message_id, duplicate=duplicate)
 
 async def handle_admin_to_user_message(
+    websocket: WebSocket,
     user_id: str,
     user_data: dict,
     message_data: dict,
@@ -277,10 +540,20 @@ async def handle_admin_to_user_message(
     if not target_user or not message:
         return
     
+    client_msg_id = get_client_msg_id(message_data)
+    if client_msg_id:
+        existing_id = await message_manager.find_client_message(session, user_id, client_msg_id)
+        if existing_id is not None:
+            await send_message_ack(websocket, client_msg_id, existing_id, duplicate=True)
+            return
+    
     # Send to target user
-    success = await manager.send_to_user(message, target_user, user_id, session)
+    message_id, duplicate = await manager.send_to_user(message, target_user, user_id, session, client_msg_id)
     
     # Message is now saved inside send_to_user if needed
+    if client_msg_id and message_id is not None:
+        message_manager.remember_client_message(user_id, client_msg_id, message_id)
+        await send_message_ack(websocket, client_msg_id, message_id, duplicate=duplicate)
 
 async def handle_get_conversation_history(
     websocket: WebSocket,
@@ -304,27 +577,120 @@ async def handle_get_conversation_history(
     # For admins, always include archived messages to show full context
     include_archived = user_data.get("is_admin", False)
     
-    messages = await message_manager.get_conversation_history(
+    rows = await message_manager.get_conversation_history_rows(
         session, user_id, with_user, limit, offset, include_archived
     )
     
-    # Convert messages to JSON-serializable format
-    serialized_messages = []
-    for msg in messages:
-        msg_dict = msg.dict()
-        # Convert datetime to ISO string
-        if isinstance(msg_dict.get('timestamp'), datetime):
-            msg_dict['timestamp'] = msg_dict['timestamp'].isoformat()
-        serialized_messages.append(msg_dict)
+    if codec_for(websocket).name == JSON:
+        # Rows are written straight to JSON, without per-message models or dicts
+        frame = conversation_history_frame(with_user, rows)
+        await websocket.send_text(frame)
+        ws_bytes_sent.labels(JSON).inc(len(frame))
+    else:
+        await send_frame(websocket, conversation_history_message(with_user, rows))
+
+async def handle_ephemeral(user_id: str, user_data: dict, message_data: dict):
+    """Relay a typing or viewing signal to the conversation; never stored.
+
+    Tenants signal the admins; admins name the tenant in to_user. Signals
+    are dropped silently when throttled or while the event loop lags.
+    """
+    event = message_data.get("event")
+    to_user = message_data.get("to_user")
+    if event not in EPHEMERAL_EVENTS or (user_data["is_admin"] and not (isinstance(to_user, str) and to_user)):
+        ephemeral_throttle.count(INVALID)
+        return
+    
+    if loop_monitor.level != NORMAL:
+        load_shed.labels("ephemeral_dropped").inc()
+        ephemeral_throttle.count(SHED)
+        return
+    
+    conversation_id = to_user if user_data["is_admin"] else user_id
+    if not ephemeral_throttle.allow(user_id, conversation_id):
+        return
+    
+    await manager.send_ephemeral(user_id, event, to_user if user_data["is_admin"] else None)
+    ephemeral_throttle.count(SENT)
+
+async def handle_subscribe_activity(
+    websocket: WebSocket,
+    user_id: str,
+    user_data: dict,
+    message_data: dict
+):
+    """Subscribe an admin to live activity and send the current snapshot"""
+    if not user_data["is_admin"]:
+        return
+    
+    activity_feed.subscribe(user_id)
+    await handle_get_recent_activity(websocket, user_data, message_data)
+
+async def handle_get_recent_activity(
+    websocket: WebSocket,
+    user_data: dict,
+    message_data: dict
+):
+    """Send the latest messages from the activity feed (admin only)"""
+    if not user_data["is_admin"]:
+        return
+    
+    try:
+        limit = max(int(message_data.get("limit", 50)), 1)
+    except (TypeError, ValueError):
+        limit = 50
     
     response = {
-        "type": "conversation_history",
-        "with_user": with_user,
-        "messages": serialized_messages,
+        "type": "recent_activity",
+        "events": activity_feed.recent(limit),
         "timestamp": get_moscow_time_iso()
     }
+    await send_frame(websocket, response)
+
+SEARCH_MAX_LIMIT = 100
+
+async def handle_search_messages(
+    websocket: WebSocket,
+    user_id: str,
+    user_data: dict,
+    message_data: dict,
+    session: SessionDep
+):
+    """Handle full-text message search (admin only)"""
+    if not user_data["is_admin"]:
+        return
+    
+    query = message_data.get("query", "")
+    try:
+        limit = min(max(int(message_data.get("limit", 20)), 1), SEARCH_MAX_LIMIT)
+        offset = max(int(message_data.get("offset", 0)), 0)
+        date_from = parse_moscow_datetime(message_data["date_from"]) if message_data.get("date_from") else None
+        date_to = parse_moscow_datetime(message_data["date_to"]) if message_data.get("date_to") else None
+    except (TypeError, ValueError):
+        await send_frame(websocket, {
+            "type": "error",
+            "message": "Invalid search parameters"
+        })
+        return
     
-    await websocket.send_text(json.dumps(response))
+    results = await message_manager.search_messages(
+        session, query,
+        user_id=message_data.get("user") or None,
+        peer_id=message_data.get("peer") or None,
+        date_from=date_from,
+        date_to=date_to,
+        limit=limit,
+        offset=offset
+    )
+    
+    response = {
+        "type": "search_results",
+        "query": query,
+        "results": results,
+        "offset": offset,
+        "timestamp": get_moscow_time_iso()
+    }
+    await send_frame(websocket, response)
 
 async def handle_get_conversations(
     websocket: WebSocket,
@@ -341,9 +707,7 @@ async def handle_get_conversations(
     serialized_conversations = []
     for conv in conversations:
         conv_dict = conv.dict()
-        # Convert datetime to ISO string
-        if isinstance(conv_dict.get('last_message_time'), datetime):
-            conv_dict['last_message_time'] = conv_dict['last_message_time'].isoformat()
+        conv_dict['last_message_time'] = ms_to_moscow_iso(conv_dict['last_message_time'])
         serialized_conversations.append(conv_dict)
     
     response = {
@@ -352,7 +716,7 @@ async def handle_get_conversations(
         "timestamp": get_moscow_time_iso()
     }
     
-    await websocket.send_text(json.dumps(response))
+    await send_frame(websocket, response)
 
 async def handle_mark_as_read(
     user_id: str,
@@ -366,6 +730,20 @@ async def handle_mark_as_read(
     
     await message_manager.mark_messages_as_read(session, user_id, sender_id)
 
+async def handle_ack(
+    user_id: str,
+    message_data: dict,
+    session: SessionDep
+):
+    """Handle delivery acknowledgement: advance the user's cursor or broadcast watermark"""
+    message_id = message_data.get("message_id")
+    if isinstance(message_id, int) and message_id > 0:
+        await message_manager.advance_delivery_cursor(session, user_id, message_id)
+    
+    broadcast_id = message_data.get("broadcast_id")
+    if isinstance(broadcast_id, int) and broadcast_id > 0:
+        await message_manager.advance_broadcast_watermark(session, user_id, broadcast_id)
+
 async def handle_get_connected_users(
     websocket: WebSocket,
     user_id: str,
@@ -383,9 +761,17 @@ async def handle_get_connected_users(
         "timestamp": get_moscow_time_iso()
     }
     
-    await websocket.send_text(json.dumps(response))
+    await send_frame(websocket, response)
+
+def parse_optional_int(value) -> Optional[int]:
+    """Parse an optional integer field from a client frame"""
+    if value is None or value == "":
+        return None
+    return int(value)
+
 
 async def handle_broadcast_message(
+    websocket: WebSocket,
     user_id: str,
     user_data: dict,
     message_data: dict,
@@ -399,11 +785,39 @@ async def handle_broadcast_message(
     if not message:
         return
     
-    # Send broadcast
-    sent_count = await manager.broadcast(message, user_id, exclude_admins=True)
+    client_msg_id = get_client_msg_id(message_data)
+    if client_msg_id:
+        existing_id = await message_manager.find_client_broadcast(session, user_id, client_msg_id)
+        if existing_id is not None:
+            await send_message_ack(websocket, client_msg_id, existing_id, duplicate=True)
+            return
+    
+    address = message_data.get("address") or None
+    try:
+        flat_from = parse_optional_int(message_data.get("flat_from"))
+        flat_to = parse_optional_int(message_data.get("flat_to"))
+    except (TypeError, ValueError):
+        await send_frame(websocket, {
+            "type": "error",
+            "message": "flat_from and flat_to must be integers"
+        })
+        return
+    
+    # Log the broadcast once; offline users pick it up from their watermark
+    saved = await message_manager.save_broadcast(
+        session, user_id, message, address, flat_from, flat_to, client_msg_id
+    )
+    if saved is None:
+        existing_id = await message_manager.find_client_broadcast(session, user_id, client_msg_id)
+        await send_message_ack(websocket, client_msg_id, existing_id, duplicate=True)
+        return
+    
+    sent_count = await manager.broadcast(
+        message, user_id, exclude_admins=True,
+        address=address, flat_from=flat_from, flat_to=flat_to,
+        broadcast_id=saved.id
+    )
+    logger.info(f"Broadcast {saved.id} delivered to {sent_count} online users")
     
-    if sent_count > 0:
-        # Save broadcast message to database (with special recipient "broadcast")
-        await message_manager.save_message(
-            session, user_id, "broadcast", message, "broadcast"
-        )
\ No newline at end of file
+    if client_msg_id:
+        await send_message_ack(websocket, client_msg_id, saved.id)
@@ -0,0 +1,88 @@
+import json
+from json.encoder import encode_basestring_ascii
+from typing import Iterable, Sequence
+
+from schemas.schemas import MESSAGE_ROW_FIELDS
+from utils.timezone import get_moscow_time_iso, ms_to_moscow_iso
+
+
+def message_row_dict(row: Sequence) -> dict:
+    """A projected message row as the dict clients receive"""
+    message = dict(zip(MESSAGE_ROW_FIELDS, row))
+    message["timestamp"] = ms_to_moscow_iso(message["timestamp"])
+    return message
+
+
+def message_row_json(row: Sequence) -> str:
+    """A projected message row written straight to JSON text.
+
+    The output is byte for byte what json.dumps(message_row_dict(row))
+    produces, without building the dict; strings go through the same C
+    escaper json.dumps uses.
+    """
+    message_id, sender_id, recipient_id, content, timestamp, is_read, message_type, is_archived = row
+    return (
+        f'{{"id": {int(message_id)}, '
+        f'"sender_id": {encode_basestring_ascii(sender_id)}, '
+        f'"recipient_id": {encode_basestring_ascii(recipient_id)}, '
+        f'"content": {encode_basestring_ascii(content)}, '
+        f'"timestamp": "{ms_to_moscow_iso(timestamp)}", '
+        f'"is_read": {"true" if is_read else "false"}, '
+        f'"message_type": {encode_basestring_ascii(message_type)}, '
+        f'"is_archived": {"true" if is_archived else "false"}}}'
+    )
+
+
+def message_rows_json(rows: Iterable[Sequence]) -> str:
+    return "[" + ", ".join(map(message_row_json, rows)) + "]"
+
+
+def conversation_history_frame(with_user, rows: Iterable[Sequence]) -> str:
+    """The conversation_history frame for a page of projected rows, as JSON text"""
+    return (
+        f'{{"type": "conversation_history", '
+        f'"with_user": {json.dumps(with_user)}, '
+        f'"messages": {message_rows_json(rows)}, '
+        f'"timestamp": "{get_moscow_time_iso()}"}}'
+    )
+
+
+def conversation_history_message(with_user, rows: Iterable[Sequence]) -> dict:
+    """The conversation_history frame as a dict, for codecs other than JSON"""
+    return {
+        "type": "conversation_history",
+        "with_user": with_user,
+        "messages": [message_row_dict(row) for row in rows],
+        "timestamp": get_moscow_time_iso()
+    }
+
+
+def offline_message_frame(row: Sequence, from_name: str) -> str:
+    """The offline_message frame for a replayed projected row, as JSON text.
+
+    Byte for byte what json.dumps(offline_message_dict(row, from_name)) gives.
+    """
+    message_id, sender_id, _, content, timestamp, _, message_type, _ = row
+    return (
+        f'{{"type": "offline_message", '
+        f'"from": {encode_basestring_ascii(sender_id)}, '
+        f'"from_name": {encode_basestring_ascii(from_name)}, '
+        f'"message": {encode_basestring_ascii(content)}, '
+        f'"timestamp": "{ms_to_moscow_iso(timestamp)}", '
+        f'"message_type": {encode_basestring_ascii(message_type)}, '
+        f'"message_id": {int(message_id)}}}'
+    )
+
+
+def offline_message_dict(row: Sequence, from_name: str) -> dict:
+    """The offline_message frame as a dict, for codecs other than JSON"""
+    message_id, sender_id, _, content, timestamp, _, message_type, _ = row
+    return {
+        "type": "offline_message",
+        "from": sender_id,
+        "from_name": from_name,
+        "message": content,
+        "timestamp": ms_to_moscow_iso(timestamp),
+        "message_type": message_type,
+        "message_id": message_id
+    }
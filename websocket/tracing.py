@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import math
+import os
+import secrets
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import count
+from typing import Deque, Dict, List, Optional, Set
+
+from utils.timezone import coarse_clock, get_moscow_time_iso, ms_to_moscow_iso
+from websocket.codec import Frame, send_frame
+
+logger = logging.getLogger(__name__)
+
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "1000"))
+# Per-recipient send times kept in a trace; beyond this only counts and bounds
+TRACE_MAX_RECIPIENTS = int(os.getenv("TRACE_MAX_RECIPIENTS", "20"))
+DEBUG_STREAM_INTERVAL = float(os.getenv("DEBUG_STREAM_INTERVAL", "2"))
+DEBUG_STREAM_RECENT = 5
+
+# Frames that would only crowd real work out of the buffer
+UNTRACED_FRAME_TYPES = frozenset({"ping", "ephemeral", "ack"})
+
+# Offsets from receive, in the order a frame goes through them
+STAGES = ("parse", "persist", "fanout_start", "first_delivery", "last_delivery", "total")
+PERCENTILES = (50, 90, 99)
+
+
+class MessageTrace:
+    """Timeline of one inbound frame, as offsets in seconds from its receipt"""
+
+    __slots__ = (
+        "trace_id", "user_id", "frame_type", "received_at", "started",
+        "marks", "delivered", "failed", "recipients"
+    )
+
+    def __init__(self, trace_id: str, user_id: str):
+        self.trace_id = trace_id
+        self.user_id = user_id
+        self.frame_type: Optional[str] = None
+        self.received_at = coarse_clock.now_ms()
+        self.started = time.perf_counter()
+        self.marks: Dict[str, float] = {}
+        self.delivered = 0
+        self.failed = 0
+        self.recipients: List[tuple] = []
+
+    def mark(self, stage: str):
+        self.marks[stage] = time.perf_counter() - self.started
+
+    def add_delivery(self, recipient: str, ok: bool):
+        offset = time.perf_counter() - self.started
+        if ok:
+            self.delivered += 1
+            self.marks.setdefault("first_delivery", offset)
+            self.marks["last_delivery"] = offset
+        else:
+            self.failed += 1
+        if len(self.recipients) < TRACE_MAX_RECIPIENTS:
+            self.recipients.append((recipient, offset, ok))
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "user_id": self.user_id,
+            "frame_type": self.frame_type,
+            "received_at": ms_to_moscow_iso(self.received_at),
+            "stages_ms": {stage: round(offset * 1000, 3) for stage, offset in self.marks.items()},
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "recipients": [
+                {"user_id": recipient, "sent_ms": round(offset * 1000, 3), "ok": ok}
+                for recipient, offset, ok in self.recipients
+            ],
+        }
+
+
+def percentile_summary(values: List[float]) -> dict:
+    """Nearest-rank percentiles of offsets in seconds, reported in ms"""
+    if not values:
+        return {}
+    values = sorted(values)
+    summary = {
+        f"p{p}": round(values[max(0, math.ceil(p * len(values) / 100) - 1)] * 1000, 3)
+        for p in PERCENTILES
+    }
+    summary["max"] = round(values[-1] * 1000, 3)
+    return summary
+
+
+_current_trace: ContextVar[Optional[MessageTrace]] = ContextVar("message_trace", default=None)
+
+
+class MessageTracer:
+    """Traces inbound WebSocket frames from receipt to delivery.
+
+    The connection loop opens a trace per frame; storage and fan-out code
+    mark stages on whatever trace is current, so no signatures change.
+    Finished traces go into a ring buffer that backs the percentile
+    summaries and the admin debug stream.
+    """
+
+    def __init__(self, size: int = TRACE_BUFFER_SIZE, interval: float = DEBUG_STREAM_INTERVAL):
+        self.size = size
+        self.interval = interval
+        self._traces: Deque[MessageTrace] = deque(maxlen=size)
+        self._ids = count(1)
+        self._prefix = secrets.token_hex(3)
+        self.subscribers: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    @contextmanager
+    def trace(self, user_id: str):
+        """Trace the frame handled inside the block"""
+        trace = MessageTrace(f"{self._prefix}-{next(self._ids):x}", user_id)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+            trace.mark("total")
+            if trace.frame_type not in UNTRACED_FRAME_TYPES:
+                self._traces.append(trace)
+
+    def parsed(self, frame_type: str):
+        """Mark the current frame as parsed and record its type"""
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.frame_type = frame_type
+            trace.mark("parse")
+
+    def mark(self, stage: str):
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.mark(stage)
+
+    def current(self) -> Optional[MessageTrace]:
+        """The trace of the frame being handled, for work that finishes later"""
+        return _current_trace.get()
+
+    def delivered(self, recipient: str, ok: bool = True):
+        """Record a send to one recipient of the current frame"""
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_delivery(recipient, ok)
+
+    def current_trace_id(self) -> Optional[str]:
+        trace = _current_trace.get()
+        return trace.trace_id if trace is not None else None
+
+    def get(self, trace_id: str) -> Optional[dict]:
+        for trace in self._traces:
+            if trace.trace_id == trace_id:
+                return trace.to_dict()
+        return None
+
+    def recent(
+        self,
+        limit: int = 50,
+        user_id: Optional[str] = None,
+        frame_type: Optional[str] = None
+    ) -> List[dict]:
+        """Newest traces first, optionally for one sender or frame type"""
+        result = []
+        for trace in reversed(self._traces):
+            if user_id is not None and trace.user_id != user_id:
+                continue
+            if frame_type is not None and trace.frame_type != frame_type:
+                continue
+            result.append(trace.to_dict())
+            if len(result) >= limit:
+                break
+        return result
+
+    def summary(self, frame_type: Optional[str] = None) -> dict:
+        """Per frame type stage percentiles over the buffered traces"""
+        offsets: Dict[str, Dict[str, List[float]]] = {}
+        for trace in self._traces:
+            if frame_type is not None and trace.frame_type != frame_type:
+                continue
+            stages = offsets.setdefault(trace.frame_type or "unknown", {})
+            for stage, offset in trace.marks.items():
+                stages.setdefault(stage, []).append(offset)
+        return {
+            name: {
+                "count": len(stages.get("total", ())),
+                "stages_ms": {
+                    stage: percentile_summary(stages[stage]) for stage in STAGES if stage in stages
+                },
+            }
+            for name, stages in offsets.items()
+        }
+
+    def clear(self):
+        self._traces.clear()
+
+    def subscribe(self, user_id: str):
+        """Start pushing debug snapshots to an admin"""
+        self.subscribers.add(user_id)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._stream())
+
+    def unsubscribe(self, user_id: str):
+        self.subscribers.discard(user_id)
+
+    def snapshot(self) -> dict:
+        from websocket.connection_manager import manager
+
+        return {
+            "type": "debug_stats",
+            "connections": {role[0]: n for role, n in manager.count_connections_by_role().items()},
+            "traces": len(self._traces),
+            "summary": self.summary(),
+            "recent": self.recent(DEBUG_STREAM_RECENT),
+            "timestamp": get_moscow_time_iso()
+        }
+
+    async def _stream(self):
+        """Push a snapshot every interval while anyone is subscribed"""
+        from websocket.connection_manager import manager
+
+        while self.subscribers:
+            frame = Frame(self.snapshot())
+            for user_id in list(self.subscribers):
+                websocket = manager.active_connections.get(user_id)
+                if websocket is None:
+                    self.subscribers.discard(user_id)
+                    continue
+                try:
+                    await send_frame(websocket, frame)
+                except Exception as e:
+                    logger.error(f"Failed to push debug stats to {user_id}: {e}")
+                    self.subscribers.discard(user_id)
+            await asyncio.sleep(self.interval)
+
+
+# Global message tracer instance
+tracer = MessageTracer()